@@ -3,6 +3,8 @@ coordinates -- Manipulate and convert coordinates of different types
 
 Notes:
   - Currently, UTM calculations do not handle nonstandard zones.
+  - The functions ending in `_array` accept NumPy arrays (converting 100,000
+    points takes tens of milliseconds, rather than a second in a loop).
 
 Sources:
   - http://www.uwgb.edu/dutchs/usefuldata/utmformulas.htm
@@ -13,13 +15,17 @@ Sources:
 
 from math import (degrees, radians, sin, cos, tan, asin, acos, atan2, sinh,
                   cosh, tanh, asinh, acosh, atanh, sqrt, hypot, ceil, floor)
+import numpy as np
 
 __all__ = [
     'from_utm',
     'to_utm',
+    'from_utm_array',
+    'to_utm_array',
     'from_dms',
     'to_dms',
     'great_circle',
+    'great_circle_array',
     'bounding_box'
 ]
 
@@ -99,12 +105,12 @@ def to_utm(latitude: float, longitude: float) -> (float, float, int, int):
                     coordinates are located in the southern hemisphere.
 
     Raises:
-        OverflowError: The coordinate does not exist.
+        ValueError: The coordinate is in the polar regions.
     """
     if abs(latitude) > 84:
         raise ValueError('Polar regions not covered')
 
-    zone = 1 + floor((longitude + 180)/6)
+    zone = min(1 + floor((longitude + 180)/6), 60)  # 180 is in the last zone
     latitude, longitude = radians(latitude), radians(longitude)
     longitude_ = radians(6*zone - 183)
 
@@ -123,8 +129,92 @@ def to_utm(latitude: float, longitude: float) -> (float, float, int, int):
 
     hemisphere = -1 if latitude < 0 else 1
     northing_ = 10000 if hemisphere < 0 else 0
-    easting = easting_ + k0*A*(eta_ + 0)
-    northing = northing_ + k0*A*(xi_ + 0)
+    easting = easting_ + k0*A*(eta_ + u)
+    northing = northing_ + k0*A*(xi_ + v)
+    return 1000*easting, 1000*northing, zone, hemisphere
+
+
+def from_utm_array(easting: np.ndarray, northing: np.ndarray,
+                   zone: np.ndarray, hemisphere: np.ndarray =1) -> (
+                   np.ndarray, np.ndarray):
+    """
+    Convert arrays of UTM coordinates to decimal latitude and longitude
+    coordinates (see `from_utm`). The arguments are broadcast together.
+
+    Keyword Arguments:
+        easting: The eastings in m.
+        northing: The northings in m.
+        zone: The zones, integers between 1 and 60, inclusive.
+        hemisphere: Signed numbers, where a negative number indicates the
+                    coordinates are located in the southern hemisphere.
+
+    Returns:
+        latitude: The latitudes in decimal degrees.
+        longitude: The longitudes in decimal degrees.
+    """
+    easting = np.asarray(easting, np.float64)/1000
+    northing = np.asarray(northing, np.float64)/1000
+    northing_ = np.where(np.asarray(hemisphere) < 0, 10000, 0)
+
+    xi_ = xi = (northing - northing_)/(k0*A)
+    eta_ = eta = (easting - easting_)/(k0*A)
+    for j in range(1, 4):
+        p, q = 2*j*xi, 2*j*eta
+        xi_ = xi_ - beta[j - 1]*np.sin(p)*np.cosh(q)
+        eta_ = eta_ - beta[j - 1]*np.cos(p)*np.sinh(q)
+
+    chi = np.arcsin(np.sin(xi_)/np.cosh(eta_))
+    latitude = chi + sum(delta[j - 1]*np.sin(2*j*chi) for j in range(1, 4))
+    longitude_ = np.radians(6*np.asarray(zone) - 183)
+    longitude = longitude_ + np.arctan2(np.sinh(eta_), np.cos(xi_))
+    return np.degrees(latitude), np.degrees(longitude)
+
+
+def to_utm_array(latitude: np.ndarray, longitude: np.ndarray) -> (
+                 np.ndarray, np.ndarray, np.ndarray, np.ndarray):
+    """
+    Convert arrays of decimal latitude and longitude coordinates to UTM
+    coordinates (see `to_utm`), with the zone and hemisphere of each point.
+
+    Keyword Arguments:
+        latitude: The latitudes in decimal degrees.
+        longitude: The longitudes in decimal degrees.
+
+    Returns:
+        easting: The eastings in m.
+        northing: The northings in m.
+        zone: The zones, integers between 1 and 60, inclusive.
+        hemisphere: Signed integers, where -1 indicates the coordinates are
+                    located in the southern hemisphere.
+
+    Raises:
+        ValueError: Some coordinates are in the polar regions.
+    """
+    latitude = np.asarray(latitude, np.float64)
+    longitude = np.asarray(longitude, np.float64)
+    if np.any(np.abs(latitude) > 84):
+        raise ValueError('Polar regions not covered')
+
+    zone = np.minimum(1 + np.floor((longitude + 180)/6).astype(np.int64), 60)
+    latitude, longitude = np.radians(latitude), np.radians(longitude)
+    longitude = longitude - np.radians(6*zone - 183)
+
+    p = 2*sqrt(n)/(1 + n)
+    t = np.sinh(np.arctanh(np.sin(latitude))
+                - p*np.arctanh(p*np.sin(latitude)))
+    xi_ = np.arctan2(t, np.cos(longitude))
+    eta_ = np.arctanh(np.sin(longitude)/np.hypot(1, t))
+
+    u, v = np.zeros_like(eta_), np.zeros_like(xi_)
+    for j in range(1, 4):
+        p, q = 2*j*xi_, 2*j*eta_
+        u += alpha[j - 1]*np.cos(p)*np.sinh(q)
+        v += alpha[j - 1]*np.sin(p)*np.cosh(q)
+
+    hemisphere = np.where(latitude < 0, -1, 1)
+    northing_ = np.where(hemisphere < 0, 10000, 0)
+    easting = easting_ + k0*A*(eta_ + u)
+    northing = northing_ + k0*A*(xi_ + v)
     return 1000*easting, 1000*northing, zone, hemisphere
 
 
@@ -181,12 +271,37 @@ def great_circle(latitude1: float, longitude1: float,
     Returns:
         angle: The angle between the two points.
     """
+    # The haversine formula, which stays accurate at short distances
     latitude1, latitude2 = radians(latitude1), radians(latitude2)
-    delta = radians(abs(longitude1 - longitude2))
+    delta = radians(longitude1 - longitude2)
+
+    h = sin((latitude2 - latitude1)/2)**2
+    h += cos(latitude1)*cos(latitude2)*sin(delta/2)**2
+    return degrees(2*asin(min(sqrt(h), 1)))
+
+
+def great_circle_array(latitude1: np.ndarray, longitude1: np.ndarray,
+                       latitude2: np.ndarray, longitude2: np.ndarray) -> (
+                       np.ndarray):
+    """
+    Calculate the angles between arrays of points on the surface of a sphere
+    (see `great_circle`). The arguments are broadcast together.
+
+    Keyword Arguments:
+        latitude1: The latitudes of the first points, in decimal degrees.
+        longitude1: The longitudes of the first points, in decimal degrees.
+        latitude2: The latitudes of the second points, in decimal degrees.
+        longitude2: The longitudes of the second points, in decimal degrees.
+
+    Returns:
+        angle: The angles between the points, in decimal degrees.
+    """
+    latitude1, latitude2 = np.radians(latitude1), np.radians(latitude2)
+    delta = np.radians(np.subtract(longitude1, longitude2))
 
-    p = sin(latitude1)*sin(latitude2)
-    q = cos(latitude1)*cos(latitude2)*cos(delta)
-    return degrees(acos(p + q))
+    h = np.sin((latitude2 - latitude1)/2)**2
+    h += np.cos(latitude1)*np.cos(latitude2)*np.sin(delta/2)**2
+    return np.degrees(2*np.arcsin(np.minimum(np.sqrt(h), 1)))
 
 
 def bounding_box(latitude: float, longitude: float, side: float) -> (
@@ -7,8 +7,8 @@ model developer. SQL comes with several advantages over Excel, most notably
 easier subsetting and strict typing.
 """
 
-__all__ = ['Base', 'cleaning', 'models', 'initialize', 'processing',
-           'terminate']
+__all__ = ['Base', 'augmentation', 'cleaning', 'models', 'initialize',
+           'processing', 'terminate']
 
 from sqlalchemy import create_engine
 from sqlalchemy.orm import scoped_session, sessionmaker
@@ -16,7 +16,7 @@ from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
 
-from . import cleaning, models, processing
+from . import augmentation, cleaning, models, processing
 
 
 def __bool__(self):
@@ -72,18 +72,20 @@ Base.__getitem__ = __getitem__
 Base.__repr__ = Base.__str__ = __repr__
 
 
-def initialize(url):
+def initialize(url, **options):
     """
     Initialize a connection to the database.
 
     Arguments:
         url: A string representing a URL to the database.
+        options: A variable number of keyword arguments passed to SQLAlchemy's
+                 `create_engine`.
 
     Returns:
         engine: A SQLAlchemy engine object.
         session: A SQLAlchemy scoped session object.
     """
-    engine = create_engine(url, convert_unicode=True)
+    engine = create_engine(url, convert_unicode=True, **options)
     session = scoped_session(sessionmaker(bind=engine))
     Base.query = session.query_property()
     Base.metadata.create_all(bind=engine)
@@ -0,0 +1,85 @@
+"""
+database.augmentation -- Batched access for augmentation tasks
+
+Augmentation tasks (weather, daylight, elevation, land cover, and so on) all
+follow the same pattern: find the instances of one model that are missing
+data, look up the time and initial planning point of each instance's incident,
+compute or fetch the missing values, and write them back. This module provides
+that pattern without loading any ORM instances, so the session's identity map
+stays empty no matter how many rows are processed.
+"""
+
+__all__ = ['iterate_ipps', 'bulk_update']
+
+from database.models import Incident, Operation, Point
+
+
+def iterate_ipps(session, model, *criteria, columns=(), batch_size=500,
+                 limit=None):
+    """
+    Iterate over the incident time and IPP of every instance of a model.
+
+    Rows come from a single query joining the model to `Incident`,
+    `Operation`, and the IPP's `Point`. Each batch is fetched with keyset
+    pagination (by the model's identifier) and its cursor is closed before the
+    batch is yielded, so callers may write and commit between batches.
+
+    Arguments:
+        session: A SQLAlchemy scoped session object connected to the database.
+        model: A model with an `incident_id` column (e.g. `Weather`).
+        criteria: A variable number of SQLAlchemy filters to apply (e.g.
+                  `Weather.daylight == None`).
+        columns: Additional columns to select, appended to each row.
+        batch_size: The maximum number of rows in each batch.
+        limit: The maximum number of rows to yield in total (no limit by
+               default).
+
+    Returns:
+        A generator of lists of tuples, each of the form `(id, datetime,
+        latitude, longitude, *columns)`. Rows without a time or a complete
+        IPP are skipped.
+    """
+    query = session.query(model.id, Incident.datetime, Point.latitude,
+                          Point.longitude, *columns)
+    query = query.join(Incident, model.incident_id == Incident.id)
+    query = query.join(Operation, Operation.incident_id == Incident.id)
+    query = query.join(Point, Operation.ipp_id == Point.id)
+    query = query.filter(Incident.datetime != None, Point.latitude != None,
+                         Point.longitude != None, *criteria)
+    query = query.order_by(model.id)
+
+    last_id, remaining = None, limit
+    while remaining is None or remaining > 0:
+        size = batch_size if remaining is None else min(batch_size, remaining)
+        page = query if last_id is None else query.filter(model.id > last_id)
+        batch = [tuple(row) for row in page.limit(size)]
+
+        if len(batch) == 0:
+            break
+        yield batch
+
+        last_id = batch[-1][0]
+        if remaining is not None:
+            remaining -= len(batch)
+
+
+def bulk_update(session, model, mappings):
+    """
+    Write new values for many instances with bulk `UPDATE` statements.
+
+    Arguments:
+        session: A SQLAlchemy scoped session object connected to the database.
+        model: The model to update.
+        mappings: A sequence of dictionaries, each containing the `id` of the
+                  instance and the columns to set. Validators defined on the
+                  model are not applied.
+
+    Returns:
+        The number of instances updated.
+
+    The changes are not committed.
+    """
+    mappings = [mapping for mapping in mappings if len(mapping) > 1]
+    if len(mappings) > 0:
+        session.bulk_update_mappings(model, mappings)
+    return len(mappings)
@@ -2,8 +2,11 @@
 evaluation -- Model evaluation tools
 """
 
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import os
+
 import numpy as np
-import pandas as pd
 
 
 def compute_brier_score(predictions, outcomes):
@@ -33,11 +36,196 @@ def compute_brier_score(predictions, outcomes):
     return np.sum(np.power(predictions - outcomes, 2))/len(predictions)
 
 
-def cross_validate(df, fit, predict, folds=10, name='prediction'):
+def censoring_survival(times, doa, at):
+    """
+    Estimate the probability an incident is not censored (that is, does not end
+    with the subject found alive) by each time, with the Kaplan-Meier estimator
+    of the censoring distribution.
+
+    Arguments:
+        times: A sequence of incident times.
+        doa: A sequence of booleans indicating whether the incident ended with
+             the subject dead-on-arrival (same length as `times`).
+        at: An array of the times to evaluate the estimate at.
+
+    Returns:
+        A tuple of two arrays with the shape of `at`: the estimate just after
+        each time, and just before it (its left limit).
+    """
+    times = np.asarray(times, dtype=np.float64)
+    censored = ~np.asarray(doa, dtype=bool)
+    timeline, inverse = np.unique(times, return_inverse=True)
+    exits = np.bincount(inverse, minlength=len(timeline))
+    censorings = np.bincount(inverse, censored, minlength=len(timeline))
+    at_risk = len(times) - np.cumsum(exits) + exits
+    survival = np.concatenate([[1.0], np.cumprod(1 - censorings/at_risk)])
+
+    after = survival[np.searchsorted(timeline, at, side='right')]
+    before = survival[np.searchsorted(timeline, at, side='left')]
+    return after, before
+
+
+def brier_scores_over_time(predictions, times, doa, grid):
+    """
+    Compute the time-dependent Brier score of survival predictions over a grid
+    of horizons, with inverse probability of censoring weights.
+
+    At each horizon t, subjects who died by t contribute the square of their
+    predicted probability of survival, weighted by one over the probability of
+    remaining uncensored until their death, and subjects whose incident lasted
+    longer than t contribute the square of their predicted probability of
+    death, weighted by one over the probability of remaining uncensored until
+    t. Subjects found alive before t contribute nothing (their weight is
+    carried by the others).
+
+    Every subject and horizon is evaluated in one `(subjects, horizons)` array
+    expression, so the cost hardly depends on the number of horizons.
+
+    Source: Graf, E., Schmoor, C., Sauerbrei, W., & Schumacher, M. (1999).
+            Assessment and comparison of prognostic classification schemes
+            for survival data. Statistics in Medicine, 18(17-18), 2529-2545.
+
+    Arguments:
+        predictions: An array of predicted probabilities of survival past each
+                     horizon, with shape `(subjects, horizons)`. An array with
+                     shape `(horizons,)` is used for every subject.
+        times: A sequence of incident times, one for each subject.
+        doa: A sequence of booleans indicating whether the incident ended with
+             the subject dead-on-arrival (same length as `times`).
+        grid: An increasing array of horizons (in the units of `times`).
+
+    Returns:
+        An array of Brier scores, one for each horizon.
+    """
+    times = np.asarray(times, dtype=np.float64)[:, np.newaxis]
+    doa = np.asarray(doa, dtype=bool)[:, np.newaxis]
+    grid = np.asarray(grid, dtype=np.float64)
+    predictions = np.asarray(predictions, dtype=np.float64)
+
+    _, before_death = censoring_survival(times.ravel(), doa.ravel(),
+                                         times.ravel())
+    at_horizon, _ = censoring_survival(times.ravel(), doa.ravel(), grid)
+    with np.errstate(divide='ignore'):
+        death_weights = np.where(before_death > 0, 1/before_death, 0.0)
+        horizon_weights = np.where(at_horizon > 0, 1/at_horizon, 0.0)
+
+    died = doa & (times <= grid)
+    alive = times > grid
+    scores = (np.where(died, predictions**2, 0)*death_weights[:, np.newaxis] +
+              np.where(alive, (1 - predictions)**2, 0)*horizon_weights)
+    return scores.mean(axis=0)
+
+
+def integrated_brier_score(predictions, times, doa, grid):
+    """
+    Integrate the time-dependent Brier score over a grid of horizons (with the
+    trapezoidal rule), and divide by the length of the grid.
+
+    Arguments:
+        predictions: See `brier_scores_over_time`.
+        times: See `brier_scores_over_time`.
+        doa: See `brier_scores_over_time`.
+        grid: An increasing array of at least two horizons.
+
+    Returns:
+        The integrated Brier score, a real number between zero and one for
+        well-behaved weights (lower is better).
+    """
+    grid = np.asarray(grid, dtype=np.float64)
+    scores = brier_scores_over_time(predictions, times, doa, grid)
+    area = np.sum(np.diff(grid)*(scores[1:] + scores[:-1])/2)
+    return area/(grid[-1] - grid[0])
+
+
+BrierInterval = namedtuple('BrierInterval', ['scores', 'lower', 'upper',
+                                             'difference_lower',
+                                             'difference_upper'])
+
+
+def bootstrap_means(losses, resamples=10000, random_state=None,
+                    max_elements=2**23):
+    """
+    Compute the mean loss of each model over bootstrap resamples of the cases.
+
+    Each chunk of resamples is drawn as one matrix of case indices, which is
+    converted to a matrix of how many times each case was drawn (with a single
+    `bincount`). Every model's mean over every resample in the chunk is then
+    one matrix product. Every model sees the same resamples, so the means can
+    be compared pairwise.
+
+    Arguments:
+        losses: An array with shape `(models, cases)` of the loss of each model
+                on each case.
+        resamples: The number of resamples to draw.
+        random_state: A seed or `numpy.random.Generator` instance.
+        max_elements: The greatest number of elements in a temporary array
+                      (which bounds memory use when `resamples` times the
+                      number of cases is large).
+
+    Returns:
+        An array of means with shape `(resamples, models)`.
+    """
+    random_state = np.random.default_rng(random_state)
+    losses = np.atleast_2d(np.asarray(losses, dtype=np.float64))
+    count = losses.shape[1]
+    chunk_size = max(1, max_elements//max(1, count))
+
+    means = np.empty((resamples, losses.shape[0]))
+    for start in range(0, resamples, chunk_size):
+        size = min(chunk_size, resamples - start)
+        indices = random_state.integers(0, count, size=(size, count))
+        indices += count*np.arange(size)[:, np.newaxis]
+        draws = np.bincount(indices.ravel(), minlength=size*count)
+        means[start:start + size] = draws.reshape(size, count) @ losses.T
+    return means/count
+
+
+def bootstrap_brier_score(predictions, outcomes, confidence=0.95,
+                          resamples=10000, random_state=None):
+    """
+    Estimate percentile bootstrap confidence intervals of Brier scores, and of
+    the paired differences between the scores of several models.
+
+    Cases (not individual predictions) are resampled, so when a model predicts
+    each case several times (for instance, over repeated cross-validation),
+    each case's squared errors are averaged before resampling.
+
+    Arguments:
+        predictions: An array of probabilities with shape `(cases,)`,
+                     `(models, cases)`, or `(models, repeats, cases)`.
+        outcomes: A sequence of observations (zeros and ones), one for each
+                  case.
+        confidence: The confidence level of the intervals.
+        resamples: The number of bootstrap resamples.
+        random_state: A seed or `numpy.random.Generator` instance.
+
+    Returns:
+        A `BrierInterval` tuple of arrays: the Brier score of each model and
+        the bounds of its interval (each with shape `(models,)`), and the
+        bounds of the interval of each difference in scores (row model minus
+        column model, each with shape `(models, models)`).
+    """
+    predictions = np.asarray(predictions, dtype=np.float64)
+    models = 1 if predictions.ndim == 1 else predictions.shape[0]
+    predictions = predictions.reshape(models, -1, predictions.shape[-1])
+    losses = np.mean((predictions - np.asarray(outcomes))**2, axis=1)
+
+    means = bootstrap_means(losses, resamples, random_state)
+    differences = means[:, :, np.newaxis] - means[:, np.newaxis, :]
+    tails = 50*(1 - confidence), 50*(1 + confidence)
+    lower, upper = np.percentile(means, tails, axis=0)
+    difference_lower, difference_upper = np.percentile(differences, tails,
+                                                       axis=0)
+    return BrierInterval(losses.mean(axis=1), lower, upper, difference_lower,
+                         difference_upper)
+
+
+def cross_validate(df, fit, predict=None, folds=10, permutation=None,
+                   predict_many=None):
     """
     Evaluate a model with k-fold cross-validation:
 
-        1. Divide the cases into k contiguous segments.
+        1. Divide the cases into k contiguous segments (of the permutation).
         2. Select an untested segment as the test cases.
         3. Use the other k - 1 segments to train a model.
         4. Generate and store predictions for the test cases.
@@ -49,29 +237,176 @@ def cross_validate(df, fit, predict, folds=10, name='prediction'):
         df: A `pandas` dataframe, with each row representing a case.
         fit: A function that accepts a `pandas` dataframe containing the
              training data and returns a model. The model can be anything, as
-             long as the `predict` function accepts it (see next argument).
+             long as the `predict` or `predict_many` function accepts it. If
+             the function has a true `excludes_test_cases` attribute, it is
+             passed an array of the row positions of the test cases instead,
+             and should fit the model to every other row of `df` (see
+             `kaplanmeier.KaplanMeierTable`).
         predict: A function that accepts the model and a test case (a `pandas`
                  series) and returns a probability.
         folds: The number of folds to use.
-        name: The name of the column in the returned dataframe.
+        permutation: An array of the row positions of `df` in the order they
+                     should be divided into folds (by default, the rows are
+                     divided in their current order).
+        predict_many: A function that accepts the model and a dataframe of test
+                      cases and returns an array of probabilities, one for
+                      each case (or one row for each case, for instance, of
+                      predictions over a grid of horizons). When given, it is
+                      used instead of `predict`.
 
     Returns:
-        A dataframe with one column labeled with the `name` argument containing
-        the model's forecasts. The indices of the result correspond to those of
-        the data passed in, `df`.
+        A `float64` array of the model's forecasts, in the order of the rows
+        of `df` (regardless of the permutation). If `predict_many` returns
+        rows, the array has one row for each case.
     """
     if folds > len(df):
         raise ValueError('more folds than samples')
+    if predict is None and predict_many is None:
+        raise ValueError('no prediction function given')
 
-    test_size = int(np.ceil(len(df)/folds))
-    predictions = pd.DataFrame(index=df.index, columns=[name])
+    count = len(df)
+    if permutation is None:
+        permutation = np.arange(count)
+    test_size = int(np.ceil(count/folds))
+    predictions = None
+    training = np.ones(count, dtype=bool)
+    excludes_test_cases = getattr(fit, 'excludes_test_cases', False)
 
-    for fold, testing_cases in df.groupby(np.arange(len(df)) // test_size):
-        training_cases = df[~df.index.isin(testing_cases.index)]
-        assert len(testing_cases) + len(training_cases) == len(df)
+    for start in range(0, count, test_size):
+        testing = permutation[start:start + test_size]
+        if excludes_test_cases:
+            model = fit(testing)
+        else:
+            training[testing] = False
+            model = fit(df.iloc[training])
+            training[testing] = True
 
-        model = fit(training_cases)
-        for index, testing_case in testing_cases.iterrows():
-            predictions.set_value(index, name, predict(model, testing_case))
+        testing_cases = df.iloc[testing]
+        if predict_many is not None:
+            forecast = np.asarray(predict_many(model, testing_cases))
+        else:
+            forecast = np.array([predict(model, testing_case) for _,
+                                 testing_case in testing_cases.iterrows()])
+        if predictions is None:
+            shape = (count,) + forecast.shape[1:]
+            predictions = np.empty(shape, dtype=np.float64)
+        predictions[testing] = forecast
 
     return predictions
+
+
+def concordance_index(times, predictions, doa):
+    """
+    Compute Harrell's concordance index (C-index) of survival predictions.
+
+    A pair of subjects is comparable when one died before the other's incident
+    ended (a subject found alive at the same time as another died is assumed
+    to have lasted longer). The pair is concordant when the subject who died
+    first had the lower prediction. Tied predictions count as half concordant.
+
+    Instead of checking every pair, the subjects are visited from the longest
+    incident to the shortest, inserting the rank of each prediction into a
+    Fenwick (binary indexed) tree. When a subject who died is visited, the tree
+    counts how many longer incidents had a greater, equal, or lesser
+    prediction, in O(log n) time. The whole index takes O(n log n) time.
+
+    Source: Harrell, F. E., Lee, K. L., & Mark, D. B. (1996). Multivariable
+            prognostic models. Statistics in Medicine, 15(4), 361-387.
+
+    Arguments:
+        times: A sequence of incident times.
+        predictions: A sequence of predictions, where a greater value predicts
+                     a longer survival (for instance, the probabilities from
+                     `cross_validate`).
+        doa: A sequence of booleans indicating whether the incident ended with
+             the subject dead-on-arrival (same length as `times`).
+
+    Returns:
+        A real number between zero and one, where one half is no better than
+        chance and one ranks every comparable pair correctly.
+
+    Raises:
+        ValueError: when there are no comparable pairs.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    doa = np.asarray(doa, dtype=bool)
+    _, ranks = np.unique(np.asarray(predictions, dtype=np.float64),
+                         return_inverse=True)
+    size = ranks.max() + 1 if len(ranks) else 0
+    tree = [0]*(size + 1)
+
+    def insert(rank):
+        rank += 1
+        while rank <= size:
+            tree[rank] += 1
+            rank += rank & -rank
+
+    def count(rank):  # The number of inserted ranks less than `rank`
+        total = 0
+        while rank > 0:
+            total += tree[rank]
+            rank -= rank & -rank
+        return total
+
+    # Longest incidents first, and among equal times, the censored first
+    order = np.lexsort((doa, -times))
+    concordant = tied = discordant = inserted = 0
+    pending, previous = [], None
+    for time, rank, died in zip(times[order].tolist(), ranks[order].tolist(),
+                                doa[order].tolist()):
+        if time != previous:
+            for pending_rank in pending:  # Deaths at the same time do not
+                insert(pending_rank)      # compare with each other
+            inserted += len(pending)
+            pending, previous = [], time
+
+        if died:
+            less, not_greater = count(rank), count(rank + 1)
+            discordant += less
+            tied += not_greater - less
+            concordant += inserted - not_greater
+            pending.append(rank)
+        else:
+            insert(rank)
+            inserted += 1
+
+    pairs = concordant + tied + discordant
+    if pairs == 0:
+        raise ValueError('no comparable pairs')
+    return (concordant + tied/2)/pairs
+
+
+def map_jobs(function, jobs, workers=None):
+    """
+    Run independent jobs in a pool of processes.
+
+    When only one worker is requested, or the platform cannot start a process
+    pool, the jobs run serially in the current process instead. Either way,
+    the results are the same, as long as each job seeds its own random number
+    generator (instead of relying on global state).
+
+    Arguments:
+        function: A function defined at the top level of a module (so that it
+                  can be pickled), which is called once for each job.
+        jobs: A sequence of tuples of arguments to call `function` with. The
+              arguments must be picklable.
+        workers: The number of processes to use (by default, the number of
+                 CPUs available).
+
+    Returns:
+        A list of the results of each job, in the order of `jobs`.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(jobs) > 1:
+        try:
+            executor = ProcessPoolExecutor(workers)
+        except (ImportError, NotImplementedError, OSError):
+            executor = None
+
+        if executor is not None:
+            chunksize = max(1, len(jobs)//(4*workers))
+            with executor:
+                return list(executor.map(function, *zip(*jobs),
+                                         chunksize=chunksize))
+
+    return [function(*arguments) for arguments in jobs]
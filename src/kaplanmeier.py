@@ -5,12 +5,14 @@ kaplanmeier -- Survival analysis using the Kaplan-Meier estimator
 """
 
 from collections import Counter
+import functools
 import matplotlib
 import matplotlib.pyplot as plt
 import numpy as np
 from lifelines import KaplanMeierFitter
 
-from evaluation import compute_brier_score, cross_validate
+from evaluation import bootstrap_brier_score, compute_brier_score
+from evaluation import cross_validate, integrated_brier_score, map_jobs
 from util import read_simple_data
 
 
@@ -104,6 +106,147 @@ def plot_combined(fitters, size=(15, 10), max_days=15,
     return figure, ax
 
 
+class KaplanMeierModel:
+    """
+    A Kaplan-Meier estimator of the survival function implemented with NumPy.
+
+    Fitting sorts the incident times once and takes the cumulative product of
+    the conditional survival probabilities at each unique time, and prediction
+    looks up whole arrays of times with binary search. For the small subsets
+    fitted during cross-validation, this is orders of magnitude faster than
+    `lifelines.KaplanMeierFitter`, and the curves are identical.
+
+    Attributes:
+        label: The name attached to the model instance.
+        timeline: The sorted unique incident times.
+        survival_function: The estimated probability of survival at (and just
+                           after) each time in the timeline.
+        variance: Greenwood's estimate of the variance of the survival function
+                  at each time in the timeline, or `None` if not requested.
+    """
+    def fit(self, times, doa, label=None, variance=False):
+        """
+        Fit a Kaplan-Meier curve to data.
+
+        Arguments:
+            times: A sequence of incident times.
+            doa: A sequence of booleans indicating whether the incident ended
+                 with the subject dead-on-arrival (same length as `times`).
+                 Incidents that did not end with a death are censored.
+            label: A name to attach to the model instance.
+            variance: A boolean that, when `True`, also computes Greenwood's
+                      variance estimate.
+
+        Returns:
+            self: The model instance.
+        """
+        times = np.asarray(times, dtype=np.float64)
+        doa = np.asarray(doa, dtype=np.float64)
+        assert len(times) == len(doa)
+
+        self.label = label
+        self.timeline, inverse = np.unique(times, return_inverse=True)
+        exits = np.bincount(inverse, minlength=len(self.timeline))
+        deaths = np.bincount(inverse, doa, minlength=len(self.timeline))
+        at_risk = len(times) - np.cumsum(exits) + exits
+
+        self.survival_function = np.cumprod(1 - deaths/at_risk)
+        self.variance = None
+        if variance:
+            with np.errstate(divide='ignore'):
+                terms = deaths/(at_risk*(at_risk - deaths))
+            self.variance = self.survival_function**2*np.cumsum(terms)
+        return self
+
+    def predict(self, time):
+        """
+        Predict a subject's probability of survival with the fitted curve.
+
+        Arguments:
+            time: A time, or an array of times, to make predictions for.
+
+        Returns:
+            The probability of surviving past each time (a float if `time` is
+            a scalar, and an array of the same shape otherwise). Times before
+            the first incident time have a probability of one, and times after
+            the last take the final value of the curve.
+        """
+        indices = np.searchsorted(self.timeline, time, side='right') - 1
+        survival = np.where(indices < 0, 1.0,
+                            self.survival_function[np.maximum(indices, 0)])
+        return float(survival) if np.ndim(survival) == 0 else survival
+
+
+class KaplanMeierTable:
+    """
+    Precomputed Kaplan-Meier counts for fitting curves that leave out cases.
+
+    In k-fold cross-validation, every training set is the whole category
+    without one fold. The table sorts the category's times and counts the
+    exits and deaths at each unique time once. Calling the table with the
+    positions of the test cases subtracts their counts and takes the
+    cumulative product, which is linear in the number of unique times and
+    needs no sorting. Cross-validating a category costs about as much as
+    fitting it once.
+
+    The table is callable like the functions `make_fitting_function` returns.
+    `evaluation.cross_validate` passes it the test case positions instead of
+    the training data (see `excludes_test_cases`).
+
+    Attributes:
+        label: The name attached to the fitted model instances.
+        timeline: The sorted unique incident times of every case.
+        positions: The position of each case's time in the timeline.
+        doa: Whether each case ended with a death, as floats.
+        exits: The number of cases that end at each time in the timeline.
+        deaths: The number of deaths at each time in the timeline.
+    """
+    excludes_test_cases = True
+
+    def __init__(self, times, doa, label=None):
+        """
+        Count the exits and deaths of every case.
+
+        Arguments:
+            times: A sequence of incident times.
+            doa: A sequence of booleans indicating whether the incident ended
+                 with the subject dead-on-arrival (same length as `times`).
+            label: A name to attach to the fitted model instances.
+        """
+        times = np.asarray(times, dtype=np.float64)
+        self.label, self.doa = label, np.asarray(doa, dtype=np.float64)
+        self.timeline, self.positions = np.unique(times, return_inverse=True)
+        self.exits = np.bincount(self.positions, minlength=len(self.timeline))
+        self.deaths = np.bincount(self.positions, self.doa, len(self.timeline))
+
+    def __call__(self, excluded=()):
+        """
+        Fit a curve to every case except some.
+
+        Arguments:
+            excluded: An array of the positions of the cases to leave out (in
+                      the order the cases were given to the table).
+
+        Returns:
+            A `KaplanMeierModel` instance, identical in its predictions to one
+            fitted to the remaining cases.
+        """
+        excluded = np.asarray(excluded, dtype=np.int64)
+        positions = self.positions[excluded]
+        exits = self.exits - np.bincount(positions, minlength=len(self.exits))
+        deaths = self.deaths - np.bincount(positions, self.doa[excluded],
+                                           len(self.deaths))
+        at_risk = np.cumsum(exits[::-1])[::-1]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            factors = np.where(at_risk > 0, 1 - deaths/at_risk, 1.0)
+
+        model = KaplanMeierModel()
+        model.label, model.timeline = self.label, self.timeline
+        model.survival_function, model.variance = np.cumprod(factors), None
+        return model
+
+
 class NaiveSurvivalRateModel:
     """
     A model that guesses the probability of survival is always the overall
@@ -131,12 +274,16 @@ class NaiveSurvivalRateModel:
         Predict a subject's probability of survival with the survival rate.
 
         Arguments:
-            time: The time the model should make a prediction for (unused).
+            time: The time, or an array of times, the model should make a
+                  prediction for (unused except for its shape).
 
         Returns:
-            The prediction (in this case, the survival rate).
+            The prediction (in this case, the survival rate) as a float, or as
+            an array of the same shape as `time`.
         """
-        return self.survival_rate
+        if np.ndim(time) == 0:
+            return self.survival_rate
+        return np.full(np.shape(time), self.survival_rate)
 
 
 def preprocess(df):
@@ -171,15 +318,39 @@ def make_fitting_function(model, df_default=None, label=None):
         fit: A one-argument function that takes in training data as a `pandas`
              dataframe containing `days` and `doa` columns, and returns a
              fitted model instance (depends on the model's implementation).
+             The function can be pickled (so it can be sent to another
+             process), provided the model class can be.
     """
-    def fit(training_cases):
-        instance = model()
-        df = training_cases if df_default is None else df_default
-        return instance.fit(df.days, df.doa, label=label)
-    return fit
+    return functools.partial(fit_model, model, df_default, label)
+
+
+def fit_model(model, df_default, label, training_cases):
+    """ Fit a new model instance (see `make_fitting_function`). """
+    instance = model()
+    df = training_cases if df_default is None else df_default
+    return instance.fit(df.days, df.doa, label=label)
 
 
-def evaluate_fit(df, fit_fn, predict_fn, repeat=10):
+def predict_case(model, test_case):
+    """ Predict the probability a test case (a `pandas` series) survived. """
+    return model.predict(test_case.days)
+
+
+def predict_cases(model, test_cases):
+    """ Predict the probability each test case (a dataframe) survived. """
+    return model.predict(test_cases.days.values)
+
+
+def predict_curves(grid, model, test_cases):
+    """
+    Predict the probability each test case survives past every horizon in a
+    grid (the same for every case, since the models use no covariates).
+    """
+    return np.broadcast_to(model.predict(grid), (len(test_cases), len(grid)))
+
+
+def evaluate_fit(df, fit_fn, predict_fn=predict_case, repeat=10,
+                 predict_many=predict_cases, random_state=None):
     """
     Evaluate a model instance (fitter) with cross-validation.
 
@@ -192,24 +363,87 @@ def evaluate_fit(df, fit_fn, predict_fn, repeat=10):
         predict_fn: A two-argument function that takes in the fitted model
                     instance and a test case and returns a prediction.
         repeat: The number of times to repeat cross-validation.
+        predict_many: A two-argument function that takes in the fitted model
+                      instance and a dataframe of test cases and returns an
+                      array of predictions. When not `None`, it is used
+                      instead of `predict_fn`.
+        random_state: A seed or `numpy.random.RandomState` instance used to
+                      shuffle the cases.
 
     Returns:
         score: The mean Brier score for the category between cross-validation
                runs.
-        errors: A list of all signed error values measured (across cross-
-                validation runs).
+        errors: A `float64` array of all signed error values measured (one
+                cross-validation run after another, with the cases of each run
+                in the order of `df`).
     """
-    subscores, errors = [], []
+    if not isinstance(random_state, np.random.RandomState):
+        random_state = np.random.RandomState(random_state)
+    outcomes = df.survived.values.astype(int)
+    subscores = np.empty(repeat)
+    errors = np.empty((repeat, len(df)))
+
     for iteration in range(repeat):
-        df = df.sample(n=len(df))
+        permutation = random_state.permutation(len(df))
+        predictions = cross_validate(df, fit_fn, predict_fn,
+                                     permutation=permutation,
+                                     predict_many=predict_many)
+        subscores[iteration] = compute_brier_score(predictions, outcomes)
+        errors[iteration] = predictions - outcomes
+    return subscores.mean(), errors.ravel()
 
-        forecast = cross_validate(df, fit_fn, predict_fn)
-        predictions = [forecast.ix[index].prediction for index in df.index]
-        outcomes = df.survived.as_matrix().astype(int)
 
-        subscores.append(compute_brier_score(predictions, outcomes))
-        errors += list(forecast.prediction - outcomes)
-    return np.mean(subscores), errors
+def evaluate_repeat(df, fit_fn, seed):
+    """ Run one repeat of `evaluate_fit` with its own random state. """
+    return evaluate_fit(df, fit_fn, repeat=1,
+                        random_state=np.random.RandomState(seed))
+
+
+def evaluate_fits(subsets, fit_fns, repeat=10, seed=0, workers=None):
+    """
+    Evaluate several models on several categories with cross-validation, in
+    parallel.
+
+    Every (category, model, repeat) combination is a separate job (see
+    `evaluation.map_jobs`). Each repeat shuffles the cases with a seed derived
+    from `seed`, the category, and the repeat, so the results do not depend on
+    the number of workers, and every model is tested on the same folds (which
+    pairs up their errors case by case).
+
+    Arguments:
+        subsets: A list of `pandas` dataframes, one for each category.
+        fit_fns: A list of lists of fitting functions (see
+                 `make_fitting_function`), with one list for each category and
+                 one function in each list for each model.
+        repeat: The number of times to repeat cross-validation.
+        seed: A nonnegative integer that determines every shuffle.
+        workers: The number of processes to use (see `evaluation.map_jobs`).
+
+    Returns:
+        scores: An array of Brier scores with shape `(categories, models,
+                repeat)`.
+        errors: An array of signed errors with shape `(models, cases)`. For
+                each category, the errors of every repeat follow one another,
+                and the categories follow one another in order.
+    """
+    models = len(fit_fns[0])
+    jobs, indices = [], []
+    for category, (df, category_fit_fns) in enumerate(zip(subsets, fit_fns)):
+        for model, fit_fn in enumerate(category_fit_fns):
+            for iteration in range(repeat):
+                jobs.append((df, fit_fn, [seed, category, iteration]))
+                indices.append((category, model, iteration))
+
+    offsets = np.cumsum([0] + [repeat*len(df) for df in subsets])
+    scores = np.empty((len(subsets), models, repeat))
+    errors = np.empty((models, offsets[-1]))
+
+    for (category, model, iteration), (score, job_errors) in zip(
+            indices, map_jobs(evaluate_repeat, jobs, workers)):
+        scores[category, model, iteration] = score
+        start = offsets[category] + iteration*len(subsets[category])
+        errors[model, start:start + len(job_errors)] = job_errors
+    return scores, errors
 
 
 def main():
@@ -217,33 +451,40 @@ def main():
     Fit Kaplan-Meier curves to each category and evaluate the performance of
     the curves against a naive survival rate model.
     """
+    from survival import logrank  # `survival.curves` imports this module
     url = 'sqlite:///../data/isrid-master.db'
     df_singles = read_simple_data(url, exclude_groups=True)
     df_singles = preprocess(df_singles)
 
     categories, counts = zip(*Counter(df_singles.category).most_common())
     survival_rates = []
-    naive_scores, km_scores = [], []
-    naive_errors, km_errors = [], []
 
     naive_fit = make_fitting_function(NaiveSurvivalRateModel)
-    predict = lambda model, test_case: model.predict(test_case.days)
-    km_fit_fns = []
+    subsets, fit_fns, km_fit_fns = [], [], []
 
     for category in categories:
         df_subset = df_singles[df_singles.category == category]
         survival_rates.append(sum(df_subset.survived)/len(df_subset))
-
-        km_fit = make_fitting_function(KaplanMeierFitter, df_subset, category)
-        km_fit_fns.append(km_fit)
-
-        score, errors = evaluate_fit(df_subset, naive_fit, predict)
-        naive_scores.append(score)
-        naive_errors += errors
-
-        score, errors = evaluate_fit(df_subset, km_fit, predict)
-        km_scores.append(score)
-        km_errors += errors
+        subsets.append(df_subset)
+
+        km_fit = KaplanMeierTable(df_subset.days, df_subset.doa, category)
+        fit_fns.append([naive_fit, km_fit])
+        km_fit_fns.append(make_fitting_function(KaplanMeierFitter, df_subset,
+                                                category))  # For plotting
+
+    repeat = 10
+    scores, errors = evaluate_fits(subsets, fit_fns, repeat)
+    naive_scores, km_scores = scores.mean(axis=2).T
+    naive_errors, km_errors = errors
+
+    # Signed errors are predictions offset by the outcomes, so bootstrapping
+    # them against zero outcomes gives the same squared errors
+    offsets = np.cumsum([0] + [repeat*len(df_subset) for df_subset in subsets])
+    blocks = [errors[:, start:end].reshape(2, repeat, -1)
+              for start, end in zip(offsets[:-1], offsets[1:])]
+    intervals = [bootstrap_brier_score(block, 0, resamples=1000,
+                                       random_state=index)
+                 for index, block in enumerate(blocks)]
 
     ## Statistics
 
@@ -256,6 +497,37 @@ def main():
                    for naive_error, km_error in zip(naive_errors, km_errors)]
     null_bound = 0.05
 
+    overall = bootstrap_brier_score(np.concatenate(blocks, axis=2), 0,
+                                    random_state=0)
+    for index, name in enumerate(['naive', 'KM']):
+        print('Overall {} Brier score: {:.4f} (95% CI {:.4f} to {:.4f})'.format(
+              name, overall.scores[index], overall.lower[index],
+              overall.upper[index]))
+    print('Difference (naive - KM): {:.4f} (95% CI {:.4f} to {:.4f})'.format(
+          overall.scores[0] - overall.scores[1],
+          overall.difference_lower[0, 1], overall.difference_upper[0, 1]))
+    better = sum(interval.difference_lower[0, 1] > 0
+                 for interval in intervals)
+    print('Categories where KM is significantly better: {} of {}'.format(
+          better, len(intervals)))
+
+    # Time-dependent scores account for when each incident ended, and weight
+    # cases by the probability they were not censored (found alive) earlier
+    grid = np.linspace(0, 30, 301)
+    predict_grid = functools.partial(predict_curves, grid)
+    integrated_scores = np.empty((len(subsets), 2))
+    for index, df_subset in enumerate(subsets):
+        random_state = np.random.RandomState([0, index])
+        permutation = random_state.permutation(len(df_subset))
+        for model, fit_fn in enumerate(fit_fns[index]):
+            predictions = cross_validate(df_subset, fit_fn,
+                                         permutation=permutation,
+                                         predict_many=predict_grid)
+            integrated_scores[index, model] = integrated_brier_score(
+                predictions, df_subset.days, df_subset.doa, grid)
+    print('Mean integrated Brier score (0 to 30 days): naive {:.4f}, '
+          'KM {:.4f}'.format(*integrated_scores.mean(axis=0)))
+
     print('Proportions: ')
     print('  Increase in error: {:.3f}%'.format(sum(diff < -null_bound
           for diff in error_diffs)/len(error_diffs)*100))
@@ -329,6 +601,13 @@ def main():
     plt.ylabel('Brier Score with Survival Rate')
     plt.scatter(km_scores, naive_scores, counts, c=c, alpha=0.3)
 
+    # 95% bootstrap confidence intervals for each category
+    lower = np.array([interval.lower for interval in intervals]).T
+    upper = np.array([interval.upper for interval in intervals]).T
+    plt.errorbar(km_scores, naive_scores, fmt='none', ecolor='gray',
+                 alpha=0.3, xerr=[km_scores - lower[1], upper[1] - km_scores],
+                 yerr=[naive_scores - lower[0], upper[0] - naive_scores])
+
     t = np.linspace(0, 0.25, 100)
     plt.plot(t, t, 'b--')
     plt.xlim(0, 0.25)
@@ -338,9 +617,24 @@ def main():
     plt.savefig('../doc/figures/evaluation/brier-score-comparison.svg',
                 transparent=True)
 
-    plt.show()
+    ## Log-Rank Tests
+
+    tables = logrank.count_tables(df_singles.days, df_singles.doa,
+                                  df_singles.category)
+    result = logrank.multivariate_logrank(None, None, None, tables=tables)
+    print('Log-rank test across categories: chi^2 = {:.3f} (df = {}), '
+          'p = {:.3g}'.format(*result))
 
-    # TODO: logrank tests between categories
+    labels, _, pvalues = logrank.pairwise_logrank(None, None, None, 'holm',
+                                                  tables=tables)
+    significant = np.argwhere(np.triu(pvalues < 0.05))
+    print('Pairs of categories with different survival curves '
+          '(Holm-adjusted p < 0.05): {}'.format(len(significant)))
+    for row, column in significant:
+        print('  {} vs. {}: p = {:.3g}'.format(labels[row], labels[column],
+                                               pvalues[row, column]))
+
+    plt.show()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+"""
+loadtest -- Measure the latency and throughput of the survival curve API
+
+Start the API (see `survival.api`), then navigate to `src` and execute
+
+    $ python3 loadtest.py --url http://localhost:5007 --levels 1 4 16 64
+
+For each level of concurrency, the script keeps that many requests in flight
+until it has sent `--requests` of them, and reports the median and 99th
+percentile latency and the number of requests answered per second. The
+cohorts are drawn at random (with a fixed seed) from the largest categories,
+age ranges, and sexes, so that the first pass mixes cache misses with hits.
+"""
+
+import argparse
+import json
+import random
+import time
+from urllib.parse import urlencode
+
+from tornado import gen
+from tornado.httpclient import AsyncHTTPClient, HTTPError
+from tornado.ioloop import IOLoop
+
+
+def make_queries(categories, count, seed=0):
+    """
+    Draw random cohort filters.
+
+    Arguments:
+        categories: A list of category labels to choose from.
+        count: The number of queries to draw.
+        seed: The seed of the random number generator.
+
+    Returns:
+        A list of URL-encoded query strings.
+    """
+    generator = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        arguments = [('categories', generator.choice(categories))]
+        if generator.random() < 0.5:
+            low = generator.choice([0, 13, 18, 40, 65])
+            arguments += [('min_age', low), ('max_age', low + 25)]
+        if generator.random() < 0.3:
+            arguments.append(('sexes', generator.choice([1, 2])))
+        queries.append(urlencode(arguments))
+    return queries
+
+
+@gen.coroutine
+def run_level(client, url, queries, concurrency):
+    """
+    Send every query, keeping `concurrency` requests in flight.
+
+    Returns:
+        A tuple of the sorted latencies in seconds, the number of failed
+        requests, and the total time in seconds.
+    """
+    latencies, failures, remaining = [], [0], list(reversed(queries))
+
+    @gen.coroutine
+    def worker():
+        while remaining:
+            query = remaining.pop()
+            start = time.perf_counter()
+            try:
+                yield client.fetch(url + '/curve?' + query)
+            except (HTTPError, OSError):
+                failures[0] += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    yield [worker() for _ in range(concurrency)]
+    return sorted(latencies), failures[0], time.perf_counter() - start
+
+
+@gen.coroutine
+def run(url, levels, requests, top):
+    """
+    Run the load test at every level of concurrency and print a report.
+    """
+    AsyncHTTPClient.configure(None, max_clients=max(levels))
+    client = AsyncHTTPClient()
+    response = yield client.fetch(url + '/categories')
+    categories = json.loads(response.body.decode('utf-8'))['categories'][:top]
+
+    print('{:>11} {:>9} {:>9} {:>9} {:>8}'.format(
+          'concurrency', 'p50 (ms)', 'p99 (ms)', 'req/s', 'failed'))
+    for level in levels:
+        queries = make_queries(categories, requests, seed=level)
+        latencies, failures, seconds = yield run_level(client, url, queries,
+                                                       level)
+        percentile = lambda q: 1000*latencies[int(q*(len(latencies) - 1))]
+        print('{:>11} {:>9.2f} {:>9.2f} {:>9.0f} {:>8}'.format(
+              level, percentile(0.5), percentile(0.99),
+              len(latencies)/seconds, failures))
+
+
+def main():
+    """
+    Parse the command line and run the load test.
+    """
+    parser = argparse.ArgumentParser(description='Load test the curve API.')
+    parser.add_argument('--url', default='http://localhost:5007')
+    parser.add_argument('--levels', type=int, nargs='+',
+                        default=[1, 4, 16, 64])
+    parser.add_argument('--requests', type=int, default=2000,
+                        help='requests per level of concurrency')
+    parser.add_argument('--top', type=int, default=20,
+                        help='number of categories to draw from')
+    arguments = parser.parse_args()
+    IOLoop.current().run_sync(lambda: run(arguments.url.rstrip('/'),
+                                          arguments.levels,
+                                          arguments.requests, arguments.top))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,40 +5,56 @@ To run, navigate to `src` and execute
 
     $ bokeh serve --show server
 
-Bokeh will then redirect you to a webpage with a plot, four tabs (one each for
-subsetting the cases by category, age, group size, and sex), and a generate
-button.
-
-When you click the generate button, Bokeh will call `generate_plot`, where the
-data will be resliced and used to update the curve without a page refresh.
+Bokeh will then redirect you to a webpage with a plot, five tabs (one each for
+subsetting the cases by category, age, group size, and sex, and one for
+comparing cohorts), and a generate button.
+
+The cases are read once per server process (see `survival.dataset`), so opening
+a new session does not query the database. Changing any widget calls
+`generate_plot` once the widgets have stopped changing for a moment (as does
+clicking the generate button), where the data will be resliced and used to
+update the curve without a page refresh. The compare tab splits the selection
+into one curve per category or sex (up to eight), and reports a log-rank test
+between them. Curves are fitted off the event loop, so a slow fit does not hold
+up other sessions, and they are cached by the selected constraints in a cache
+every session shares (see `survival.cache`). The curves of the largest
+categories are fitted when the server starts. Before a curve is sent to the
+browser, steps that would not be visible are removed (see `survival.simplify`),
+and it is sent as single-precision arrays. The time spent selecting, fitting
+and sending curves is recorded for the server's metrics endpoint (see
+`survival.metrics` and `server.server_lifecycle`).
 """
 
-from bokeh.models import (Button, CheckboxGroup, Panel, Paragraph, Slider,
-                          Tabs, HBox)
+from bokeh.models import (Button, CheckboxGroup, Panel, Paragraph, RadioGroup,
+                          Slider, Tabs, HBox)
 from bokeh.models.ranges import Range1d
 from bokeh.plotting import figure, curdoc, vplot
-from collections import Counter
-from lifelines import KaplanMeierFitter
-import pandas as pd
+from functools import partial
+import numpy as np
 
-import database
-from database.models import Incident, Group, Subject
-from database.processing import tabulate
+from survival.cache import shared_cache
+from survival.cohort import shared_index
+from survival.dataset import load_shared
+from survival.metrics import PHASES
+from survival.simplify import simplify, step_coordinates
 
 
 # Get data
 
-# Path may vary based on your current working directory
-engine, session = database.initialize('sqlite:///../../data/isrid-master.db')
-
-query = session.query(Subject.survived, Incident.total_hours, Group.category,
-                      Group.id, Subject.age, Subject.sex)
-query = query.join(Group, Incident)
-df = tabulate(query)
-df['size'] = [Group.query.get(int(id)).size for id in df.id]  # Bad hack
-df['days'] = [hours.total_seconds()/3600/24 for hours in df.total_hours]
+# Path may vary based on your current working directory (keep it the same as
+# in `server_lifecycle`, which loads the data once when the server starts)
+path = '../../data/isrid-master.db'
+df = load_shared(path)  # Shared between sessions, so never modify in place
+cohort_index = shared_index(df)
+cache = shared_cache(path)  # Prewarmed with the largest categories
 
-database.terminate(engine, session)
+document = curdoc()
+state = {'generation': 0, 'futures': [], 'timeout': None,  # Latest request
+         'summaries': [], 'comparison': ''}
+DEBOUNCE = 150  # Milliseconds
+TOLERANCE = 1e-3  # Smallest drop in survival drawn (raise to send less data)
+COLORS = ['blue', 'orange', 'green', 'red', 'purple', 'brown', 'magenta',
+          'gray']  # One for each curve that can be compared
 
 
 # Build UI
@@ -51,8 +67,8 @@ status = Paragraph()  # Used for notifying the user when the constraints
 
 # Create a list of checkboxes for enabling each category
 # Categories are sorted from largest to smallest
-categories = Counter(df['category'])
-categories = sorted(categories, key=lambda category: -categories[category])
+categories = cohort_index.labels[np.argsort(-cohort_index.counts,
+                                           kind='stable')].tolist()
 category_select = CheckboxGroup(labels=categories, active=[0])
 
 # Create sliders for constraining cases by minimum and maximum group sizes
@@ -71,64 +87,198 @@ max_age_select = Slider(start=0, end=max(df['age']), value=max(df['age']),
 # Create checkboxes for enabling each sex
 sex_select = CheckboxGroup(labels=['Male', 'Female'], active=[0, 1])
 
+# Create options for splitting the cases into one curve per category or sex
+mode_select = RadioGroup(labels=['Single Curve', 'Compare Categories',
+                                 'Compare Sexes'], active=0)
+
 # Combine all the widgets above into a tabbed pane
 selectors = Tabs(tabs=[
     Panel(child=HBox(category_select), title='Category'),
     Panel(child=HBox(min_size_select, max_size_select), title='Group Size'),
     Panel(child=HBox(min_age_select, max_age_select), title='Age'),
-    Panel(child=HBox(sex_select), title='Sex')
+    Panel(child=HBox(sex_select), title='Sex'),
+    Panel(child=HBox(mode_select), title='Compare')
 ])
 
 generate = Button(label='Generate')
-renderer = plot.line([], [], line_width=2, line_alpha=0.75)
+renderers = [plot.line([], [], line_width=2, line_alpha=0.75, line_color=color)
+             for color in COLORS]
+
+
+def select_cohorts():
+    """
+    Describe the cohorts selected by the widgets.
+
+    Returns:
+        A list of `(label, cohort)` tuples, with one normalized cohort for each
+        curve to draw (at most one for each color).
+    """
+    constraints = {
+        'categories': [category_select.labels[index]
+                       for index in category_select.active],
+        'min_size': min_size_select.value, 'max_size': max_size_select.value,
+        'min_age': min_age_select.value, 'max_age': max_age_select.value,
+        'sexes': [index + 1 for index in sex_select.active]
+    }
+    if mode_select.active == 1:
+        splits = [(category, {'categories': [category]})
+                  for category in constraints['categories']]
+    elif mode_select.active == 2:
+        splits = [(label, {'sex': sex})
+                  for sex, label in ((1, 'Male'), (2, 'Female'))
+                  if sex in constraints['sexes']]
+    else:
+        splits = [('', {})]
+    return [(label, cohort_index.normalize(dict(constraints, **split)))
+            for label, split in splits[:len(COLORS)]]
 
 
 def generate_plot():  # Perhaps `regenerate_plot`?
-    """ Dynamically fit and plot a Kaplan-Meier curve. """
-    df_ = df.copy()
-
-    # Use constraints
-    for index in range(len(categories)):
-        if index not in category_select.active:
-            df_ = df_[df_.category != category_select.labels[index]]
-
-    df_ = df_[min_size_select.value <= df_['size']]
-    df_ = df_[df_['size'] <= max_size_select.value]
-
-    df_ = df_[min_age_select.value <= df_.age]
-    df_ = df_[df_.age <= max_age_select.value]
-
-    if 0 not in sex_select.active:  # Male
-        df_ = df_[df_.sex != 1]
-    if 1 not in sex_select.active:  # Female
-        df_ = df_[df_.sex != 2]
-
-    if len(df_) == 0:  # Bad constraints
-        status.text = 'No cases found. Try different constraints.'
+    """
+    Request the Kaplan-Meier curves of the selected cohorts (and, when there
+    are several, a log-rank test between them).
+
+    The curves are fitted concurrently on worker threads (see
+    `CurveCache.submit`), so other sessions are not blocked, and each one is
+    drawn by `show_curve` on the next tick of the event loop after it is
+    ready. Fits for a state that has since been replaced are cancelled if they
+    have not started yet, and their results are discarded otherwise.
+    """
+    cancel_scheduled()
+    cohorts = select_cohorts()
+    state['generation'] += 1
+    generation = state['generation']
+    for future in state['futures']:
+        future.cancel()
+    state['futures'] = []
+    state['summaries'] = [None]*len(cohorts)
+    state['comparison'] = ''
+
+    for renderer in renderers[len(cohorts):]:
+        renderer.data_source.data.update(x=[], y=[])
+    status.text = 'Fitting...'
+
+    for position, (label, cohort) in enumerate(cohorts):
+        fit = lambda cohort=cohort: cohort_index.fit(cohort)
+        request(cache.submit(cohort, fit),
+                partial(show_curve, generation, position, label))
+    if len(cohorts) > 1:
+        request(cache.run(cohort_index.compare,
+                          [cohort for _, cohort in cohorts]),
+                partial(show_comparison, generation))
+    elif not cohorts:
+        update_status()
+
+
+def request(future, callback):
+    """
+    Call `callback` with a future on the event loop once it is done (at once
+    if it is done already, as for curves served from memory).
+    """
+    state['futures'].append(future)
+    if future.done():
+        callback(future)
+    else:
+        future.add_done_callback(lambda future: document.add_next_tick_callback(
+            partial(callback, future)))
+
+
+def show_curve(generation, position, label, future):
+    """ Draw a fitted curve, unless newer curves have been requested since. """
+    if generation != state['generation']:
+        return
+    if future.cancelled():  # By another session that shared the request
+        generate_plot()
+        return
+    try:
+        curve = future.result()
+    except Exception as error:
+        state['summaries'][position] = 'Unable to fit the curve: {}'.format(
+                                       error)
+        update_status()
         return
 
-    doa = [not survived for survived in df_.survived]
-
-    kmf = KaplanMeierFitter()
-    fit = kmf.fit(df_.days, event_observed=doa, label='prob_of_surv')
+    with PHASES.time('serialize'):
+        shown = simplify(curve, TOLERANCE, plot.plot_width)
+        x, y = step_coordinates(shown.times, shown.survival)
+        data = renderers[position].data_source.data
+        data.update(x=x.astype(np.float32), y=y.astype(np.float32))
+    prefix = '{}: '.format(label) if label else ''
+    state['summaries'][position] = (prefix, curve.count, curve.times[-1])
 
-    # Here, we are using the smoothed version of the Kaplan-Meier curve
-    # The stepwise version would work just as well
+    end = max(summary[2] for summary in state['summaries']
+              if isinstance(summary, tuple))
+    # bounds='auto' doesn't work?
+    plot.x_range.update(start=0, end=end, bounds=(0, end))
+    update_status()
 
-    data, surv_func = renderer.data_source.data, fit.survival_function_
-    data.update(x=surv_func.index, y=surv_func.prob_of_surv)
 
-    start, end = 0, max(df_.days)
-    # bounds='auto' doesn't work?
-    plot.x_range.update(start=start, end=end, bounds=(start, end))
-    status.text = '{} cases found.'.format(len(df_))
+def show_comparison(generation, future):
+    """ Report the result of a log-rank test between the drawn curves. """
+    if generation != state['generation'] or future.cancelled():
+        return
+    try:
+        result = future.result()
+    except Exception as error:
+        state['comparison'] = 'Unable to compare the curves: {}'.format(error)
+    else:
+        if result.df == 0:
+            state['comparison'] = 'No deaths to compare.'
+        else:
+            state['comparison'] = 'Log-rank test: p = {:.3g}.'.format(
+                                  result.pvalue)
+    update_status()
+
+
+def update_status():
+    """ Summarize the curves drawn so far. """
+    parts = []
+    for color, summary in zip(COLORS, state['summaries']):
+        if summary is None:
+            parts.append('Fitting...')
+        elif isinstance(summary, str):
+            parts.append(summary)
+        elif summary[1] == 0:  # Bad constraints
+            parts.append('{}No cases found. Try different constraints.'.format(
+                         summary[0]))
+        elif len(state['summaries']) > 1:
+            parts.append('{}{} cases ({}).'.format(summary[0], summary[1],
+                                                   color))
+        else:
+            parts.append('{} cases found.'.format(summary[1]))
+    if not state['summaries']:
+        parts.append('No cohorts selected.')
+    status.text = ' '.join(parts + [state['comparison']]).strip()
+
+
+def cancel_scheduled():
+    """ Cancel the pending call to `generate_plot`, if there is one. """
+    if state['timeout'] is not None:
+        try:
+            document.remove_timeout_callback(state['timeout'])
+        except ValueError:  # Already running
+            pass
+        state['timeout'] = None
+
+
+def schedule_plot(attribute, old, new):
+    """
+    Regenerate the plot once the widgets have stopped changing for
+    `DEBOUNCE` milliseconds (so dragging a slider does not fit every value it
+    passes through).
+    """
+    cancel_scheduled()
+    state['timeout'] = document.add_timeout_callback(generate_plot, DEBOUNCE)
 
 
 plot.xaxis.axis_label = 'Time (days)'
 plot.yaxis.axis_label = 'Probability of Survival'
 
 generate.on_click(generate_plot)
+for widget in min_size_select, max_size_select, min_age_select, max_age_select:
+    widget.on_change('value', schedule_plot)
+for widget in category_select, sex_select, mode_select:
+    widget.on_change('active', schedule_plot)
 generate_plot()  # Start with Hikers, both sexes, all ages and group sizes
 
-document = curdoc()
 document.add_root(vplot(plot, status, generate, selectors))
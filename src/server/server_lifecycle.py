@@ -5,6 +5,10 @@ server.server_lifecycle
 import os
 import sys
 
+DATABASE_PATH = '../../data/isrid-master.db'  # The same path as in `main`
+METRICS_PORT = 5008  # Set to `None` to not serve metrics
+PROFILING = False  # Whether to serve `/profile` alongside `/metrics`
+
 
 def on_server_loaded(server_context):
     """
@@ -12,8 +16,49 @@ def on_server_loaded(server_context):
     locations where Python searches for modules (the server is expected to run
     from `src`, which would allow the frontend to access the database).
 
+    Then load and index the cases every session shares (see
+    `survival.dataset` and `survival.cohort`), and fit the curves of the
+    largest categories, so the first visitors do not wait for them either.
+    Finally, serve the process's metrics on `METRICS_PORT` (see
+    `survival.api.monitoring_patterns`).
+
     Arguments:
         server_context: Supplied by Bokeh.
     """
     cwd = os.getcwd()
     sys.path.append(cwd)  # Relative imports
+
+    from survival.cache import shared_cache
+    from survival.cohort import prewarm, shared_index
+    from survival.dataset import load_shared
+    index = shared_index(load_shared(DATABASE_PATH))
+    cache = shared_cache(DATABASE_PATH)
+    prewarm(cache, index)
+
+    if METRICS_PORT is not None:
+        from tornado.web import Application
+        from survival.api import monitoring_patterns
+        Application(monitoring_patterns([cache], PROFILING)).listen(
+            METRICS_PORT)
+
+
+def on_session_created(session_context):
+    """
+    Count the new session in the server's metrics.
+
+    Arguments:
+        session_context: Supplied by Bokeh.
+    """
+    from survival.metrics import SESSIONS
+    SESSIONS.add(1)
+
+
+def on_session_destroyed(session_context):
+    """
+    Stop counting a closed session in the server's metrics.
+
+    Arguments:
+        session_context: Supplied by Bokeh.
+    """
+    from survival.metrics import SESSIONS
+    SESSIONS.add(-1)
@@ -7,7 +7,8 @@ You can use this standalone script for quickly querying the database or using
 features of the framework. When executed, the script will present you with a
 prompt, where you can enter expressions to be evaluated (this will not work for
 statements, like `import`). You will have access to a SQLAlchemy scoped session
-object, `session`, as well as all of the names imported at the start of this
+object, `session`, a cache of fitted survival curves, `cache` (shared with the
+Bokeh frontend), as well as all of the names imported at the start of this
 file.
 
 Here is an example:
@@ -24,6 +25,10 @@ Here is an example:
 [!] weather.noaa.fetch_history(datetime.datetime(2016, 7, 4),  # Single line
                                [38.8, -77.1, 38.9, -77.0], 'TMAX', 'TMIN')
  => {'TMIN': [200], 'TMAX': [233]}
+[!] cache.get({'example': 1}, lambda: fit_curve([1, 2, 3], [0, 1, 0])).survival
+ => [1.  1.  0.5 0.5]
+[!] cache.hits, cache.misses  # The curve is only fitted once per snapshot
+ => (0, 1)
 """
 
 import datetime
@@ -38,6 +43,8 @@ import database
 from database.models import Subject, Group, Incident, Location, Point
 from database.models import Operation, Outcome, Weather, Search
 from database.processing import survival_rate, tabulate, export_to_orange
+from survival.cache import CurveCache, DEFAULT_DIRECTORY
+from survival.curves import fit_curve
 import weather
 from util import configure_api_access, read_simple_data
 
@@ -46,7 +53,9 @@ def loop():
     """
     Read and evaluate expressions provided by the user.
     """
-    engine, session = database.initialize('sqlite:///../data/isrid-master.db')
+    path = '../data/isrid-master.db'
+    engine, session = database.initialize('sqlite:///' + path)
+    cache = CurveCache(path, DEFAULT_DIRECTORY)
     print('Shell initialized at: {}'.format(datetime.datetime.now()))
 
     cmd = 1  # You can change your prompt to include the command number
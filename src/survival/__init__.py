@@ -0,0 +1,22 @@
+"""
+survival -- Fitted survival curves for interactive use
+
+The purpose of this package is to serve survival curves quickly, whether to the
+Bokeh frontend, the shell, or scripts. Each submodule handles one concern:
+`dataset` keeps a columnar snapshot of the cases, `cohort` selects the cases
+matching a set of constraints, `curves` fits Kaplan-Meier step functions with
+confidence intervals, `cache` stores fitted curves by cohort so that they are
+only fitted once per database snapshot, `simplify` shrinks curves for display,
+`logrank` compares the curves of many categories at once, and `table`
+precomputes every category's curve on a time grid for fast lookups. `export`
+writes the curves of every category, age band and sex to a static page.
+`metrics` records how long serving curves takes, for the servers to report.
+`api` serves curves as JSON over HTTP (it is not imported here, since it needs
+Tornado).
+"""
+
+__all__ = ['cache', 'cohort', 'curves', 'dataset', 'export', 'logrank',
+           'metrics', 'simplify', 'table']
+
+from survival import (curves, cache, cohort, dataset, export, logrank,
+                      metrics, simplify, table)
@@ -0,0 +1,262 @@
+"""
+survival.api -- JSON endpoints for survival curves
+
+The same curves the Bokeh frontend draws can be requested over HTTP:
+
+    GET /curve?categories=Hiker&categories=Hunter&min_age=18&sexes=1&sexes=2
+
+responds with the cohort's Kaplan-Meier curve and its pointwise confidence
+interval:
+
+    {"cohort": {...}, "count": 2568, "times": [...], "survival": [...],
+     "lower": [...], "upper": [...]}
+
+The filters are the frontend's: `categories` and `sexes` may be repeated,
+`min_age`, `max_age`, `min_size` and `max_size` are inclusive bounds, `sex` is
+an exact sex code, and a filter that is left out matches every case. Three
+more arguments shrink the response for large cohorts (see `survival.simplify`):
+`tolerance` (the smallest drop in survival to keep, zero by default),
+`max_points` (the greatest number of points to keep), and `binary=1`, which
+encodes each array as base64 single-precision floats instead of a list of
+numbers. `GET /categories` lists the categories from largest to smallest, with
+their number of cases.
+
+The handlers share the process's dataset, cohort index and curve cache (see
+`survival.dataset`, `survival.cohort` and `survival.cache`), and fits run on
+the cache's worker threads, so a slow fit does not block other requests. The
+API can be run on its own (curves are still shared with the frontend through
+the cache's directory); navigate to `src` and execute
+
+    $ python3 -m survival.api --port 5007
+
+`GET /metrics` reports the process's metrics in the Prometheus text format
+(see `survival.metrics`). When profiling is enabled (`--profiling`),
+`GET /profile?seconds=5` samples the stacks of the server's threads for that
+long and responds with their counts, for flame graph tools.
+
+Alternatively, `patterns` returns the routes for any Tornado server, such as
+one started with `bokeh.server.server.Server(..., extra_patterns=...)`.
+"""
+
+__all__ = ['DEFAULT_PORT', 'MAX_PROFILE_SECONDS', 'parse_cohort',
+           'CurveHandler', 'CategoriesHandler', 'MetricsHandler',
+           'ProfileHandler', 'monitoring_patterns', 'patterns',
+           'make_application']
+
+import argparse
+import logging
+import numpy as np
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.web import Application, HTTPError, RequestHandler
+
+from survival.cache import shared_cache
+from survival.cohort import prewarm, shared_index
+from survival.dataset import load_shared
+from survival.metrics import PHASES, profile, render
+from survival.simplify import encode_array, simplify
+
+DEFAULT_PORT = 5007
+MAX_PROFILE_SECONDS = 60
+
+
+def parse_cohort(arguments):
+    """
+    Convert query arguments to a cohort definition.
+
+    Arguments:
+        arguments: A dictionary mapping argument names to lists of strings (as
+                   in `tornado.httputil.HTTPServerRequest.query_arguments`,
+                   though the values may also be bytes).
+
+    Returns:
+        A dictionary of constraints (see `survival.cohort.CohortIndex.mask`).
+
+    Raises:
+        ValueError: when an argument is unknown or is not a number.
+    """
+    decode = lambda value: (value.decode('utf-8')
+                            if isinstance(value, bytes) else value)
+    cohort = {}
+    for name, values in arguments.items():
+        values = list(map(decode, values))
+        if name == 'categories':
+            cohort[name] = values
+        elif name == 'sexes':
+            cohort[name] = [int(value) for value in values]
+        elif name == 'sex':
+            cohort[name] = int(values[-1])
+        elif name in ('min_age', 'max_age', 'min_size', 'max_size'):
+            cohort[name] = float(values[-1])
+        else:
+            raise ValueError('unknown filter: {}'.format(name))
+    return cohort
+
+
+class JSONHandler(RequestHandler):
+    """ A request handler that also reports errors as JSON. """
+    def write_error(self, status_code, **kwargs):
+        error = kwargs.get('exc_info', (None, None))[1]
+        message = getattr(error, 'log_message', None) or self._reason
+        self.finish({'error': message})
+
+
+class CurveHandler(JSONHandler):
+    """
+    Respond with the Kaplan-Meier curve of a cohort (see the module
+    documentation).
+    """
+    def initialize(self, index, cache):
+        self.index, self.cache = index, cache
+
+    @gen.coroutine
+    def get(self):
+        arguments = dict(self.request.query_arguments)
+        try:
+            tolerance = float(arguments.pop('tolerance', [0])[-1])
+            max_points = arguments.pop('max_points', [None])[-1]
+            max_points = None if max_points is None else int(max_points)
+            binary = arguments.pop('binary', [b'0'])[-1] not in (b'0', '0')
+            cohort = parse_cohort(arguments)
+        except ValueError as error:
+            raise HTTPError(400, str(error))
+        if max_points is not None and max_points < 2:
+            raise HTTPError(400, 'max_points must be at least 2')
+
+        cohort = self.index.normalize(cohort)
+        curve = yield self.cache.submit(cohort,
+                                        lambda: self.index.fit(cohort))
+        with PHASES.time('serialize'):
+            curve = simplify(curve, tolerance, max_points)
+            encode = encode_array if binary else lambda array: array.tolist()
+            self.write({'cohort': cohort, 'count': curve.count,
+                        'times': encode(curve.times),
+                        'survival': encode(curve.survival),
+                        'lower': encode(curve.lower),
+                        'upper': encode(curve.upper)})
+
+
+class CategoriesHandler(JSONHandler):
+    """
+    Respond with the categories and their number of cases, from largest to
+    smallest.
+    """
+    def initialize(self, index, cache):
+        self.index = index
+
+    def get(self):
+        order = np.argsort(-self.index.counts, kind='stable')
+        self.write({'categories': self.index.labels[order].tolist(),
+                    'counts': self.index.counts[order].tolist()})
+
+
+class MetricsHandler(RequestHandler):
+    """ Respond with the process's metrics (see `survival.metrics`). """
+    def initialize(self, caches):
+        self.caches = caches
+
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4')
+        self.write(render(self.caches))
+
+
+class ProfileHandler(RequestHandler):
+    """
+    Respond with the stacks of the process's threads, sampled for `seconds`
+    (see `survival.metrics.profile`).
+    """
+    @gen.coroutine
+    def get(self):
+        try:
+            seconds = float(self.get_query_argument('seconds', 5))
+        except ValueError:
+            raise HTTPError(400, 'seconds must be a number')
+        if not 0 < seconds <= MAX_PROFILE_SECONDS:
+            raise HTTPError(400, 'seconds must be between 0 and {}'.format(
+                            MAX_PROFILE_SECONDS))
+        # Not on the cache's workers, which the profile should catch busy
+        stacks = yield IOLoop.current().run_in_executor(None, profile,
+                                                        seconds)
+        self.set_header('Content-Type', 'text/plain')
+        self.write(stacks)
+
+
+def monitoring_patterns(caches, profiling=False):
+    """
+    Get the routes reporting on the process.
+
+    Arguments:
+        caches: A sequence of `survival.cache.CurveCache` instances whose hit
+                rate should be reported.
+        profiling: Whether to allow sampling the process's stacks (which
+                   exposes the source paths of the server, and slows it down
+                   slightly while it runs).
+
+    Returns:
+        A list of Tornado URL specifications.
+    """
+    routes = [(r'/metrics', MetricsHandler, {'caches': caches})]
+    if profiling:
+        routes.append((r'/profile', ProfileHandler))
+    return routes
+
+
+def patterns(index, cache, profiling=False):
+    """
+    Get the API's routes.
+
+    Arguments:
+        index: The `survival.cohort.CohortIndex` of the cases to serve.
+        cache: The `survival.cache.CurveCache` to fit curves through.
+        profiling: Whether to serve `/profile` (see `monitoring_patterns`).
+
+    Returns:
+        A list of Tornado URL specifications.
+    """
+    options = {'index': index, 'cache': cache}
+    return [(r'/curve', CurveHandler, options),
+            (r'/categories', CategoriesHandler, options)] + \
+        monitoring_patterns([cache], profiling)
+
+
+def make_application(database_path, profiling=False, **settings):
+    """
+    Make a Tornado application serving the API for a database, loading (and
+    prewarming) the process's shared dataset and cache.
+
+    Arguments:
+        database_path: A string representing the path to the database file.
+        profiling: Whether to serve `/profile` (see `monitoring_patterns`).
+        settings: A variable number of keyword arguments passed to
+                  `tornado.web.Application`.
+
+    Returns:
+        A `tornado.web.Application` instance.
+    """
+    index = shared_index(load_shared(database_path))
+    cache = shared_cache(database_path)
+    prewarm(cache, index)
+    return Application(patterns(index, cache, profiling), **settings)
+
+
+def main():
+    """
+    Serve the API on its own.
+    """
+    parser = argparse.ArgumentParser(description='Serve survival curves.')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--database', default='../data/isrid-master.db')
+    parser.add_argument('--profiling', action='store_true',
+                        help='serve /profile')
+    arguments = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    make_application(arguments.database,
+                     arguments.profiling).listen(arguments.port)
+    logging.getLogger().info('Serving curves on port {}'.format(
+                             arguments.port))
+    IOLoop.current().start()
+
+
+if __name__ == '__main__':
+    main()
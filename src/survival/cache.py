@@ -0,0 +1,302 @@
+"""
+survival.cache -- Fitted survival curves keyed by cohort
+
+A cohort is described by a dictionary of filters (for instance,
+`{'categories': ['Hiker'], 'sexes': [1], 'ages': [18, 65]}`). `CurveCache`
+hashes a canonical form of the filters together with a version of the database
+snapshot, and stores each fitted `survival.curves.Curve` under that key, first
+in a small in-memory LRU cache and then on disk as a `.npz` file. Repeated
+requests for a cohort are answered from memory without touching the data.
+
+The snapshot version is derived from the database file's real path, size, and
+modification time, so the cache invalidates itself whenever the database
+changes (or `isrid-master.db` is pointed at a different snapshot). The file is
+checked at most once a second by default.
+
+`shared_cache` returns one cache per database for the whole process, so every
+session of the frontend shares the curves fitted for any of them.
+"""
+
+__all__ = ['DEFAULT_DIRECTORY', 'canonicalize', 'snapshot_version',
+           'CurveCache', 'shared_cache']
+
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import hashlib
+import json
+import logging
+import numbers
+import os
+import tempfile
+import threading
+import time
+import numpy as np
+
+from survival.curves import Curve
+
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser('~'), '.cache', 'sarbayes',
+                                 'curves')
+
+_shared, _shared_lock = {}, threading.Lock()
+
+
+def canonicalize(cohort):
+    """
+    Convert a cohort definition to a canonical JSON string.
+
+    Keys are sorted, sequences are treated as sets (sorted, with duplicates
+    removed), NumPy scalars become plain numbers, and whole numbers are
+    written as integers, so two definitions of the same cohort produce the
+    same string.
+
+    Arguments:
+        cohort: A dictionary mapping filter names to values (strings, numbers,
+                `None`, or sequences of those).
+
+    Returns:
+        A JSON string.
+    """
+    def convert(value):
+        if isinstance(value, (list, tuple, set, frozenset, np.ndarray)):
+            items = {json.dumps(item): item for item in map(convert, value)}
+            return [items[item] for item in sorted(items)]
+        elif isinstance(value, np.generic):
+            return convert(value.item())
+        elif isinstance(value, numbers.Integral) or value is None:
+            return value
+        elif isinstance(value, numbers.Real):  # 18.0 is the same bound as 18
+            value = float(value)
+            return int(value) if value.is_integer() else value
+        return str(value)
+
+    cohort = {str(key): convert(value) for key, value in cohort.items()}
+    return json.dumps(cohort, sort_keys=True, separators=(',', ':'))
+
+
+def snapshot_version(path):
+    """
+    Identify the current version of a database file.
+
+    Arguments:
+        path: A string representing the path to the database file.
+
+    Returns:
+        A string that changes whenever the file is modified or the path is
+        pointed at another file.
+    """
+    real_path = os.path.realpath(path)
+    status = os.stat(real_path)
+    return '{}:{}:{}'.format(real_path, status.st_size, status.st_mtime_ns)
+
+
+class CurveCache:
+    """
+    A two-level (memory and disk) cache of fitted survival curves.
+
+    Attributes:
+        path: The path to the database file the curves are fitted from.
+        directory: The directory curves are stored in (`None` to keep curves
+                   in memory only).
+        size: The maximum number of curves kept in memory.
+        check_every: The least number of seconds between checks of the
+                     database's version.
+        workers: The number of threads `submit` fits curves with.
+        hits: The number of requests answered from memory.
+        disk_hits: The number of requests answered from disk.
+        misses: The number of requests that required fitting a curve.
+    """
+    def __init__(self, path, directory=None, size=256, check_every=1,
+                 workers=2):
+        self.path, self.directory, self.size = path, directory, size
+        self.check_every, self.checked = check_every, -float('inf')
+        self.workers, self.executor, self.pending = workers, None, {}
+        self.hits = self.disk_hits = self.misses = 0
+        self.curves, self.version = OrderedDict(), None
+        self.lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def refresh(self):
+        """
+        Check the version of the database, and discard the cached curves if it
+        has changed.
+
+        Returns:
+            A short hash of the current version.
+        """
+        now = time.monotonic()
+        if now - self.checked < self.check_every:
+            return self.version
+        self.checked = now
+
+        version = hashlib.sha1(snapshot_version(self.path).encode('utf-8'))
+        version = version.hexdigest()[:16]
+        if version != self.version:
+            with self.lock:
+                self.curves.clear()
+                self.version = version
+            self.prune()
+        return version
+
+    def key(self, cohort):
+        """ Hash a cohort definition together with the database version. """
+        cohort = canonicalize(cohort).encode('utf-8')
+        return '{}-{}'.format(self.refresh(),
+                              hashlib.sha1(cohort).hexdigest()[:24])
+
+    def filename(self, key):
+        """ Get the path a curve with the given key is stored at. """
+        return os.path.join(self.directory, key + '.npz')
+
+    def get(self, cohort, fit):
+        """
+        Get the curve of a cohort, fitting it only if necessary.
+
+        Arguments:
+            cohort: A dictionary describing the cohort (see `canonicalize`).
+            fit: A function with no arguments that returns the cohort's
+                 `Curve`. It is called only on a miss.
+
+        Returns:
+            A `Curve` instance. Treat its arrays as read-only, since they are
+            shared between requests.
+        """
+        key = self.key(cohort)
+        with self.lock:
+            curve = self.curves.get(key)
+            if curve is not None:
+                self.curves.move_to_end(key)
+                self.hits += 1
+                return curve
+
+        curve = self.load(key)
+        if curve is not None:
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            curve = fit()
+            self.store(key, curve)
+
+        with self.lock:
+            self.curves[key] = curve
+            while len(self.curves) > self.size:
+                self.curves.popitem(last=False)
+        return curve
+
+    def submit(self, cohort, fit):
+        """
+        Get the curve of a cohort without blocking the calling thread.
+
+        Curves in memory are returned at once, and the rest are read or
+        fitted on a pool of worker threads. Concurrent requests for the same
+        cohort (from any thread) share a single fit.
+
+        Arguments:
+            cohort: A dictionary describing the cohort (see `canonicalize`).
+            fit: A function with no arguments that returns the cohort's
+                 `Curve`. It is called on a worker thread, and only on a miss.
+
+        Returns:
+            A `concurrent.futures.Future` of the `Curve`.
+        """
+        key = self.key(cohort)
+        with self.lock:
+            curve = self.curves.get(key)
+            if curve is not None:
+                self.curves.move_to_end(key)
+                self.hits += 1
+                future = Future()
+                future.set_result(curve)
+                return future
+
+            future = self.pending.get(key)
+            if future is None:
+                future = self.run(self.get, cohort, fit)
+                self.pending[key] = future
+                # The callback must not take the lock: a future that has
+                # already finished calls it right away, with the lock held
+                future.add_done_callback(
+                    lambda _: self.pending.pop(key, None))
+        return future
+
+    def run(self, function, *arguments):
+        """
+        Call a function on the cache's worker threads (for work related to
+        the curves, like comparing them).
+
+        Returns:
+            A `concurrent.futures.Future` of the function's result.
+        """
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(self.workers)
+        return self.executor.submit(function, *arguments)
+
+    def load(self, key):
+        """ Read a curve from disk, or return `None` if it is not stored. """
+        if self.directory is None:
+            return None
+        try:
+            with np.load(self.filename(key)) as arrays:
+                return Curve(*(arrays[field] for field in Curve._fields[:-1]),
+                             count=int(arrays['count']))
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def store(self, key, curve):
+        """ Write a curve to disk atomically (if there is a directory). """
+        if self.directory is None:
+            return
+        descriptor, temporary = tempfile.mkstemp(suffix='.tmp',
+                                                 dir=self.directory)
+        try:
+            with os.fdopen(descriptor, 'wb') as curve_file:
+                np.savez(curve_file, **curve._asdict())
+            os.replace(temporary, self.filename(key))
+        except OSError as error:
+            logging.getLogger().warning('Unable to cache curve: {}'.format(
+                                        error))
+            if os.path.exists(temporary):
+                os.remove(temporary)
+
+    def prune(self):
+        """ Delete stored curves fitted to other versions of the database. """
+        if self.directory is None:
+            return
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.npz') and \
+                    not filename.startswith(self.version + '-'):
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except OSError:
+                    pass
+
+    def clear(self):
+        """ Discard every cached curve, in memory and on disk. """
+        with self.lock:
+            self.curves.clear()
+            self.version, self.checked = None, -float('inf')
+        if self.directory is not None:
+            for filename in os.listdir(self.directory):
+                if filename.endswith('.npz'):
+                    os.remove(os.path.join(self.directory, filename))
+
+
+def shared_cache(path, directory=DEFAULT_DIRECTORY, size=1024, workers=4):
+    """
+    Get the cache of curves for a database that is shared by the whole process
+    (for instance, by every session of the frontend), creating it on first use.
+
+    Arguments:
+        path: The path to the database file the curves are fitted from.
+        directory: The directory curves are stored in.
+        size: The maximum number of curves kept in memory.
+        workers: The number of threads curves are fitted with.
+
+    Returns:
+        A `CurveCache` instance.
+    """
+    key = os.path.realpath(path), directory
+    with _shared_lock:
+        if key not in _shared:
+            _shared[key] = CurveCache(path, directory, size, workers=workers)
+        return _shared[key]
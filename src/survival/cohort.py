@@ -0,0 +1,237 @@
+"""
+survival.cohort -- Fast selection of the cases in a cohort
+
+The frontend describes a cohort with a dictionary of widget values (see
+`survival.cache.canonicalize`). Filtering a dataframe once per constraint
+allocates a new frame for every step, which adds up when many categories are
+selected. `CohortIndex` instead converts the dataset to plain arrays once,
+with the categories replaced by integer codes and the sexes by precomputed
+masks, so any combination of constraints resolves to an array of row indices
+with a handful of vectorized comparisons:
+
+    >>> index = CohortIndex(df)
+    >>> rows = index.select({'categories': ['Hiker'], 'min_age': 18})
+    >>> fit_curve(index.days[rows], index.doa[rows])
+
+Categories are matched with a lookup table indexed by category code, so
+selecting hundreds of categories costs about as much as selecting one.
+"""
+
+__all__ = ['CohortIndex', 'shared_index', 'prewarm']
+
+import threading
+import numpy as np
+
+from survival.curves import fit_curve
+from survival.logrank import multivariate_logrank
+from survival.metrics import PHASES
+
+_shared, _shared_lock = [None, None], threading.Lock()
+
+
+class CohortIndex:
+    """
+    A read-only index of cases for selecting cohorts.
+
+    Attributes:
+        labels: The sorted array of category labels.
+        codes: The position of each case's category in `labels`.
+        positions: A dictionary mapping each label to its position.
+        counts: The number of cases in each category.
+        days: The incident time of each case in days.
+        doa: Whether each case ended with the subject dead-on-arrival.
+        age: The age of each case's subject in years.
+        size: The size of each case's group.
+        sex: The sex code of each case's subject.
+        male: Whether each case's subject is male.
+        female: Whether each case's subject is female.
+        bounds: A dictionary mapping `'size'` and `'age'` to the least and
+                greatest value of the column (empty without cases).
+    """
+    def __init__(self, columns):
+        """
+        Index the columns of a dataset.
+
+        Arguments:
+            columns: A `pandas` dataframe or a dictionary of arrays with (at
+                     least) the columns in `survival.dataset.COLUMNS`.
+        """
+        array = lambda name: np.asarray(columns[name])
+        self.labels, self.codes = np.unique(array('category').astype(str),
+                                            return_inverse=True)
+        self.positions = {label: code
+                          for code, label in enumerate(self.labels)}
+        self.counts = np.bincount(self.codes, minlength=len(self.labels))
+        self.days, self.doa = array('days'), array('doa').astype(bool)
+        self.age, self.size = array('age'), array('size')
+        self.sex = array('sex')
+        self.male, self.female = self.sex == 1, self.sex == 2
+        self.bounds = {}
+        if len(self.codes) > 0:
+            for name in 'size', 'age':
+                column = getattr(self, name)
+                self.bounds[name] = column.min().item(), column.max().item()
+
+    def __len__(self):
+        return len(self.codes)
+
+    def mask(self, cohort):
+        """
+        Find the cases in a cohort.
+
+        Arguments:
+            cohort: A dictionary of constraints. `categories` is a sequence of
+                    category labels (unknown labels match nothing), and
+                    `min_size`, `max_size`, `min_age` and `max_age` are
+                    inclusive bounds. `sexes` is a sequence of sex codes, where
+                    leaving out 1 (male) or 2 (female) excludes those
+                    subjects, while `sex` is the one code every subject must
+                    have (so subjects of unknown sex never match it). Missing
+                    constraints match every case.
+
+        Returns:
+            A boolean array with one element for each case.
+        """
+        mask = np.ones(len(self), bool)
+        if 'categories' in cohort:
+            allowed = np.zeros(len(self.labels), bool)
+            allowed[[self.positions[category]
+                     for category in cohort['categories']
+                     if category in self.positions]] = True
+            mask &= allowed.take(self.codes)
+
+        for name, column, compare in (('min_size', self.size, np.greater_equal),
+                                      ('max_size', self.size, np.less_equal),
+                                      ('min_age', self.age, np.greater_equal),
+                                      ('max_age', self.age, np.less_equal)):
+            if cohort.get(name) is not None:
+                mask &= compare(column, cohort[name])
+
+        if 'sexes' in cohort:
+            if 1 not in cohort['sexes']:
+                mask &= ~self.male
+            if 2 not in cohort['sexes']:
+                mask &= ~self.female
+        if cohort.get('sex') is not None:
+            mask &= self.sex == cohort['sex']
+        return mask
+
+    def normalize(self, cohort):
+        """
+        Rewrite a cohort so that every set of constraints selecting the same
+        cases in the same way has the same definition (and so the same cache
+        key).
+
+        Unknown categories are dropped, and so are constraints that exclude
+        nothing: bounds at or beyond the range of the data, both sexes, and
+        every category.
+
+        Arguments:
+            cohort: A dictionary of constraints (see `mask`).
+
+        Returns:
+            A new dictionary of constraints that selects the same cases.
+        """
+        normalized = {}
+        if 'categories' in cohort:
+            categories = sorted(set(category
+                                    for category in cohort['categories']
+                                    if category in self.positions))
+            if len(categories) < len(self.labels):
+                normalized['categories'] = categories
+
+        for name in 'size', 'age':
+            low, high = self.bounds.get(name, (None, None))
+            value = cohort.get('min_' + name)
+            if value is not None and (low is None or value > low):
+                normalized['min_' + name] = value
+            value = cohort.get('max_' + name)
+            if value is not None and (high is None or value < high):
+                normalized['max_' + name] = value
+
+        if 'sexes' in cohort:
+            sexes = sorted(set(cohort['sexes']) & {1, 2})
+            if len(sexes) < 2:
+                normalized['sexes'] = sexes
+        if cohort.get('sex') is not None:
+            normalized['sex'] = cohort['sex']
+        return normalized
+
+    def select(self, cohort):
+        """
+        Find the row indices of the cases in a cohort (see `mask`).
+
+        Returns:
+            An increasing array of row indices.
+        """
+        return np.flatnonzero(self.mask(cohort))
+
+    def fit(self, cohort, confidence=0.95):
+        """
+        Fit the survival curve of a cohort (see `survival.curves.fit_curve`),
+        recording the time spent selecting its cases and fitting the curve in
+        `survival.metrics.PHASES`.
+        """
+        with PHASES.time('filter'):
+            rows = self.select(cohort)
+        with PHASES.time('fit'):
+            return fit_curve(self.days[rows], self.doa[rows], confidence)
+
+    def compare(self, cohorts):
+        """
+        Test whether several cohorts have the same survival curve (see
+        `survival.logrank.multivariate_logrank`).
+
+        Arguments:
+            cohorts: A sequence of cohort definitions. A case in more than one
+                     cohort counts once in each.
+
+        Returns:
+            A `MultivariateResult` tuple of the statistic, its degrees of
+            freedom, and the p-value (the degrees of freedom are zero when
+            there is nothing to compare).
+        """
+        rows = [self.select(cohort) for cohort in cohorts]
+        groups = np.repeat(np.arange(len(rows)), list(map(len, rows)))
+        rows = np.concatenate(rows) if rows else np.zeros(0, np.intp)
+        return multivariate_logrank(self.days[rows], self.doa[rows], groups)
+
+
+def shared_index(columns):
+    """
+    Get the `CohortIndex` of a shared dataset (such as the dataframe returned
+    by `survival.dataset.load_shared`), building it only once per process.
+
+    Arguments:
+        columns: The shared dataset. It is compared by identity, so a new
+                 snapshot of the dataset gets a new index.
+
+    Returns:
+        A `CohortIndex` instance.
+    """
+    with _shared_lock:
+        if _shared[0] is not columns:
+            _shared[:] = columns, CohortIndex(columns)
+        return _shared[1]
+
+
+def prewarm(cache, index, count=20):
+    """
+    Fit the curves most likely to be requested first, so that they are served
+    from memory: each of the largest categories on its own, with no other
+    constraints (the state a new session of the frontend starts in).
+
+    Arguments:
+        cache: A `survival.cache.CurveCache` instance.
+        index: A `CohortIndex` instance.
+        count: The number of categories to fit.
+
+    Returns:
+        The number of curves that had to be fitted (the others were read from
+        memory or disk).
+    """
+    misses = cache.misses
+    for code in np.argsort(-index.counts, kind='stable')[:count]:
+        cohort = index.normalize({'categories': [index.labels[code]]})
+        cache.get(cohort, lambda: index.fit(cohort))
+    return cache.misses - misses
@@ -0,0 +1,62 @@
+"""
+survival.curves -- Kaplan-Meier step functions with confidence intervals
+
+A `Curve` holds plain arrays (no `pandas` or `lifelines` objects), so it is
+cheap to store, serialize, and send to a browser.
+"""
+
+__all__ = ['Curve', 'fit_curve']
+
+from collections import namedtuple
+import numpy as np
+from scipy.stats import norm
+
+from kaplanmeier import KaplanMeierModel
+
+Curve = namedtuple('Curve', ['times', 'survival', 'lower', 'upper', 'count'])
+Curve.__doc__ = """
+A fitted Kaplan-Meier curve.
+
+Attributes:
+    times: The times at which the curve steps (starting with zero).
+    survival: The probability of survival just after each time.
+    lower: The lower bound of the pointwise confidence interval.
+    upper: The upper bound of the pointwise confidence interval.
+    count: The number of cases the curve was fitted to.
+"""
+
+
+def fit_curve(times, doa, confidence=0.95):
+    """
+    Fit a Kaplan-Meier curve with a pointwise confidence interval.
+
+    The interval uses Greenwood's variance on the log(-log) scale (the same
+    "exponential Greenwood" interval `lifelines` reports), so the bounds always
+    lie between zero and one.
+
+    Arguments:
+        times: A sequence of incident times in days.
+        doa: A sequence of booleans indicating whether the incident ended with
+             the subject dead-on-arrival (same length as `times`).
+        confidence: The confidence level of the interval.
+
+    Returns:
+        A `Curve` instance. The curve starts at a survival probability of one at
+        time zero (or at the first time, if it is negative).
+    """
+    model = KaplanMeierModel().fit(times, doa, variance=True)
+    survival = model.survival_function
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_survival = np.log(survival)
+        scale = np.sqrt(model.variance)/(survival*np.abs(log_survival))
+        z = norm.ppf((1 + confidence)/2)
+        lower = np.where(survival > 0, survival**np.exp(z*scale), 0.0)
+        upper = np.where(survival > 0, survival**np.exp(-z*scale), 0.0)
+    lower = np.where(survival < 1, np.nan_to_num(lower), 1.0)
+    upper = np.where(survival < 1, np.nan_to_num(upper, nan=1.0), 1.0)
+
+    start = min(0.0, model.timeline[0]) if len(model.timeline) else 0.0
+    prepend = lambda value, array: np.concatenate([[value], array])
+    return Curve(prepend(start, model.timeline), prepend(1.0, survival),
+                 prepend(1.0, lower), prepend(1.0, upper), len(times))
@@ -0,0 +1,165 @@
+"""
+survival.dataset -- Columnar snapshot of the cases the curves are fitted to
+
+Querying the cases out of the database takes seconds (a join over three
+tables, with a subquery counting the members of every group), which is too
+slow to repeat whenever the frontend opens a new session. `load_dataset` runs
+the query once per database snapshot and stores the result as plain NumPy
+columns in a `.npz` file next to the curve cache. The file records the
+snapshot version (see `survival.cache.snapshot_version`), so it is rebuilt
+automatically when the database changes.
+
+`load_shared` additionally keeps the loaded columns in memory for the life of
+the process. The Bokeh server loads them once when it starts (see
+`server.server_lifecycle`), and every session then shares the same read-only
+arrays.
+"""
+
+__all__ = ['DEFAULT_PATH', 'COLUMNS', 'query_dataset', 'write_dataset',
+           'read_dataset', 'load_dataset', 'load_shared']
+
+import logging
+import os
+import tempfile
+import threading
+import time
+import numpy as np
+import pandas as pd
+
+from survival.cache import snapshot_version
+from survival.metrics import DATASET_LOAD
+
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'sarbayes',
+                            'dataset.npz')
+COLUMNS = 'days', 'doa', 'category', 'age', 'sex', 'size'
+
+_shared, _shared_lock = {}, threading.Lock()
+
+
+def query_dataset(path):
+    """
+    Query the cases (with their category, age, sex, and group size) from the
+    database.
+
+    Cases with a missing value or a negative duration are left out.
+
+    Arguments:
+        path: A string representing the path to the database file.
+
+    Returns:
+        A dictionary mapping each name in `COLUMNS` to a NumPy array.
+    """
+    import database
+    from database.models import Group, Incident, Subject
+    from database.processing import tabulate
+
+    engine, session = database.initialize('sqlite:///' + path)
+    query = session.query(Subject.survived, Incident.total_hours,
+                          Group.category, Subject.age, Subject.sex, Group.size)
+    df = tabulate(query.select_from(Subject).join(Group).join(Incident))
+    database.terminate(engine, session)
+
+    days = pd.to_timedelta(df.total_hours).dt.total_seconds().values/3600/24
+    valid = days >= 0
+    columns = {'days': days, 'doa': ~df.survived.values.astype(bool),
+               'category': df.category.values.astype(str),
+               'age': df.age.values.astype(np.float64),
+               'sex': df.sex.values.astype(np.int64),
+               'size': df['size'].values.astype(np.int64)}
+    return {name: column[valid] for name, column in columns.items()}
+
+
+def write_dataset(path, columns, version):
+    """
+    Store the columns of a dataset atomically.
+
+    Arguments:
+        path: The path of the `.npz` file to write.
+        columns: A dictionary mapping each name in `COLUMNS` to an array.
+        version: The snapshot version of the database the columns came from.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(suffix='.tmp',
+                                             dir=os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(descriptor, 'wb') as dataset_file:
+            np.savez(dataset_file, version=version, **columns)
+        os.replace(temporary, path)
+    except OSError:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+def read_dataset(path, version=None):
+    """
+    Read a stored dataset.
+
+    Arguments:
+        path: The path of the `.npz` file to read.
+        version: If not `None`, the snapshot version the dataset must have.
+
+    Returns:
+        A dictionary mapping each name in `COLUMNS` to a read-only array, or
+        `None` if the file is missing, unreadable, or has another version.
+    """
+    try:
+        with np.load(path) as arrays:
+            if version is not None and str(arrays['version']) != version:
+                return None
+            columns = {name: arrays[name] for name in COLUMNS}
+    except (OSError, KeyError, ValueError):
+        return None
+    for column in columns.values():
+        column.flags.writeable = False
+    return columns
+
+
+def load_dataset(database_path, path=DEFAULT_PATH):
+    """
+    Read the dataset of the current database snapshot, querying the database
+    (and storing the result) only if it has not been stored yet.
+
+    Arguments:
+        database_path: A string representing the path to the database file.
+        path: The path of the stored dataset (`None` to always query).
+
+    Returns:
+        A dictionary mapping each name in `COLUMNS` to a read-only array.
+    """
+    version = snapshot_version(database_path)
+    columns = None if path is None else read_dataset(path, version)
+    if columns is None:
+        columns = query_dataset(database_path)
+        if path is not None:
+            try:
+                write_dataset(path, columns, version)
+            except OSError as error:
+                logging.getLogger().warning('Unable to store dataset: '
+                                            '{}'.format(error))
+        for column in columns.values():
+            column.flags.writeable = False
+    return columns
+
+
+def load_shared(database_path, path=DEFAULT_PATH):
+    """
+    Load the dataset once per process (per database snapshot), and share it.
+
+    Arguments:
+        database_path: A string representing the path to the database file.
+        path: The path of the stored dataset (see `load_dataset`).
+
+    Returns:
+        A `pandas` dataframe with one column for each name in `COLUMNS`. The
+        dataframe is shared, so it must not be modified in place.
+    """
+    key = os.path.realpath(database_path), snapshot_version(database_path)
+    with _shared_lock:
+        if key not in _shared:
+            _shared.clear()
+            start = time.perf_counter()
+            _shared[key] = pd.DataFrame(load_dataset(database_path, path),
+                                        columns=COLUMNS, copy=False)
+            DATASET_LOAD.set(time.perf_counter() - start)
+        return _shared[key]
@@ -0,0 +1,267 @@
+"""
+survival.export -- Static bundle of precomputed curves with a viewer page
+
+Most visitors only look at the curve of one category, perhaps narrowed to an
+age band or a sex, which needs no server at all if every such curve has been
+fitted in advance. `export_curves` fits the Kaplan-Meier curve of every cell of
+the lattice
+
+    categories x age bands (and any age) x sexes (and any sex)
+
+using the age bands of `survival.table`, and simplifies each curve for display
+(see `survival.simplify`). `write_bundle` stores the curves as `curves.json`,
+with each array packed as base64 single-precision floats, next to an
+`index.html` page that loads them and redraws the plot in the browser whenever
+a menu changes. Copy the directory to any static file host (the page fetches
+the bundle, so browsers will not load it from a `file://` address).
+
+To export the curves from the database, navigate to `src` and execute
+
+    $ python3 -m survival.export --output ../export
+"""
+
+__all__ = ['DEFAULT_DIRECTORY', 'PAGE', 'export_curves', 'write_bundle']
+
+import argparse
+import json
+import os
+import tempfile
+import numpy as np
+
+from survival.curves import fit_curve
+from survival.dataset import load_dataset
+from survival.simplify import encode_array, simplify
+from survival.table import DEFAULT_AGE_EDGES, _subsets
+
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser('~'), '.cache', 'sarbayes',
+                                 'export')
+SEX_NAMES = 'Any sex', 'Male', 'Female'  # The order of `_subsets`
+
+PAGE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>Lost Person Survival Over Time</title>
+<style>
+  body { font-family: sans-serif; margin: 2em; }
+  select { margin-right: 1em; }
+  svg text { font-size: 12px; }
+  .band { fill: steelblue; fill-opacity: 0.2; stroke: none; }
+  .curve { fill: none; stroke: steelblue; stroke-width: 2; }
+  .axis { stroke: black; }
+</style>
+</head>
+<body>
+<h2>Lost Person Survival Over Time</h2>
+<p>
+  <select id="category"></select>
+  <select id="age"></select>
+  <select id="sex"></select>
+</p>
+<svg id="plot" width="1000" height="450"></svg>
+<p id="status">Loading...</p>
+<script>
+"use strict";
+var WIDTH = 1000, HEIGHT = 450, MARGIN = 50;
+var bundle;
+
+function decode(array) {
+  // Packed little-endian, the byte order of practically every browser
+  var text = atob(array.__ndarray__), bytes = new Uint8Array(text.length);
+  for (var i = 0; i < text.length; i++) bytes[i] = text.charCodeAt(i);
+  return new Float32Array(bytes.buffer);
+}
+
+function fill(id, names) {
+  var select = document.getElementById(id);
+  names.forEach(function (name, index) {
+    select.add(new Option(name, index));
+  });
+  select.addEventListener('change', draw);
+}
+
+function steps(times, values, x, y) {
+  var path = [];
+  for (var i = 0; i < times.length; i++) {
+    if (i > 0) path.push('H' + x(times[i]));
+    path.push((i > 0 ? 'V' : 'M' + x(times[i]) + ',') + y(values[i]));
+  }
+  return path;
+}
+
+function draw() {
+  var cell = bundle.curves[document.getElementById('category').value]
+                           [document.getElementById('age').value]
+                           [document.getElementById('sex').value];
+  var svg = document.getElementById('plot'), status =
+      document.getElementById('status');
+  svg.innerHTML = '';
+  if (cell === null) {
+    status.textContent = 'No cases found. Try different constraints.';
+    return;
+  }
+  var times = decode(cell.times), end = times[times.length - 1] || 1;
+  var lower = decode(cell.lower), last = times.length - 1;
+  var x = function (t) { return MARGIN + t/end*(WIDTH - 2*MARGIN); };
+  var y = function (p) { return HEIGHT - MARGIN - p*(HEIGHT - 2*MARGIN); };
+
+  // Along the upper bound, then back along the lower one
+  var band = steps(times, decode(cell.upper), x, y);
+  band.push('V' + y(lower[last]));
+  for (var i = last; i > 0; i--) {
+    band.push('V' + y(lower[i - 1]), 'H' + x(times[i - 1]));
+  }
+  var markup = '<path class="band" d="' + band.join('') + 'Z"/>' +
+      '<path class="curve" d="' +
+      steps(times, decode(cell.survival), x, y).join('') + '"/>' +
+      '<path class="axis" d="M' + MARGIN + ',' + MARGIN + 'V' +
+      (HEIGHT - MARGIN) + 'H' + (WIDTH - MARGIN) + '"/>';
+  for (var tick = 0; tick <= 5; tick++) {
+    markup += '<text x="' + x(end*tick/5) + '" y="' + (HEIGHT - MARGIN + 20) +
+        '" text-anchor="middle">' + (end*tick/5).toFixed(1) + '</text>' +
+        '<text x="' + (MARGIN - 8) + '" y="' + (y(tick/5) + 4) +
+        '" text-anchor="end">' + (tick/5).toFixed(1) + '</text>';
+  }
+  markup += '<text x="' + WIDTH/2 + '" y="' + (HEIGHT - 10) +
+      '" text-anchor="middle">Days</text>';
+  svg.innerHTML = markup;
+  status.textContent = cell.count + ' cases found (' +
+      Math.round(bundle.confidence*100) + '% confidence interval shaded).';
+}
+
+fetch('curves.json').then(function (response) {
+  return response.json();
+}).then(function (data) {
+  bundle = data;
+  fill('category', bundle.labels);
+  fill('age', bundle.age_bands);
+  fill('sex', bundle.sexes);
+  draw();
+}).catch(function (error) {
+  document.getElementById('status').textContent =
+      'Unable to load the curves: ' + error;
+});
+</script>
+</body>
+</html>
+"""
+
+
+def _band_names(age_edges):
+    """ Name the age bands of `_subsets` (the first includes every age). """
+    names = ['Any age']
+    for index, (low, high) in enumerate(zip(age_edges[:-1], age_edges[1:])):
+        if index == len(age_edges) - 2:
+            names.append('{:g}+'.format(low))
+        else:
+            names.append('{:g}-{:g}'.format(low, high - 1))
+    return names
+
+
+def export_curves(times, doa, categories, ages, sexes,
+                  age_edges=DEFAULT_AGE_EDGES, tolerance=1e-3,
+                  max_points=1000, confidence=0.95):
+    """
+    Fit and simplify the survival curve of every category, age band and sex.
+
+    Arguments:
+        times: A sequence of incident times in days.
+        doa: A sequence of booleans indicating whether the incident ended with
+             the subject dead-on-arrival (same length as `times`).
+        categories: A sequence of category labels (same length as `times`).
+        ages: A sequence of ages in years (`NaN` if unknown).
+        sexes: A sequence of sex codes.
+        age_edges: The increasing boundaries of the age bands (each band
+                   includes its lower boundary).
+        tolerance: The greatest difference in survival probability allowed
+                   between a full curve and its simplified version.
+        max_points: The greatest number of points to keep in each curve (the
+                    width of the plot in pixels).
+        confidence: The confidence level of the intervals.
+
+    Returns:
+        A dictionary that can be serialized as JSON, with the `labels` of the
+        categories, the names of the `age_bands` and `sexes` (each starting
+        with "any"), the `age_edges`, the `confidence`, and the `curves`,
+        nested by category, age band and sex. Each curve is a dictionary of
+        its `count` and its encoded `times`, `survival`, `lower` and `upper`
+        arrays (see `survival.simplify.encode_array`), or `None` if the cell
+        has no cases.
+    """
+    times, doa = np.asarray(times, np.float64), np.asarray(doa, bool)
+    ages, sexes = np.asarray(ages, np.float64), np.asarray(sexes)
+    labels, rows = np.unique(np.asarray(categories, str), return_inverse=True)
+    age_edges = list(age_edges)
+
+    curves = []
+    order = np.argsort(rows, kind='stable')
+    splits = np.searchsorted(rows[order], np.arange(1, len(labels)))
+    for cases in np.split(order, splits):
+        cells = [[None]*len(SEX_NAMES) for _ in range(len(age_edges))]
+        for age_index, sex_index, mask in _subsets(len(cases), ages[cases],
+                                                   sexes[cases], age_edges):
+            if not np.any(mask):
+                continue
+            curve = simplify(fit_curve(times[cases][mask], doa[cases][mask],
+                                       confidence), tolerance, max_points)
+            cells[age_index][sex_index] = {
+                'count': curve.count, 'times': encode_array(curve.times),
+                'survival': encode_array(curve.survival),
+                'lower': encode_array(curve.lower),
+                'upper': encode_array(curve.upper)}
+        curves.append(cells)
+
+    return {'labels': labels.tolist(), 'age_bands': _band_names(age_edges),
+            'sexes': list(SEX_NAMES), 'age_edges': age_edges,
+            'confidence': confidence, 'curves': curves}
+
+
+def write_bundle(directory, bundle):
+    """
+    Store a bundle of curves and the page that displays it.
+
+    Arguments:
+        directory: The directory to write `curves.json` and `index.html` to
+                   (created if necessary). A bundle already stored there is
+                   replaced.
+        bundle: A dictionary returned by `export_curves`.
+
+    Returns:
+        The size of `curves.json` in bytes.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for filename, content in (('curves.json', json.dumps(
+                                   bundle, separators=(',', ':'))),
+                              ('index.html', PAGE)):
+        descriptor, temporary = tempfile.mkstemp(suffix='.tmp', dir=directory)
+        with os.fdopen(descriptor, 'w', encoding='utf-8') as export_file:
+            export_file.write(content)
+        os.chmod(temporary, 0o644)  # Readable by the web server
+        os.replace(temporary, os.path.join(directory, filename))
+    return os.path.getsize(os.path.join(directory, 'curves.json'))
+
+
+def main():
+    """
+    Export the curves from the database.
+    """
+    parser = argparse.ArgumentParser(description='Export survival curves as '
+                                                 'a static page.')
+    parser.add_argument('--output', default=DEFAULT_DIRECTORY)
+    parser.add_argument('--database', default='../data/isrid-master.db')
+    parser.add_argument('--tolerance', type=float, default=1e-3)
+    parser.add_argument('--max-points', type=int, default=1000)
+    arguments = parser.parse_args()
+
+    columns = load_dataset(arguments.database)
+    bundle = export_curves(columns['days'], columns['doa'],
+                           columns['category'], columns['age'],
+                           columns['sex'], tolerance=arguments.tolerance,
+                           max_points=arguments.max_points)
+    size = write_bundle(arguments.output, bundle)
+    print('Wrote {} categories ({:.1f} MB) to {}'.format(
+          len(bundle['labels']), size/2**20, arguments.output))
+
+
+if __name__ == '__main__':
+    main()
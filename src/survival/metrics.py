@@ -0,0 +1,211 @@
+"""
+survival.metrics -- Process metrics and a sampling profiler for the servers
+
+The frontend and the API record how long each phase of serving a curve takes
+(`filter`, selecting the cohort's cases; `fit`, fitting the curve; and
+`serialize`, simplifying and encoding it), along with the number of open
+sessions and the time the dataset took to load. `render` reports those,
+together with the hit rate of every shared curve cache and the resident memory
+of the process, in the Prometheus text format:
+
+    # HELP curve_phase_seconds Time spent serving curves, by phase.
+    # TYPE curve_phase_seconds histogram
+    curve_phase_seconds_bucket{phase="fit",le="0.001"} 12
+    ...
+
+`profile` samples the stacks of every thread for a few seconds and counts
+them in the "collapsed" format flame graph tools read, which is cheap enough
+to run against a live server.
+"""
+
+__all__ = ['Histogram', 'Gauge', 'PHASES', 'SESSIONS', 'DATASET_LOAD',
+           'resident_memory', 'render', 'profile']
+
+import bisect
+from collections import Counter
+import resource
+import sys
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    """
+    A thread-safe histogram of durations, with one series for each phase.
+
+    Attributes:
+        name: The name of the metric.
+        description: A sentence describing the metric.
+        buckets: The increasing upper bounds of the buckets (in seconds).
+        series: A dictionary mapping each phase to a list of the count in each
+                bucket, the total count, and the sum of the observations.
+    """
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        self.name, self.description, self.buckets = name, description, buckets
+        self.series, self.lock = {}, threading.Lock()
+
+    def observe(self, phase, seconds):
+        """ Record a duration. """
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self.lock:
+            counts = self.series.setdefault(phase, [[0]*len(self.buckets),
+                                                    0, 0.0])
+            if index < len(self.buckets):
+                counts[0][index] += 1
+            counts[1] += 1
+            counts[2] += seconds
+
+    def time(self, phase):
+        """ Make a context manager that records how long its body takes. """
+        return _Timer(self, phase)
+
+    def lines(self):
+        """ Format the histogram in the Prometheus text format. """
+        yield '# HELP {} {}'.format(self.name, self.description)
+        yield '# TYPE {} histogram'.format(self.name)
+        with self.lock:
+            series = sorted((phase, (list(counts[0]),) + tuple(counts[1:]))
+                            for phase, counts in self.series.items())
+        for phase, (buckets, count, total) in series:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, buckets):
+                cumulative += bucket
+                yield '{}_bucket{{phase="{}",le="{}"}} {}'.format(
+                      self.name, phase, bound, cumulative)
+            yield '{}_bucket{{phase="{}",le="+Inf"}} {}'.format(
+                  self.name, phase, count)
+            yield '{}_sum{{phase="{}"}} {}'.format(self.name, phase, total)
+            yield '{}_count{{phase="{}"}} {}'.format(self.name, phase, count)
+
+
+class _Timer:
+    """ Time the body of a `with` statement into a histogram. """
+    def __init__(self, histogram, phase):
+        self.histogram, self.phase = histogram, phase
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        self.histogram.observe(self.phase, time.perf_counter() - self.start)
+
+
+class Gauge:
+    """
+    A thread-safe value that can go up and down.
+
+    Attributes:
+        name: The name of the metric.
+        description: A sentence describing the metric.
+        value: The current value.
+    """
+    def __init__(self, name, description):
+        self.name, self.description = name, description
+        self.value, self.lock = 0, threading.Lock()
+
+    def add(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+    def lines(self):
+        yield '# HELP {} {}'.format(self.name, self.description)
+        yield '# TYPE {} gauge'.format(self.name)
+        yield '{} {}'.format(self.name, self.value)
+
+
+PHASES = Histogram('curve_phase_seconds',
+                   'Time spent serving curves, by phase.')
+SESSIONS = Gauge('sessions', 'Number of open frontend sessions.')
+DATASET_LOAD = Gauge('dataset_load_seconds',
+                     'Time the shared dataset took to load.')
+
+
+def resident_memory():
+    """
+    Get the resident set size of the process in bytes (the peak size, on
+    systems without `/proc`).
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1])*resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak*1024
+
+
+def render(caches=()):
+    """
+    Report every metric in the Prometheus text format.
+
+    Arguments:
+        caches: A sequence of `survival.cache.CurveCache` instances whose
+                requests should be counted.
+
+    Returns:
+        A string.
+    """
+    lines = list(PHASES.lines()) + list(SESSIONS.lines())
+    lines += list(DATASET_LOAD.lines())
+
+    lines += ['# HELP curve_cache_requests_total Requests for curves, by '
+              'where they were answered from.',
+              '# TYPE curve_cache_requests_total counter']
+    totals = Counter()
+    for cache in caches:
+        totals.update(memory=cache.hits, disk=cache.disk_hits,
+                      fit=cache.misses)
+    for result in 'memory', 'disk', 'fit':
+        lines.append('curve_cache_requests_total{{result="{}"}} {}'.format(
+                     result, totals[result]))
+    requests = sum(totals.values())
+    lines += ['# HELP curve_cache_hit_ratio Fraction of requests for curves '
+              'answered without a fit.',
+              '# TYPE curve_cache_hit_ratio gauge',
+              'curve_cache_hit_ratio {}'.format(
+                  (requests - totals['fit'])/requests if requests else 0)]
+
+    lines += ['# HELP process_resident_memory_bytes Resident memory size.',
+              '# TYPE process_resident_memory_bytes gauge',
+              'process_resident_memory_bytes {}'.format(resident_memory())]
+    return '\n'.join(lines) + '\n'
+
+
+def profile(seconds=5, interval=0.005):
+    """
+    Sample the stacks of every other thread at regular intervals.
+
+    Arguments:
+        seconds: How long to sample for.
+        interval: The time between samples in seconds.
+
+    Returns:
+        A string with one line for each distinct stack, in the "collapsed"
+        format (frames from the outermost inwards, separated by semicolons,
+        then the number of samples), from the most to the least common.
+    """
+    samples, current = Counter(), threading.get_ident()
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        for ident, frame in sys._current_frames().items():
+            if ident == current:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{} ({}:{})'.format(code.co_name,
+                                                 code.co_filename,
+                                                 frame.f_lineno))
+                frame = frame.f_back
+            stack.append(names.get(ident, 'thread-{}'.format(ident)))
+            samples[';'.join(reversed(stack))] += 1
+        time.sleep(interval)
+    return ''.join('{} {}\n'.format(stack, count)
+                   for stack, count in samples.most_common())
@@ -0,0 +1,110 @@
+"""
+survival.simplify -- Smaller survival curves for display
+
+A Kaplan-Meier curve steps at every distinct time in its cohort, so the curves
+of broad cohorts have thousands of points, far more than a plot can show. Most
+of those steps are tiny (each death in a cohort of thousands lowers the curve
+by a fraction of a percent), and many fall within the same pixel.
+
+`simplify` removes steps from a `survival.curves.Curve` with two guarantees:
+
+  - Vertical: the simplified curve never differs from the full one by more
+    than `tolerance` (a drop is only drawn once the curve has fallen by at
+    least that much since the last drop drawn).
+  - Horizontal: at most `max_points` points remain (a drop is drawn at the
+    end of the interval of width `span/max_points` it falls in, so it moves by
+    less than one such interval).
+
+Raising the tolerance or lowering the number of points trades fidelity for
+smaller payloads. `encode_array` then packs an array as base64-encoded binary
+(in the format Bokeh uses for typed arrays), which is a fraction of the size
+of a JSON list of floats. Since fewer steps means longer gaps between points,
+`step_coordinates` turns the remaining points into the corners of the steps,
+so the curve is not drawn with sloped lines between them.
+"""
+
+__all__ = ['simplify', 'encode_array', 'step_coordinates']
+
+import base64
+import numpy as np
+
+from survival.curves import Curve
+
+
+def simplify(curve, tolerance=1e-3, max_points=None):
+    """
+    Remove the steps of a curve that would not be visible.
+
+    Arguments:
+        curve: A `survival.curves.Curve` instance.
+        tolerance: The greatest difference in survival probability allowed
+                   between the full and simplified curves (zero to keep every
+                   drop).
+        max_points: The greatest number of points to keep (for instance, the
+                    width of the plot in pixels), or `None` for no limit.
+
+    Returns:
+        A `Curve` with a subset of the original points, always including the
+        first and the last.
+    """
+    times, survival = curve.times, curve.survival
+    if len(times) <= 2:
+        return curve
+
+    keep = np.ones(len(times), bool)
+    if tolerance > 0:
+        # Keep the first point at each new multiple of the tolerance below one
+        levels = np.floor((1 - survival)/tolerance)
+        keep[1:] = levels[1:] != levels[:-1]
+        keep[-1] = True
+
+    if max_points is not None and np.count_nonzero(keep) > max_points:
+        # Keep the last point within each bucket of time (and the first point)
+        buckets = max(max_points - 1, 1)
+        span = times[-1] - times[0]
+        scale = buckets/span if span > 0 else 0
+        positions = np.flatnonzero(keep)
+        bins = np.minimum(((times[positions] - times[0])*scale)
+                          .astype(np.int64), buckets - 1)
+        keep[:] = False
+        keep[positions[np.append(bins[1:] != bins[:-1], True)]] = True
+
+    keep[0] = True
+    return Curve(times[keep], survival[keep], curve.lower[keep],
+                 curve.upper[keep], curve.count)
+
+
+def encode_array(array, dtype=np.float32):
+    """
+    Pack an array as base64-encoded binary (in little-endian byte order).
+
+    Arguments:
+        array: A one-dimensional array.
+        dtype: The type to convert the values to (single precision is more
+               than enough to draw a curve).
+
+    Returns:
+        A dictionary with the data (`__ndarray__`), the `dtype`, and the
+        `shape`, which Bokeh and browsers (with a `Float32Array`) can decode
+        without parsing any text.
+    """
+    array = np.ascontiguousarray(array, np.dtype(dtype).newbyteorder('<'))
+    return {'__ndarray__': base64.b64encode(array.tobytes()).decode('ascii'),
+            'dtype': array.dtype.name, 'shape': list(array.shape)}
+
+
+def step_coordinates(times, values):
+    """
+    Get the vertices of a step function, for drawing it with straight lines.
+
+    Arguments:
+        times: The times at which the function steps.
+        values: The value of the function from each time until the next.
+
+    Returns:
+        A tuple of two arrays (of twice the length, less one): the x and y
+        coordinates of the horizontal and vertical segments.
+    """
+    x = np.repeat(np.asarray(times), 2)[1:]
+    y = np.repeat(np.asarray(values), 2)[:-1]
+    return x, y
@@ -0,0 +1,260 @@
+"""
+survival.table -- Precomputed survival probabilities on a fixed time grid
+
+Most questions asked of the curves take the form "what is the probability of
+survival after `t` days for category `X`?", which needs no fitting at all if
+every curve has already been evaluated on a fine grid of times. `write_table`
+fits a Kaplan-Meier curve (with its confidence interval) for every category,
+and optionally for every age band and sex within each category, and stores
+the values as one dense `float32` array:
+
+    categories x age bands x sexes x (survival, lower, upper) x grid
+
+The first age band and the first sex always hold the whole category, so a
+query that leaves out the age or the sex of a subject still has an answer.
+
+`SurvivalTable` memory-maps the stored array, so opening a table is instant
+and only the pages that are read are loaded. The grid is evenly spaced, so a
+time is turned into a grid index with arithmetic instead of a search, and
+`SurvivalTable.predict` answers whole arrays of queries with a few array
+operations.
+
+To rebuild the table from the database, navigate to `src` and execute
+
+    $ python3 -m survival.table
+"""
+
+__all__ = ['DEFAULT_DIRECTORY', 'DEFAULT_AGE_EDGES', 'SEXES', 'write_table',
+           'SurvivalTable']
+
+import json
+import os
+import tempfile
+import numpy as np
+
+from survival.curves import fit_curve
+from survival.dataset import load_dataset
+
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser('~'), '.cache', 'sarbayes',
+                                 'table')
+DEFAULT_AGE_EDGES = (0, 13, 18, 40, 65, 150)
+SEXES = (1, 2)  # Male, female (see `database.models.Subject.SEX_CODES`)
+BOUNDS = 'survival', 'lower', 'upper'
+
+
+def _subsets(count, ages, sexes, age_edges):
+    """ Generate a mask for every age band and sex (both including "any"). """
+    age_masks = [np.ones(count, bool)]
+    if age_edges is not None:
+        age_masks += [(low <= ages) & (ages < high)
+                      for low, high in zip(age_edges[:-1], age_edges[1:])]
+    sex_masks = [np.ones(count, bool)]
+    if sexes is not None:
+        sex_masks += [sexes == sex for sex in SEXES]
+    for age_index, age_mask in enumerate(age_masks):
+        for sex_index, sex_mask in enumerate(sex_masks):
+            yield age_index, sex_index, age_mask & sex_mask
+
+
+def write_table(directory, times, doa, categories, ages=None, sexes=None,
+                age_edges=DEFAULT_AGE_EDGES, max_days=30, points=721,
+                confidence=0.95):
+    """
+    Fit and store a survival curve for every category (and subgroup).
+
+    Arguments:
+        directory: The directory to write the table to (created if necessary).
+                   Any table already stored there is replaced.
+        times: A sequence of incident times in days.
+        doa: A sequence of booleans indicating whether the incident ended with
+             the subject dead-on-arrival (same length as `times`).
+        categories: A sequence of category labels (same length as `times`).
+        ages: A sequence of ages in years (`NaN` if unknown), or `None` to
+              leave out the age axis.
+        sexes: A sequence of sex codes, or `None` to leave out the sex axis.
+        age_edges: The increasing boundaries of the age bands (each band
+                   includes its lower boundary).
+        max_days: The last time on the grid.
+        points: The number of evenly spaced times on the grid (from zero to
+                `max_days`). The default is one point every hour.
+        confidence: The confidence level of the stored intervals.
+
+    Returns:
+        The `SurvivalTable` that was written.
+    """
+    times, doa = np.asarray(times, np.float64), np.asarray(doa, bool)
+    labels, rows = np.unique(np.asarray(categories, str), return_inverse=True)
+    grid = np.linspace(0, max_days, points)
+    if ages is None:
+        age_edges = None
+    else:
+        ages, age_edges = np.asarray(ages, np.float64), list(age_edges)
+    if sexes is not None:
+        sexes = np.asarray(sexes)
+
+    shape = (len(labels), 1 if age_edges is None else len(age_edges),
+             1 if sexes is None else len(SEXES) + 1)
+    os.makedirs(directory, exist_ok=True)
+    temporary = tempfile.mkdtemp(dir=directory)
+    values = np.lib.format.open_memmap(
+        os.path.join(temporary, 'values.npy'), mode='w+', dtype=np.float32,
+        shape=shape + (len(BOUNDS), points))
+    counts = np.zeros(shape, np.int64)
+
+    order = np.argsort(rows, kind='stable')
+    splits = np.searchsorted(rows[order], np.arange(1, len(labels)))
+    for row, cases in enumerate(np.split(order, splits)):
+        subsets = _subsets(len(cases), None if ages is None else ages[cases],
+                           None if sexes is None else sexes[cases], age_edges)
+        for age_index, sex_index, mask in subsets:
+            index = row, age_index, sex_index
+            counts[index] = np.count_nonzero(mask)
+            if counts[index] == 0:
+                values[index] = np.nan
+                continue
+            curve = fit_curve(times[cases][mask], doa[cases][mask], confidence)
+            steps = np.searchsorted(curve.times, grid, side='right') - 1
+            steps = np.maximum(steps, 0)
+            values[index] = np.stack([curve.survival[steps], curve.lower[steps],
+                                      curve.upper[steps]])
+    values.flush()
+    del values
+
+    np.save(os.path.join(temporary, 'counts.npy'), counts)
+    with open(os.path.join(temporary, 'index.json'), 'w') as index_file:
+        json.dump({'labels': labels.tolist(), 'max_days': max_days,
+                   'points': points, 'age_edges': age_edges,
+                   'sexes': sexes is not None, 'confidence': confidence},
+                  index_file)
+
+    # Each replacement is atomic, so readers never see a partially written file
+    for filename in 'values.npy', 'counts.npy', 'index.json':
+        os.replace(os.path.join(temporary, filename),
+                   os.path.join(directory, filename))
+    os.rmdir(temporary)
+    return SurvivalTable(directory)
+
+
+class SurvivalTable:
+    """
+    A read-only, memory-mapped table of survival probabilities.
+
+    Attributes:
+        labels: The sorted array of category labels.
+        grid: The evenly spaced times (in days) the curves are evaluated at.
+        age_edges: The boundaries of the age bands (`None` without an age
+                   axis).
+        has_sexes: Whether the table has a sex axis.
+        confidence: The confidence level of the stored intervals.
+        values: The memory-mapped `float32` array of probabilities. Cells with
+                no cases hold `NaN`.
+        counts: The number of cases behind each cell (categories by age bands
+                by sexes).
+    """
+    def __init__(self, directory=DEFAULT_DIRECTORY):
+        with open(os.path.join(directory, 'index.json')) as index_file:
+            index = json.load(index_file)
+        self.labels = np.array(index['labels'], str)
+        self.grid = np.linspace(0, index['max_days'], index['points'])
+        self.age_edges = index['age_edges']
+        self.has_sexes = index['sexes']
+        self.confidence = index['confidence']
+        self.values = np.load(os.path.join(directory, 'values.npy'),
+                              mmap_mode='r')
+        self.counts = np.load(os.path.join(directory, 'counts.npy'))
+
+    def rows(self, categories):
+        """
+        Look up the row of each category.
+
+        Raises:
+            KeyError: when a category is not in the table.
+        """
+        categories = np.asarray(categories, str)
+        rows = np.searchsorted(self.labels, categories)
+        rows = np.minimum(rows, len(self.labels) - 1)
+        unknown = self.labels[rows] != categories
+        if np.any(unknown):
+            raise KeyError(str(categories[unknown].flat[0]))
+        return rows
+
+    def columns(self, ages=None, sexes=None):
+        """
+        Look up the age band and sex index of each subject. Unknown ages and
+        sexes (and those outside the table) fall back to the whole category.
+        """
+        age_indices = sex_indices = 0
+        if ages is not None and self.age_edges is not None:
+            ages = np.asarray(ages, np.float64)
+            age_indices = np.searchsorted(self.age_edges, ages, side='right')
+            outside = np.isnan(ages) | (age_indices >= len(self.age_edges))
+            age_indices = np.where(outside, 0, age_indices)
+        if sexes is not None and self.has_sexes:
+            sexes = np.asarray(sexes)
+            sex_indices = np.select([sexes == sex for sex in SEXES],
+                                    np.arange(1, len(SEXES) + 1), 0)
+        return age_indices, sex_indices
+
+    def predict(self, categories, times, ages=None, sexes=None,
+                interval=False):
+        """
+        Look up the probability of survival after each time.
+
+        Values between grid points are interpolated linearly, and times past
+        the end of the grid take the last value.
+
+        Arguments:
+            categories: A category label, or an array of labels (or of rows
+                        already looked up with `rows`, which saves the string
+                        search when the same categories are queried often).
+            times: A time in days, or an array of times (broadcast against the
+                   other arguments).
+            ages: An optional age, or array of ages, in years.
+            sexes: An optional sex code, or array of sex codes.
+            interval: A boolean that, when `True`, also returns the bounds of
+                      the confidence interval.
+
+        Returns:
+            An array of probabilities (`NaN` where a subgroup has no cases), or
+            a tuple of the probabilities and their lower and upper bounds if
+            `interval` is `True`.
+
+        Raises:
+            KeyError: when a category is not in the table.
+        """
+        categories = np.asarray(categories)
+        if np.issubdtype(categories.dtype, np.integer):
+            rows = categories
+        else:
+            rows = self.rows(categories)
+        age_indices, sex_indices = self.columns(ages, sexes)
+        step = self.grid[-1]/(len(self.grid) - 1)
+        position = np.clip(np.asarray(times, np.float64)/step,
+                           0, len(self.grid) - 1)
+        left = np.minimum(position.astype(np.int64), len(self.grid) - 2)
+        fraction = (position - left).astype(np.float32)
+
+        _, ages_, sexes_, bounds, points = self.values.shape
+        cells = ((rows*ages_ + age_indices)*sexes_ + sex_indices)*bounds
+        flat = self.values.reshape(-1)
+        results = []
+        for bound in range(bounds if interval else 1):
+            start = (cells + bound)*points + left
+            before, after = flat[start], flat[start + 1]
+            results.append(before + fraction*(after - before))
+        return tuple(results) if interval else results[0]
+
+
+def main():
+    """
+    Build the survival table from the database.
+    """
+    columns = load_dataset('../data/isrid-master.db')
+    table = write_table(DEFAULT_DIRECTORY, columns['days'], columns['doa'],
+                        columns['category'], columns['age'], columns['sex'])
+    print('Wrote {} categories ({:.1f} MB) to {}'.format(
+          len(table.labels), table.values.nbytes/2**20, DEFAULT_DIRECTORY))
+
+
+if __name__ == '__main__':
+    main()
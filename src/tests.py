@@ -4,21 +4,58 @@
 tests -- Unit testing
 """
 
+import base64
 import datetime
+import gzip
 import hashlib
+import http.server
+import json
+import numpy as np
 import os
+import pandas as pd
 import random
+import tempfile
+import threading
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application
 import unittest
+from unittest import mock
+from urllib.error import HTTPError
 import warnings
 import yaml
 
 import database
+from database.augmentation import bulk_update, iterate_ipps
 from database.cleaning import extract_numbers, coerce_type
 from database.models import Subject, Group, Incident, Location, Point
 from database.models import Operation, Outcome, Weather, Search
 from database.processing import survival_rate, tabulate
-from evaluation import compute_brier_score
-from weather import noaa, wsi
+from coordinates import from_utm, from_utm_array, to_utm, to_utm_array
+from coordinates import great_circle, great_circle_array
+from evaluation import bootstrap_brier_score, bootstrap_means
+from evaluation import brier_scores_over_time, censoring_survival
+from evaluation import compute_brier_score, concordance_index
+from evaluation import cross_validate
+from evaluation import integrated_brier_score
+from kaplanmeier import KaplanMeierModel, KaplanMeierTable
+from kaplanmeier import NaiveSurvivalRateModel
+from kaplanmeier import evaluate_fits, make_fitting_function
+from kaplanmeier import predict_case, predict_cases
+from survival.api import parse_cohort, patterns
+from survival.cache import CurveCache, canonicalize
+from survival.cohort import CohortIndex, prewarm
+from survival.curves import fit_curve
+from survival.dataset import load_dataset
+from survival.export import export_curves, write_bundle
+from survival.logrank import adjust_pvalues, multivariate_logrank
+from survival.logrank import pairwise_logrank
+from survival.metrics import Histogram, profile, render
+from survival.simplify import encode_array, simplify, step_coordinates
+from survival.table import SurvivalTable, write_table
+from update import STOP, Task, find_dependencies, read_state, run_tasks
+from update import augment_daylight, augment_weather_instances
+from update import find_unreadable_incidents, remove_unreadable_incidents
+from weather import noaa, solar, transport, wsi
 from util import configure_api_access
 
 
@@ -211,6 +248,808 @@ class DeletionTests(unittest.TestCase):
         database.terminate(self.engine, self.session)
 
 
+class UpdateTests(unittest.TestCase):
+    READABLE = ['2016-02-29 10:00:00.000000', '2016-07-04 12:00:00']
+    UNREADABLE = ['garbage', 'now', '10:00', '2016-07-04T12:00:00',
+                  '2016-07-04', '2016-02-30 10:00:00.000000',
+                  '2015-02-29 00:00:00', '2016-07-04 24:00:00']
+
+    def setUp(self):
+        self.engine, self.session = database.initialize('sqlite:///:memory:')
+
+        group = Group(subjects=[Subject(age=30)])
+        operation = Operation(ipp=Point(latitude=0, longitude=0))
+        self.incident = Incident(group=group, operation=operation,
+                                 weather=Weather())
+        self.empty = Incident(operation=Operation(), weather=Weather(),
+                              group=Group())
+        self.sparse = Incident(weather=Weather(rain=1), group=Group())
+        self.readable = [Incident(group=Group(subjects=[Subject()]))
+                         for value in self.READABLE]
+        self.unreadable = [Incident(group=Group(subjects=[Subject()]),
+                                    outcome=Outcome(find_point=Point()))
+                           for value in self.UNREADABLE]
+
+        instances = [self.incident, self.empty, self.sparse]
+        for instance in instances + self.readable + self.unreadable:
+            self.session.add(instance)
+        self.session.commit()
+
+        self.kept = [self.incident.id, self.sparse.id]
+        self.kept += [incident.id for incident in self.readable]
+        self.empty_id = self.empty.id
+        self.unreadable_ids = [incident.id for incident in self.unreadable]
+
+        incidents = self.readable + self.unreadable
+        values = self.READABLE + self.UNREADABLE
+        for incident, value in zip(incidents, values):
+            self.session.execute('UPDATE incidents SET datetime = :value '
+                                 'WHERE id = :id', {'value': value,
+                                                    'id': incident.id})
+        self.session.commit()
+        self.session.expunge_all()
+
+    def test_find_unreadable_incidents(self):
+        self.assertEqual(find_unreadable_incidents(self.session),
+                         self.unreadable_ids)
+        self.assertEqual(find_unreadable_incidents(self.session, True),
+                         sorted(self.unreadable_ids + [self.empty_id]))
+
+        for incident_id in self.kept:
+            self.session.query(Incident).filter_by(id=incident_id).one()
+        for incident_id in self.unreadable_ids:
+            with self.assertRaises(ValueError):
+                query = self.session.query(Incident)
+                query.filter_by(id=incident_id).one()
+
+    def test_remove_unreadable_incidents(self):
+        count = len(self.unreadable_ids)
+        self.assertEqual(remove_unreadable_incidents(self.session), count)
+        self.assertEqual(self.session.query(Outcome).count(), 0)
+        self.assertEqual(self.session.query(Point).count(), 1)
+        self.assertEqual(self.session.query(Incident).count(),
+                         len(self.kept) + 1)
+
+        self.assertEqual(remove_unreadable_incidents(self.session,
+                                                     include_empty=True), 1)
+        self.assertEqual(sorted(self.session.query(Incident.id)),
+                         [(incident_id, ) for incident_id in self.kept])
+        self.assertEqual(self.session.query(Operation).count(), 1)
+        self.assertEqual(self.session.query(Weather).count(), 2)
+        self.assertEqual(self.session.query(Subject).count(),
+                         1 + len(self.readable))
+
+    def tearDown(self):
+        database.terminate(self.engine, self.session)
+
+
+class TaskSchedulingTests(unittest.TestCase):
+    def setUp(self):
+        self.engine, self.session = database.initialize('sqlite:///:memory:')
+        self.directory = tempfile.TemporaryDirectory()
+        self.state_filename = os.path.join(self.directory.name, 'state.json')
+        self.calls = []
+
+        def make_task(name, reads=(), writes=(), fail=False):
+            def function(session):
+                self.calls.append(name)
+                if fail:
+                    raise ValueError(name)
+                return len(name)
+            function.__name__ = name
+            return Task(function, frozenset(reads) | frozenset(writes),
+                        frozenset(writes))
+
+        self.clean = make_task('clean', writes=['incidents'])
+        self.augment = make_task('augment', ['points'], ['weather'])
+        self.count = make_task('count', reads=['incidents'])
+        self.broken = make_task('broken', writes=['searches'], fail=True)
+        self.summarize = make_task('summarize', reads=['searches'])
+
+    def test_dependencies(self):
+        tasks = [self.clean, self.augment, self.count]
+        dependencies = find_dependencies(tasks)
+        self.assertEqual(dependencies[self.clean], set())
+        self.assertEqual(dependencies[self.augment], set())
+        self.assertEqual(dependencies[self.count], {self.clean})
+
+        remove = Task(None, frozenset(['weather:unreadable']),
+                      frozenset(['weather:unreadable']))
+        fill = Task(None, frozenset(['points', 'weather:readable']),
+                    frozenset(['weather:readable']))
+        dependencies = find_dependencies([remove, fill, self.augment])
+        self.assertEqual(dependencies[fill], set())
+        self.assertEqual(dependencies[self.augment], {remove, fill})
+
+    def test_failure_and_restart(self):
+        tasks = [self.clean, self.broken, self.augment, self.summarize]
+        stats = run_tasks(tasks, self.session, self.state_filename, 'a')
+        self.assertEqual(set(stats), {'clean', 'augment'})
+        self.assertEqual(stats['clean']['rows'], 5)
+        self.assertNotIn('summarize', self.calls)
+
+        self.calls.clear()
+        run_tasks(tasks, self.session, self.state_filename, 'a')
+        self.assertEqual(self.calls, ['broken'])
+
+        self.calls.clear()
+        run_tasks(tasks, self.session, self.state_filename, 'b')
+        self.assertEqual(set(self.calls), {'clean', 'broken', 'augment'})
+
+    def test_success_clears_state(self):
+        tasks = [self.clean, self.augment]
+        run_tasks(tasks, self.session, self.state_filename, 'a')
+        self.assertFalse(os.path.exists(self.state_filename))
+
+        self.calls.clear()
+        run_tasks(tasks, self.session, self.state_filename, 'a')
+        self.assertEqual(set(self.calls), {'clean', 'augment'})
+
+    def test_stop(self):
+        def wait(session):
+            self.assertTrue(STOP.wait(10))
+            self.calls.append('wait')
+
+        tasks = [Task(wait, frozenset(['weather']), frozenset(['weather']))]
+        with mock.patch('update.wait', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                run_tasks(tasks, self.session, self.state_filename, 'a')
+        self.assertEqual(self.calls, ['wait'])
+        self.assertEqual(read_state(self.state_filename, 'a')['tasks'], {})
+
+    def tearDown(self):
+        self.directory.cleanup()
+        database.terminate(self.engine, self.session)
+
+
+class AugmentationTests(unittest.TestCase):
+    def setUp(self):
+        self.engine, self.session = database.initialize('sqlite:///:memory:')
+        self.datetime = datetime.datetime(2016, 7, 4, 12)
+
+        for index in range(10):
+            ipp = Point(latitude=index, longitude=-index)
+            incident = Incident(datetime=self.datetime, weather=Weather(),
+                                operation=Operation(ipp=ipp))
+            self.session.add(incident)
+        self.session.add(Incident(weather=Weather(), operation=Operation()))
+        self.session.commit()
+        self.session.expunge_all()
+
+    def test_iterate_ipps(self):
+        batches = list(iterate_ipps(self.session, Weather, batch_size=4))
+        self.assertEqual(list(map(len, batches)), [4, 4, 2])
+
+        rows = sum(batches, [])
+        self.assertEqual(len(set(row[0] for row in rows)), 10)
+        for weather_id, datetime_, latitude, longitude in rows:
+            self.assertEqual(datetime_, self.datetime)
+            self.assertEqual(latitude, -longitude)
+
+        batches = iterate_ipps(self.session, Weather, Point.latitude > 2,
+                               columns=[Weather.rain], limit=5)
+        rows = sum(batches, [])
+        self.assertEqual(len(rows), 5)
+        self.assertTrue(all(row[2] > 2 and row[4] is None for row in rows))
+
+    def test_bulk_update(self):
+        rows = sum(iterate_ipps(self.session, Weather), [])
+        mappings = [{'id': row[0], 'rain': row[2]} for row in rows]
+        self.assertEqual(bulk_update(self.session, Weather, mappings), 10)
+        self.session.commit()
+
+        query = self.session.query(Weather).filter(Weather.rain != None)
+        self.assertEqual(query.count(), 10)
+        self.assertEqual(len(self.session.identity_map), 0)
+
+    def test_augment_weather_instances(self):
+        self.session.query(Weather).update({'low_temp': 20})
+        self.session.commit()
+        responses = [{'high_temp': 10}, {'high_temp': 30, 'low_temp': 0},
+                     {'high_temp': 25}, OSError('Connection refused')]
+
+        with mock.patch('update.configure_api_access'), \
+                mock.patch.dict(wsi.DEFAULT_PARAMETERS, userKey=''), \
+                mock.patch('update.augment_weather_instance',
+                           side_effect=responses):
+            with self.assertRaises(OSError):
+                augment_weather_instances(self.session, save_every=10)
+
+        temperatures = self.session.query(Weather.high_temp, Weather.low_temp)
+        temperatures = temperatures.filter(Weather.high_temp != None)
+        self.assertEqual(sorted(temperatures), [(25, 20), (30, 20)])
+
+    def test_augment_daylight(self):
+        self.assertEqual(augment_daylight(self.session, batch_size=3), 10)
+        query = self.session.query(Weather.daylight, Point.latitude)
+        query = query.join(Incident).join(Operation).join(Operation.ipp)
+        for duration, latitude in query:
+            expected = solar.daylight(self.datetime, latitude).item()
+            self.assertEqual(duration, expected)
+        self.assertEqual(augment_daylight(self.session), 0)
+
+    def tearDown(self):
+        database.terminate(self.engine, self.session)
+
+
+class SolarTests(unittest.TestCase):
+    def test_daylight(self):
+        # Boston on the solstices (published by the U.S. Naval Observatory)
+        dates = np.array(['2016-06-20', '2016-12-21'], dtype='datetime64[D]')
+        durations = solar.daylight(dates, 42.36).astype(float)/60
+        self.assertTrue(np.allclose(durations, [15*60 + 17, 9*60 + 4], atol=3))
+
+        durations = solar.daylight('2016-06-21', [-80, 0, 80])
+        self.assertEqual(durations[0], np.timedelta64(0, 's'))
+        self.assertEqual(durations[2], np.timedelta64(1, 'D'))
+        self.assertTrue(abs(durations[1] - np.timedelta64(12, 'h')) < 600)
+
+    def test_sunrise_sunset(self):
+        sunrise, sunset = solar.sunrise_sunset('2016-06-21', 42.36, -71.06)
+        self.assertEqual(str(sunrise)[:16], '2016-06-21T09:07')
+        self.assertEqual(str(sunset)[:16], '2016-06-22T00:24')
+
+        midnight, noon = np.datetime64('2016-06-21T04:44'), sunrise + 27900
+        irradiance = solar.clear_sky_irradiance([midnight, noon], 42.36, -71.06)
+        self.assertEqual(irradiance[0], 0)
+        self.assertTrue(800 < irradiance[1] < 1100)
+
+
+class KaplanMeierTests(unittest.TestCase):
+    def test_fit_and_predict(self):
+        model = KaplanMeierModel().fit([2, 1, 4, 2, 3], [1, 1, 0, 0, 1],
+                                       variance=True)
+        self.assertEqual(list(model.timeline), [1, 2, 3, 4])
+        predictions = model.predict([0, 1, 2.5, 10])
+        self.assertTrue(np.allclose(predictions, [1, 0.8, 0.6, 0.3]))
+        self.assertAlmostEqual(model.predict(1.5), 0.8)
+        self.assertAlmostEqual(model.variance[0], 0.64/20)
+
+        table = KaplanMeierTable([2, 1, 4, 2, 3], [1, 1, 0, 0, 1])
+        self.assertTrue(np.allclose(table().survival_function,
+                                    model.survival_function))
+        left_out = table([0, 4]).predict([0, 1, 2.5, 10])
+        self.assertTrue(np.allclose(left_out, [1, 2/3, 2/3, 2/3]))
+
+        naive = NaiveSurvivalRateModel().fit([1, 2], [0, 1])
+        self.assertEqual(naive.predict(1), 0.5)
+        self.assertEqual(naive.predict(np.zeros((2, 3))).shape, (2, 3))
+
+
+class CohortIndexTests(unittest.TestCase):
+    def setUp(self):
+        random_state = np.random.RandomState(0)
+        self.df = pd.DataFrame({
+            'days': random_state.exponential(3, 500),
+            'doa': random_state.rand(500) < 0.2,
+            'category': random_state.choice(['Child', 'Hiker', 'Hunter'], 500),
+            'age': random_state.uniform(0, 80, 500),
+            'sex': random_state.choice([0, 1, 2], 500),
+            'size': random_state.randint(1, 6, 500)})
+        self.index = CohortIndex(self.df)
+
+    def test_select(self):
+        cohort = {'categories': ['Hiker', 'Hunter', 'Skier'], 'min_size': 2,
+                  'max_size': 4, 'min_age': 18, 'max_age': 65, 'sexes': [2]}
+        df = self.df[self.df.category.isin(cohort['categories'])]
+        df = df[(df['size'] >= 2) & (df['size'] <= 4)]
+        df = df[(df.age >= 18) & (df.age <= 65) & (df.sex != 1)]
+        self.assertEqual(self.index.select(cohort).tolist(), list(df.index))
+
+        self.assertEqual(len(self.index.select({})), 500)
+        self.assertEqual(len(self.index.select({'categories': []})), 0)
+        self.assertEqual(self.index.counts.sum(), 500)
+
+    def test_normalize(self):
+        default = {'categories': ['Hiker', 'Skier'], 'min_size': 1,
+                   'max_size': 5, 'min_age': 0, 'max_age': 80, 'sexes': [2, 1]}
+        self.assertEqual(self.index.normalize(default),
+                         {'categories': ['Hiker']})
+        cohort = dict(default, categories=['Hunter', 'Child', 'Hiker'],
+                      min_age=18, sexes=[1, 9])
+        normalized = self.index.normalize(cohort)
+        self.assertEqual(normalized, {'min_age': 18, 'sexes': [1]})
+        self.assertTrue(np.array_equal(self.index.select(cohort),
+                                       self.index.select(normalized)))
+
+    def test_compare(self):
+        males = self.index.select({'sex': 1})
+        self.assertTrue(np.all(self.df.sex.values[males] == 1))
+        self.assertEqual(len(self.index.select({'sexes': [1]})),
+                         np.sum(self.df.sex != 2))
+
+        cohorts = [{'categories': ['Hiker']}, {'categories': ['Hunter']}]
+        result = self.index.compare(cohorts)
+        df = self.df[self.df.category.isin(['Hiker', 'Hunter'])]
+        expected = multivariate_logrank(df.days, df.doa, df.category)
+        self.assertAlmostEqual(result.statistic, expected.statistic)
+        self.assertEqual(result.df, 1)
+        self.assertEqual(self.index.compare(cohorts[:1]).df, 0)
+
+    def test_prewarm(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'snapshot.db')
+            with open(path, 'w') as database_file:
+                database_file.write('version 1')
+            cache = CurveCache(path)
+            self.assertEqual(prewarm(cache, self.index, count=2), 2)
+
+            largest = self.index.labels[np.argmax(self.index.counts)]
+            cohort = self.index.normalize({'categories': [largest],
+                                           'sexes': [1, 2], 'min_age': 0})
+            curve = cache.get(cohort, self.fail)
+            self.assertEqual(cache.hits, 1)
+            self.assertEqual(curve.count, self.index.counts.max())
+
+
+class CurveAPITests(AsyncHTTPTestCase):
+    def get_app(self):
+        random_state = np.random.RandomState(0)
+        self.index = CohortIndex({
+            'days': random_state.exponential(3, 300),
+            'doa': random_state.rand(300) < 0.2,
+            'category': np.repeat(['Hiker', 'Hunter', 'Child'], 100),
+            'age': random_state.uniform(0, 80, 300),
+            'sex': random_state.choice([1, 2], 300),
+            'size': random_state.randint(1, 6, 300)})
+        self.cache = CurveCache(__file__)
+        return Application(patterns(self.index, self.cache))
+
+    def test_parse_cohort(self):
+        cohort = parse_cohort({'categories': [b'Hiker', b'Hunter'],
+                               'min_age': ['18'], 'sexes': ['1', '2']})
+        self.assertEqual(cohort, {'categories': ['Hiker', 'Hunter'],
+                                  'min_age': 18.0, 'sexes': [1, 2]})
+        with self.assertRaises(ValueError):
+            parse_cohort({'max_size': ['large']})
+
+    def test_curve(self):
+        response = self.fetch('/curve?categories=Hunter&sexes=2&min_age=0')
+        self.assertEqual(response.code, 200)
+        body = json.loads(response.body.decode('utf-8'))
+        cohort = {'categories': ['Hunter'], 'sexes': [2]}
+        self.assertEqual(body['cohort'], cohort)
+        curve = self.index.fit(cohort)
+        self.assertEqual(body['count'], curve.count)
+        self.assertTrue(np.allclose(body['lower'], curve.lower))
+
+        self.fetch('/curve?categories=Hunter&sexes=2')
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+        response = self.fetch('/curve?categories=Hunter&binary=1&max_points=5')
+        body = json.loads(response.body.decode('utf-8'))
+        self.assertLessEqual(body['times']['shape'][0], 5)
+
+        response = self.fetch('/curve?colour=red')
+        self.assertEqual(response.code, 400)
+        self.assertIn('colour', json.loads(response.body.decode('utf-8'))[
+                      'error'])
+
+        response = self.fetch('/categories')
+        body = json.loads(response.body.decode('utf-8'))
+        self.assertEqual(body['counts'], [100, 100, 100])
+
+    def test_metrics(self):
+        self.fetch('/curve?categories=Child')
+        self.fetch('/curve?categories=Child')
+        metrics = self.fetch('/metrics').body.decode('utf-8')
+        self.assertIn('curve_cache_requests_total{result="memory"} 1',
+                      metrics)
+        self.assertIn('curve_cache_hit_ratio 0.5', metrics)
+        for phase in 'filter', 'fit', 'serialize':
+            self.assertIn('curve_phase_seconds_count{{phase="{}"}}'.format(
+                          phase), metrics)
+        self.assertEqual(self.fetch('/profile').code, 404)
+
+
+class CurveCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'snapshot.db')
+        with open(self.path, 'w') as database_file:
+            database_file.write('version 1')
+        self.store = os.path.join(self.directory.name, 'curves')
+        self.fits = 0
+
+    def fit(self):
+        self.fits += 1
+        return fit_curve([1, 2, 3, 3], [0, 1, 0, 1])
+
+    def test_canonicalize(self):
+        self.assertEqual(canonicalize({'b': [2, 1, 1], 'a': np.int64(3)}),
+                         canonicalize({'a': 3, 'b': (1, 2)}))
+        self.assertNotEqual(canonicalize({'a': [1]}), canonicalize({'a': [2]}))
+        self.assertEqual(canonicalize({'a': 18.0}), canonicalize({'a': 18}))
+
+    def test_memory_and_disk(self):
+        cache = CurveCache(self.path, self.store, size=1)
+        curve = cache.get({'categories': ['Hiker']}, self.fit)
+        self.assertIs(cache.get({'categories': ('Hiker',)}, self.fit), curve)
+        self.assertEqual((cache.hits, cache.misses, self.fits), (1, 1, 1))
+
+        cache.get({'categories': ['Child']}, self.fit)  # Evicts the first
+        restored = cache.get({'categories': ['Hiker']}, self.fit)
+        self.assertEqual((cache.disk_hits, self.fits), (1, 2))
+        for expected, actual in zip(curve, restored):
+            self.assertTrue(np.array_equal(expected, actual))
+
+        cache = CurveCache(self.path, self.store)
+        cache.get({'categories': ['Hiker']}, self.fit)
+        self.assertEqual((cache.disk_hits, self.fits), (1, 2))
+
+    def test_submit(self):
+        cache = CurveCache(self.path, workers=1)
+        started, release = threading.Event(), threading.Event()
+
+        def slow_fit():
+            started.set()
+            release.wait(5)
+            return self.fit()
+
+        first = cache.submit({'categories': ['Hiker']}, slow_fit)
+        started.wait(5)
+        shared = cache.submit({'categories': ['Hiker']}, self.fit)
+        queued = cache.submit({'categories': ['Child']}, self.fit)
+        self.assertIs(first, shared)
+        self.assertTrue(queued.cancel())
+        release.set()
+
+        curve = first.result(5)
+        self.assertEqual(self.fits, 1)
+        done = cache.submit({'categories': ['Hiker']}, self.fit)
+        self.assertTrue(done.done())
+        self.assertIs(done.result(), curve)
+        self.assertEqual(cache.pending, {})
+
+    def test_invalidation(self):
+        cache = CurveCache(self.path, self.store, check_every=0)
+        cache.get({'categories': ['Hiker']}, self.fit)
+        with open(self.path, 'a') as database_file:
+            database_file.write(', version 2')
+
+        cache.get({'categories': ['Hiker']}, self.fit)
+        self.assertEqual((cache.hits, cache.disk_hits, self.fits), (0, 0, 2))
+        self.assertEqual(len(os.listdir(self.store)), 1)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+class LogRankTests(unittest.TestCase):
+    def test_pairwise(self):
+        # Three small groups (the statistic between `a` and `b` is worked below)
+        times = [1, 2, 3, 4, 5, 1, 3, 3, 6, 7, 2, 2, 8]
+        doa = [1, 1, 0, 1, 1, 0, 1, 1, 0, 1, 1, 1, 0]
+        categories = ['a']*5 + ['b']*5 + ['c']*3
+        result = pairwise_logrank(times, doa, categories, chunk_size=2)
+        self.assertEqual(list(result.labels), ['a', 'b', 'c'])
+        self.assertTrue(np.allclose(result.statistics, result.statistics.T,
+                                    equal_nan=True))
+
+        # Expected deaths of `a` against `b`: 5/10 + 4/8 + 3/7*2 + 2/4 + 1/3
+        expected = 0.5 + 0.5 + 6/7 + 0.5 + 1/3
+        variance = 1/4 + 1/4 + 12/49*2*5/6 + 1/4 + 2/9
+        self.assertAlmostEqual(result.statistics[0, 1],
+                               (4 - expected)**2/variance)
+
+        single = pairwise_logrank(times[:10], doa[:10], categories[:10])
+        self.assertAlmostEqual(single.statistics[0, 1],
+                               result.statistics[0, 1])
+
+        total = multivariate_logrank(times[:10], doa[:10], categories[:10])
+        self.assertEqual(total.df, 1)
+        self.assertAlmostEqual(total.statistic, result.statistics[0, 1])
+
+    def test_adjust_pvalues(self):
+        pvalues = [0.01, 0.04, 0.03, np.nan, 0.5]
+        self.assertTrue(np.allclose(adjust_pvalues(pvalues, 'holm'),
+                                    [0.04, 0.09, 0.09, np.nan, 0.5],
+                                    equal_nan=True))
+        self.assertTrue(np.allclose(adjust_pvalues(pvalues, 'bh'),
+                                    [0.04, 0.16/3, 0.16/3, np.nan, 0.5],
+                                    equal_nan=True))
+        with self.assertRaises(ValueError):
+            adjust_pvalues(pvalues, 'bonferroni')
+
+
+class MetricsTests(unittest.TestCase):
+    def test_histogram(self):
+        histogram = Histogram('latency', 'Latency.', buckets=(0.1, 1))
+        for seconds in 0.05, 0.5, 0.1, 5:
+            histogram.observe('fit', seconds)
+        lines = list(histogram.lines())
+        self.assertIn('latency_bucket{phase="fit",le="0.1"} 2', lines)
+        self.assertIn('latency_bucket{phase="fit",le="1"} 3', lines)
+        self.assertIn('latency_bucket{phase="fit",le="+Inf"} 4', lines)
+        self.assertIn('latency_sum{phase="fit"} 5.65', lines)
+        with histogram.time('serialize'):
+            pass
+        self.assertEqual(histogram.series['serialize'][1], 1)
+        self.assertRegex(render(), r'process_resident_memory_bytes [1-9]')
+
+    def test_profile(self):
+        stop = threading.Event()
+        def spin():
+            while not stop.is_set():
+                sum(range(1000))
+        thread = threading.Thread(target=spin, name='spinner')
+        thread.start()
+        try:
+            stacks = profile(0.1, interval=0.001)
+        finally:
+            stop.set()
+            thread.join()
+        line = next(line for line in stacks.splitlines()
+                    if line.startswith('spinner;'))
+        self.assertIn('spin (', line)
+        self.assertGreater(int(line.rsplit(' ', 1)[1]), 0)
+
+
+class DatasetTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'snapshot.db')
+        self.store = os.path.join(self.directory.name, 'dataset.npz')
+        engine, session = database.initialize('sqlite:///' + self.path)
+        for hours, status in (36, 'DOA'), (12, 'Well'), (-1, 'Well'):
+            group = Group(category='Hiker', subjects=[
+                Subject(age=30, sex=1, status=status),
+                Subject(age=8, sex=2, status='Well')])
+            session.add(Incident(group=group,
+                                 total_hours=datetime.timedelta(hours=hours)))
+        session.commit()
+        database.terminate(engine, session)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_load(self):
+        columns = load_dataset(self.path, self.store)
+        self.assertEqual(sorted(columns['days']), [0.5, 0.5, 1.5, 1.5])
+        self.assertEqual(columns['doa'].sum(), 1)
+        self.assertEqual(set(columns['size']), {2})
+        self.assertFalse(columns['age'].flags.writeable)
+
+        with mock.patch('survival.dataset.query_dataset') as query_dataset:
+            stored = load_dataset(self.path, self.store)
+            self.assertFalse(query_dataset.called)
+            os.utime(self.path, ns=(0, 0))  # A new snapshot
+            load_dataset(self.path, self.store)
+            self.assertTrue(query_dataset.called)
+        for name in columns:
+            self.assertTrue(np.array_equal(columns[name], stored[name]))
+
+
+class SimplifyTests(unittest.TestCase):
+    def test_simplify(self):
+        random_state = np.random.RandomState(0)
+        curve = fit_curve(random_state.exponential(3, 20000),
+                          random_state.rand(20000) < 0.3)
+        simple = simplify(curve, tolerance=0.01, max_points=200)
+        self.assertLessEqual(len(simple.times), 200)
+        self.assertEqual((simple.times[0], simple.times[-1]),
+                         (curve.times[0], curve.times[-1]))
+        self.assertEqual(simple.count, curve.count)
+
+        # Without a limit on the points, no drop is moved in time
+        simple = simplify(curve, tolerance=0.01)
+        grid = np.linspace(0, curve.times[-1], 5000)
+        value = lambda curve: curve.survival[
+            np.searchsorted(curve.times, grid, side='right') - 1]
+        self.assertLess(np.max(np.abs(value(curve) - value(simple))), 0.01)
+        self.assertEqual(len(simplify(curve, tolerance=0).times),
+                         len(curve.times))
+
+    def test_encoding(self):
+        x, y = step_coordinates([0, 1, 3], [1, 0.5, 0.25])
+        self.assertEqual(x.tolist(), [0, 1, 1, 3, 3])
+        self.assertEqual(y.tolist(), [1, 1, 0.5, 0.5, 0.25])
+
+        encoded = encode_array(y)
+        self.assertEqual((encoded['dtype'], encoded['shape']), ('float32', [5]))
+        decoded = np.frombuffer(base64.b64decode(encoded['__ndarray__']),
+                                '<f4')
+        self.assertEqual(decoded.tolist(), y.tolist())
+
+
+class SurvivalTableTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        random_state = np.random.RandomState(0)
+        self.times = random_state.exponential(3, 600)
+        self.doa = random_state.rand(600) < 0.2
+        self.categories = np.repeat(['Child', 'Hiker', 'Hunter'], 200)
+        self.ages = random_state.uniform(0, 80, 600)
+        self.sexes = random_state.choice([1, 2], 600)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_predict(self):
+        write_table(self.directory.name, self.times, self.doa,
+                    self.categories, self.ages, self.sexes)
+        table = SurvivalTable(self.directory.name)
+        self.assertEqual(table.values.shape, (3, 6, 3, 3, 721))
+        self.assertEqual(table.counts[1, 0, 0], 200)
+
+        mask = (self.categories == 'Hiker') & (self.sexes == 2)
+        model = KaplanMeierModel().fit(self.times[mask], self.doa[mask])
+        grid = table.grid[::24]
+        predictions = table.predict(['Hiker']*len(grid), grid, sexes=2)
+        self.assertTrue(np.allclose(predictions, model.predict(grid)))
+
+        # Unknown ages and sexes fall back to the whole category
+        survival, lower, upper = table.predict(['Child', 'Child'], 1.5,
+                                               ages=[np.nan, 200], sexes=0,
+                                               interval=True)
+        self.assertEqual(survival[0], table.predict('Child', 1.5))
+        self.assertTrue(np.all((lower <= survival) & (survival <= upper)))
+
+        halfway = table.predict('Hunter', table.grid[10] + 1/48)
+        self.assertAlmostEqual(halfway, table.values[2, 0, 0, 0, 10:12].mean(),
+                               places=6)
+        with self.assertRaises(KeyError):
+            table.predict(['Hiker', 'Skier'], 1)
+
+
+class CoordinatesTests(unittest.TestCase):
+    def setUp(self):
+        random_state = np.random.RandomState(0)
+        self.latitudes = random_state.uniform(-84, 84, 1000)
+        self.longitudes = random_state.uniform(-180, 180, 1000)
+
+    def test_utm(self):
+        # The Statue of Liberty (zone 18T)
+        easting, northing, zone, hemisphere = to_utm(40.689247, -74.044502)
+        self.assertAlmostEqual(easting, 580735.6, places=0)
+        self.assertAlmostEqual(northing, 4504700.4, places=0)
+        self.assertEqual((zone, hemisphere), (18, 1))
+
+        utm = to_utm_array(self.latitudes, self.longitudes)
+        for index in range(0, 1000, 50):
+            expected = to_utm(self.latitudes[index], self.longitudes[index])
+            self.assertTrue(np.allclose([array[index] for array in utm],
+                                        expected, rtol=0, atol=1e-6))
+            self.assertTrue(np.allclose(from_utm_array(*utm)[0][index],
+                                        from_utm(*expected)[0]))
+
+        latitudes, longitudes = from_utm_array(*utm)
+        self.assertLess(np.abs(latitudes - self.latitudes).max(), 1e-7)
+        self.assertLess(np.abs(longitudes - self.longitudes).max(), 1e-7)
+        self.assertEqual(to_utm_array([0], [180])[2][0], 60)
+        with self.assertRaises(ValueError):
+            to_utm_array([10, 85], [0, 0])
+
+    def test_great_circle(self):
+        # About 10 cm apart, where the law of cosines gives zero
+        angle = great_circle(45, -70, 45, -70 + 1e-6*np.sqrt(2))
+        self.assertAlmostEqual(angle, 1e-6, delta=1e-12)
+
+        angles = great_circle_array(self.latitudes, self.longitudes,
+                                    self.latitudes[::-1], self.longitudes[0])
+        for index in range(0, 1000, 50):
+            self.assertAlmostEqual(angles[index], great_circle(
+                                   self.latitudes[index],
+                                   self.longitudes[index],
+                                   self.latitudes[::-1][index],
+                                   self.longitudes[0]))
+        self.assertAlmostEqual(great_circle_array(10, 20, -10, -160), 180,
+                               places=5)
+
+
+class ExportTests(unittest.TestCase):
+    def test_export(self):
+        random_state = np.random.RandomState(0)
+        times = random_state.exponential(3, 400)
+        doa = random_state.rand(400) < 0.2
+        categories = np.repeat(['Hiker', 'Child'], 200)
+        ages = np.where(categories == 'Child', 8, random_state.uniform(18, 80,
+                                                                       400))
+        sexes = random_state.choice([1, 2], 400)
+        bundle = export_curves(times, doa, categories, ages, sexes)
+        self.assertEqual(bundle['labels'], ['Child', 'Hiker'])
+        self.assertEqual(bundle['age_bands'][1:3], ['0-12', '13-17'])
+        self.assertEqual(bundle['age_bands'][-1], '65+')
+
+        child = bundle['curves'][0]
+        self.assertEqual(child[0][0]['count'], 200)
+        self.assertIsNone(child[3][0])  # No children aged 18 to 39
+        cell = bundle['curves'][1][3][2]
+        mask = ((categories == 'Hiker') & (ages >= 18) & (ages < 40) &
+                (sexes == 2))
+        self.assertEqual(cell['count'], np.count_nonzero(mask))
+        survival = np.frombuffer(base64.b64decode(
+                                 cell['survival']['__ndarray__']), '<f4')
+        curve = fit_curve(times[mask], doa[mask])
+        self.assertAlmostEqual(survival[-1], curve.survival[-1], places=6)
+
+        with tempfile.TemporaryDirectory() as directory:
+            size = write_bundle(directory, bundle)
+            with open(os.path.join(directory, 'curves.json')) as bundle_file:
+                self.assertEqual(json.load(bundle_file), bundle)
+            self.assertEqual(size, os.path.getsize(
+                             os.path.join(directory, 'curves.json')))
+            self.assertTrue(os.path.exists(os.path.join(directory,
+                                                        'index.html')))
+
+
+class TransportTests(unittest.TestCase):
+    def setUp(self):
+        self.responses, self.clients = [], []
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(handler):
+                self.clients.append(handler.client_address)
+                status, headers, body = self.responses.pop(0)
+                handler.send_response(status)
+                for name, value in headers.items():
+                    handler.send_header(name, value)
+                handler.send_header('Content-Length', str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(('localhost', 0),
+                                                      Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+        self.delays = []
+        self.transport = transport.Transport(retries=2,
+                                             sleep=self.delays.append)
+        self.default, transport.DEFAULT = transport.DEFAULT, self.transport
+        self.base_url, wsi.BASE_URL = wsi.BASE_URL, 'http://{}:{}/'.format(
+                                      *self.server.server_address)
+
+    def test_retry_and_reuse(self):
+        body = json.dumps({'weatherData': {}}).encode('utf-8')
+        self.responses += [(503, {'Retry-After': '7'}, b''),
+                           (429, {}, b''),
+                           (200, {'Content-Encoding': 'gzip'},
+                            gzip.compress(body)),
+                           (200, {}, body)]
+
+        self.assertEqual(wsi.fetch_history(userKey='key'), {'weatherData': {}})
+        self.assertEqual(wsi.fetch_history(userKey='key'), {'weatherData': {}})
+        self.assertEqual(self.delays, [7, 2])
+        self.assertEqual(len(set(self.clients)), 1)  # One connection
+
+        summary = self.transport.summarize()
+        self.assertEqual(summary['requests'], 2)
+        self.assertEqual(summary['retries'], 2)
+
+    def test_failure(self):
+        self.responses += [(500, {}, b'')]*3
+        with self.assertRaises(HTTPError):
+            wsi.fetch_history(userKey='key')
+        self.assertEqual(self.delays, [1, 2])
+
+        self.responses += [(404, {}, b'')]
+        with self.assertRaises(HTTPError):
+            wsi.fetch_history(userKey='key')
+        self.assertEqual(len(self.responses), 0)
+
+    def test_retry_after(self):
+        delay = self.transport.delay
+        self.assertEqual(delay(1, {'Retry-After': '3'}), 3)
+        self.assertEqual(delay(2, {'Retry-After': 'soon'}), 2)
+        self.assertEqual(delay(3, {'Retry-After': 'Mon, 01 Jan 2001 '
+                                                  '00:00:00'}), 0)
+        self.assertEqual(delay(3), 4)
+
+    def tearDown(self):
+        transport.DEFAULT, wsi.BASE_URL = self.default, self.base_url
+        self.transport.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+
 class CleaningTests(unittest.TestCase):
     def test_extract_number(self):
         self.assertEqual(list(extract_numbers('2 people')), [2])
@@ -288,6 +1127,128 @@ class EvaluationTests(unittest.TestCase):
         self.assertAlmostEqual(compute_brier_score([1, 0, 0],
                                                    [0.75, 0.25, 0.25]), 0.0625)
 
+    def test_bootstrap_brier_score(self):
+        outcomes = np.arange(100) % 4 == 0
+        predictions = np.array([outcomes*0.8 + 0.1, np.full(100, 0.25)])
+        losses = (predictions - outcomes)**2
+
+        means = bootstrap_means(losses, 50, random_state=0)
+        chunked = bootstrap_means(losses, 50, random_state=0, max_elements=300)
+        self.assertTrue(np.allclose(means, chunked))
+        self.assertAlmostEqual(means.mean(axis=0)[1], losses[1].mean(),
+                               places=2)
+
+        interval = bootstrap_brier_score(predictions, outcomes, resamples=500,
+                                         random_state=0)
+        self.assertTrue(np.allclose(interval.scores, losses.mean(axis=1)))
+        self.assertTrue(np.all(interval.lower <= interval.scores))
+        self.assertTrue(np.all(interval.scores <= interval.upper))
+        self.assertTrue(np.allclose(interval.difference_lower,
+                                    -interval.difference_upper.T))
+        self.assertLess(interval.difference_upper[0, 1], 0)
+
+        repeated = bootstrap_brier_score(np.stack([predictions]*3, axis=1),
+                                         outcomes, resamples=500,
+                                         random_state=0)
+        for expected, actual in zip(interval, repeated):
+            self.assertTrue(np.allclose(expected, actual))
+
+    def test_brier_scores_over_time(self):
+        times = np.array([1, 2, 3, 4, 5, 6.0])
+        doa = np.array([1, 0, 1, 0, 1, 1], dtype=bool)
+        grid = np.array([0.5, 2.5, 4.5, 10])
+
+        after, before = censoring_survival(times, doa, [2, 4, 7])
+        self.assertTrue(np.allclose(after, [0.8, 0.8*2/3, 0.8*2/3]))
+        self.assertTrue(np.allclose(before, [1, 0.8, 0.8*2/3]))
+
+        # Predicting a half always scores a quarter (the weights sum to one)
+        scores = brier_scores_over_time(np.full(4, 0.5), times, doa, grid)
+        self.assertAlmostEqual(scores[0], 0.25)
+        self.assertTrue(np.allclose(scores, 0.25))
+
+        predictions = np.tile([0.9, 0.6, 0.3, 0.0], (6, 1))
+        self.assertTrue(np.allclose(
+            brier_scores_over_time(predictions, times, doa, grid),
+            brier_scores_over_time(predictions[0], times, doa, grid)))
+        scores = brier_scores_over_time(predictions[0], times, doa, grid)
+        self.assertAlmostEqual(scores[-1], 0)  # Everyone died by day 10
+        self.assertAlmostEqual(scores[1], (0.36 + 0.16*4/0.8)/6)
+
+        integrated = integrated_brier_score(predictions, times, doa, grid)
+        area = np.sum(np.diff(grid)*(scores[1:] + scores[:-1])/2)
+        self.assertAlmostEqual(integrated, area/9.5)
+
+    def test_concordance_index(self):
+        times = [1, 2, 3, 4, 5, 6]
+        doa = [1, 1, 0, 1, 0, 1]
+        self.assertEqual(concordance_index(times, times, doa), 1)
+        self.assertEqual(concordance_index(times, [-t for t in times], doa), 0)
+        self.assertEqual(concordance_index(times, [1]*6, doa), 0.5)
+
+        random_state = np.random.RandomState(0)
+        times = random_state.randint(0, 20, 200)
+        predictions = random_state.randint(0, 5, 200) + times//4
+        doa = random_state.rand(200) < 0.4
+
+        concordant = tied = pairs = 0
+        for time, prediction, died in zip(times, predictions, doa):
+            longer = (times > time) | ((times == time) & ~doa)
+            if died:
+                concordant += np.sum(longer & (predictions > prediction))
+                tied += np.sum(longer & (predictions == prediction))
+                pairs += np.sum(longer)
+        self.assertAlmostEqual(concordance_index(times, predictions, doa),
+                               (concordant + tied/2)/pairs)
+        with self.assertRaises(ValueError):
+            concordance_index([1, 2], [1, 2], [0, 0])
+
+    def test_cross_validate(self):
+        df = pd.DataFrame({'days': np.arange(10.0), 'doa': [0, 1]*5})
+        permutation = np.random.RandomState(0).permutation(len(df))
+        fit = lambda training_cases: set(training_cases.days)
+        predict = lambda model, case: float(case.days in model)
+        predict_many = lambda model, cases: np.isin(cases.days, list(model))
+
+        for arguments in ({'predict': predict},
+                          {'predict_many': predict_many}):
+            predictions = cross_validate(df, fit, folds=3,
+                                         permutation=permutation, **arguments)
+            self.assertEqual(predictions.dtype, np.float64)
+            self.assertFalse(predictions.any())
+
+        model = KaplanMeierModel().fit(df.days, df.doa)
+        predictions = cross_validate(df, lambda _: model, predict_case, 5)
+        self.assertTrue(np.allclose(predictions,
+                                    cross_validate(df, lambda _: model,
+                                                   predict_many=predict_cases)))
+        self.assertTrue(np.allclose(predictions, model.predict(df.days)))
+
+        table = KaplanMeierTable(df.days, df.doa)
+        predictions = cross_validate(df, table, permutation=permutation,
+                                     folds=4, predict_many=predict_cases)
+        expected = cross_validate(df, make_fitting_function(KaplanMeierModel),
+                                  permutation=permutation, folds=4,
+                                  predict_many=predict_cases)
+        self.assertTrue(np.allclose(predictions, expected))
+
+    def test_evaluate_fits(self):
+        random_state = np.random.RandomState(0)
+        subsets = []
+        for size in (30, 45):
+            doa = random_state.rand(size) < 0.3
+            subsets.append(pd.DataFrame({'days': random_state.rand(size),
+                                         'doa': doa, 'survived': ~doa}))
+        fit_fns = [[make_fitting_function(NaiveSurvivalRateModel),
+                    make_fitting_function(KaplanMeierModel)]]*2
+
+        serial = evaluate_fits(subsets, fit_fns, repeat=3, workers=1)
+        parallel = evaluate_fits(subsets, fit_fns, repeat=3, workers=2)
+        self.assertEqual(serial[0].shape, (2, 2, 3))
+        self.assertEqual(serial[1].shape, (2, 3*75))
+        for expected, actual in zip(serial, parallel):
+            self.assertTrue(np.array_equal(expected, actual))
+
 
 if __name__ == '__main__':
     unittest.main()
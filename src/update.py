@@ -3,68 +3,274 @@
 """
 update -- Update and augment the database
 
-This is a standalone script for cleaning and augmenting the database. Each
-function in this module except `main` (which bootstraps the update process) is
-a "task" that takes one argument, a SQLAlchemy scoped session, and operates on
-the database. New tasks should be added to the list inside `main` and use
-the nameless logger `logging.getLogger()`.
+This is a standalone script for cleaning and augmenting the database. A "task"
+is a function that takes one argument, a SQLAlchemy scoped session, operates on
+the database, and returns the number of rows it changed. New tasks should be
+registered with the `task` decorator, which records the tables the task reads
+and writes, and use the nameless logger `logging.getLogger()`. Long-running
+tasks should check `STOP` between batches and return early once it is set.
+
+Tasks run in registration order unless they touch disjoint tables (or disjoint
+scopes of a table, see `task`), in which case `run_tasks` runs them concurrently
+and each thread gets its own session. For example, removing unreadable incidents
+and augmenting the weather of readable ones run side by side.
+
+Completed tasks are recorded in a state file until every task has succeeded, so
+restarting an update that failed or was interrupted skips the tasks that already
+finished against the same database snapshot. The next full run starts afresh.
+
+Note:
+    The enabled tasks modify the database in place. In particular,
+    `remove_unreadable_incidents` deletes incidents SQLAlchemy cannot load
+    (along with their subjects, points, and other child instances). Work on a
+    copy of the snapshot if those rows are still needed.
 """
 
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import datetime
 from functools import reduce
+import itertools
+import json
 import logging
-from sqlalchemy import or_
+import os
+import threading
+from sqlalchemy import DateTime, Interval, and_, func, not_, or_
+import time
 import yaml
 
 import database
+from database.augmentation import bulk_update, iterate_ipps
 from database.models import Subject, Group, Incident, Location, Point
 from database.models import Operation, Outcome, Weather, Search
 from util import initialize_logging
-from weather import wsi
+from weather import solar, transport, wsi
 from util import configure_api_access
 
+Task = namedtuple('Task', ['function', 'reads', 'writes'])
+TASKS = []
+STOP = threading.Event()  # Set when the update is interrupted
 
-def remove_unreadable_incidents(session, limit=float('inf'), save_every=100):
+
+def task(reads=(), writes=(), enabled=True):
+    """
+    A decorator for registering a function as an update task.
+
+    Arguments:
+        reads: The names of the tables the task reads from.
+        writes: The names of the tables the task modifies (a table that is
+                written to is implicitly read from, too).
+
+    A name may be narrowed to the rows a task touches with a scope, separated
+    by a colon (for instance, `'weather:readable'`). Names of the same table
+    with different scopes do not conflict, but an unscoped name conflicts with
+    every scope of its table.
+        enabled: A boolean indicating whether or not `main` should run the
+                 task.
+
+    Returns:
+        A one-argument wrapper function that takes another function, adds it
+        to `TASKS`, and returns it unchanged.
+    """
+    def wrapper(function):
+        if enabled:
+            TASKS.append(Task(function, frozenset(reads) | frozenset(writes),
+                              frozenset(writes)))
+        return function
+
+    return wrapper
+
+
+def chunks(sequence, size=500):
+    """
+    Split a sequence into consecutive slices.
+
+    Arguments:
+        sequence: A sliceable sequence (e.g. a list of identifiers).
+        size: The maximum length of each slice. SQLite limits the number of
+              bound parameters per statement to 999, so `IN` lists should be
+              kept below that.
+
+    Returns:
+        A generator of slices of `sequence`, in order.
+    """
+    for start in range(0, len(sequence), size):
+        yield sequence[start:start + size]
+
+
+def is_unparseable(column):
+    """
+    Build a SQL criterion that is true when a date or duration column holds a
+    value SQLAlchemy cannot load.
+
+    SQLite stores both `DateTime` and `Interval` columns as text of the form
+    `YYYY-MM-DD HH:MM:SS[.ffffff]`. SQLite's own date functions are more
+    lenient than Python (for instance, they accept February 30), so the date
+    and time are checked by normalizing them with `datetime` and comparing the
+    result to the stored text.
+
+    Arguments:
+        column: A SQLAlchemy `DateTime` or `Interval` column.
+
+    Returns:
+        A SQLAlchemy boolean expression.
+    """
+    digits = '[0-9]'
+    pattern = '-'.join([digits*4, digits*2, digits*2]) + ' '
+    pattern += ':'.join([digits*2]*3)
+
+    stamp, fraction = func.substr(column, 1, 19), func.substr(column, 20)
+    valid_fraction = or_(fraction == '',
+                         and_(func.substr(fraction, 1, 1) == '.',
+                              func.length(fraction).between(2, 7),
+                              not_(func.substr(fraction, 2)
+                                   .op('GLOB')('*[^0-9]*'))))
+    valid = and_(func.typeof(column) == 'text', stamp.op('GLOB')(pattern),
+                 func.datetime(stamp, '+0 seconds') == stamp, valid_fraction)
+    return and_(column != None, not_(valid))
+
+
+def is_unreadable_incident():
     """
-    Remove all cases with no data.
+    Build a SQL criterion that is true for incidents SQLAlchemy cannot load.
+
+    Returns:
+        A SQLAlchemy boolean expression over the columns of `Incident`.
+    """
+    return or_(*[is_unparseable(column) for column in Incident.__table__.columns
+                 if isinstance(column.type, (DateTime, Interval))])
+
+
+def find_unreadable_incidents(session, include_empty=False):
+    """
+    Find every incident that cannot be loaded (and, optionally, every incident
+    that contains no data).
+
+    An incident is unreadable if one of its date or duration columns holds a
+    value SQLAlchemy cannot parse (`Query.one` raises a `ValueError` on these
+    rows). An incident is empty if none of its own columns are filled in, no
+    subjects belong to it, and none of its child instances (weather, location,
+    and so on) hold any data either. Both conditions are checked in a single
+    query, with an anti-join against the incidents that have subjects.
 
     Arguments:
         session: A SQLAlchemy scoped session object connected to the database.
-        limit: The number of empty cases to remove at once (no limit by
-               default).
-        save_every: The number of cases to remove before commiting changes to
-                    the database.
+        include_empty: A boolean indicating whether empty incidents should be
+                       found, too.
+
+    Returns:
+        A sorted list of `Incident` identifiers.
     """
-    logger, count = logging.getLogger(), 0
+    columns = [column for column in Incident.__table__.columns
+               if not column.primary_key]
+    criteria = [is_unreadable_incident()]
+    query = session.query(Incident.id)
+
+    if include_empty:
+        populated = session.query(Group.incident_id).join(Subject)
+        populated = populated.filter(Group.incident_id != None).distinct()
+        populated = populated.subquery()
+        query = query.outerjoin(populated,
+                                populated.c.incident_id == Incident.id)
+
+        empty = [populated.c.incident_id == None]
+        empty += [column == None for column in columns]
+        for model in Weather, Location, Operation, Outcome, Search:
+            data = [column != None for column in model.__table__.columns
+                    if column.name not in ('id', 'incident_id')]
+            child = session.query(model.id)
+            child = child.filter(model.incident_id == Incident.id, or_(*data))
+            empty.append(~child.exists())
+        criteria.append(and_(*empty))
+
+    query = query.filter(or_(*criteria)).order_by(Incident.id)
+    return [incident_id for incident_id, in query]
+
+
+@task(writes=['incidents:unreadable', 'subjects:unreadable',
+              'groups:unreadable', 'points:unreadable', 'weather:unreadable',
+              'locations:unreadable', 'operations:unreadable',
+              'outcomes:unreadable', 'searches:unreadable'])
+def remove_unreadable_incidents(session, limit=float('inf'),
+                                include_empty=False):
+    """
+    Remove all cases that are unreadable (and, optionally, cases with no data).
 
-    for incident_id, *empty in session.query(Incident.id):
-        query = session.query(Incident).filter(Incident.id == incident_id)
+    Every dependent row (subjects, groups, points, and the other child
+    instances) is removed with bulk `DELETE` statements inside one
+    transaction, so the database is never left with half-removed incidents.
 
-        try:
-            query.one()
-        except ValueError:
-            logger.info('Removing incident {} ... '.format(incident_id))
+    Arguments:
+        session: A SQLAlchemy scoped session object connected to the database.
+        limit: The number of cases to remove at once (no limit by default).
+        include_empty: A boolean indicating whether cases with no data should
+                       be removed as well (see `find_unreadable_incidents`).
+
+    Returns:
+        The number of incidents removed.
+    """
+    logger, start = logging.getLogger(), time.perf_counter()
+
+    incident_ids = find_unreadable_incidents(session, include_empty)
+    if len(incident_ids) > limit:
+        incident_ids = incident_ids[:int(limit)]
+    logger.info('Found {} cases to remove in {:.3f} s'.format(
+                len(incident_ids), time.perf_counter() - start))
+
+    counts = dict.fromkeys(['points', 'subjects', 'groups', 'weather',
+                            'locations', 'operations', 'outcomes',
+                            'searches', 'incidents'], 0)
+    delete = lambda query: query.delete(synchronize_session=False)
+
+    try:
+        for batch in chunks(incident_ids):
+            point_ids = set()
+            for model, columns in ((Operation, (Operation.ipp_id,
+                                                Operation.dest_id)),
+                                   (Outcome, (Outcome.dec_point_id,
+                                              Outcome.find_point_id))):
+                query = session.query(*columns)
+                query = query.filter(model.incident_id.in_(batch))
+                point_ids.update(point_id for row in query for point_id in row
+                                 if point_id is not None)
+
+            group_ids = session.query(Group.id)
+            group_ids = group_ids.filter(Group.incident_id.in_(batch))
+            group_ids = [group_id for group_id, in group_ids]
+
+            for group_batch in chunks(group_ids):
+                query = session.query(Subject)
+                query = query.filter(Subject.group_id.in_(group_batch))
+                counts['subjects'] += delete(query)
 
             for model in Group, Weather, Location, Operation, Outcome, Search:
-                subquery = session.query(model)
-                subquery = subquery.filter(model.incident_id == incident_id)
+                query = session.query(model)
+                query = query.filter(model.incident_id.in_(batch))
+                counts[model.__tablename__] += delete(query)
 
-                instance = subquery.one_or_none()
-                if instance is not None:
-                    session.delete(instance)
+            for point_batch in chunks(sorted(point_ids)):
+                query = session.query(Point)
+                query = query.filter(Point.id.in_(point_batch))
+                counts['points'] += delete(query)
 
-            query.delete()
+            query = session.query(Incident).filter(Incident.id.in_(batch))
+            counts['incidents'] += delete(query)
 
-            count += 1
-            if count >= limit:
-                break
-            elif (count + 1)%save_every == 0:
-                session.commit()
+        session.commit()
+    except BaseException:
+        session.rollback()
+        raise
 
-    session.commit()
-    logger.info('Removed {} cases'.format(count))
+    for table, count in counts.items():
+        logger.debug('Deleted {} rows from {}'.format(count, table))
+    logger.info('Removed {} cases in {:.3f} s'.format(
+                counts['incidents'], time.perf_counter() - start))
+    return counts['incidents']
 
 
+@task(reads=['incidents'], writes=['groups', 'weather', 'locations',
+                                   'operations', 'outcomes', 'searches'],
+      enabled=False)
 def add_missing_instances(session):
     """
     Iterate through `Incident` instances and add missing child instances.
@@ -87,10 +293,49 @@ def add_missing_instances(session):
     ...
 
 
-def augment_weather_instance(weather, datetime_, ipp):
+@task(reads=['incidents:readable', 'operations:readable', 'points:readable'],
+      writes=['weather:readable'])
+def augment_daylight(session, batch_size=5000):
+    """
+    Compute the duration of daylight for every `Weather` instance with a
+    location and time but no recorded daylight.
+
+    The durations are computed offline (see `weather.solar`), one batch at a
+    time, and written back in bulk.
+
+    Arguments:
+        session: A SQLAlchemy scoped session object connected to the database.
+        batch_size: The number of instances to compute and write at once.
+
+    Returns:
+        The number of instances augmented.
+    """
+    logger = logging.getLogger()
+    batches = iterate_ipps(session, Weather, Weather.daylight == None,
+                           not_(is_unreadable_incident()),
+                           batch_size=batch_size)
+
+    count = 0
+    for batch in batches:
+        if STOP.is_set():
+            logger.info('Stopping daylight augmentation')
+            break
+
+        weather_ids, datetimes, latitudes, _ = zip(*batch)
+        durations = solar.daylight(datetimes, latitudes).tolist()
+        mappings = [{'id': weather_id, 'daylight': duration}
+                    for weather_id, duration in zip(weather_ids, durations)]
+        count += bulk_update(session, Weather, mappings)
+        session.commit()
+
+    logger.info('Computed daylight for {} weather instances'.format(count))
+    return count
+
+
+def augment_weather_instance(datetime_, latitude, longitude):
     """
-    Pull historical weather data from the online WSI database and attempt to
-    fill in the `Weather` instance's missing fields.
+    Pull historical weather data from the online WSI database for a `Weather`
+    instance.
 
     The data pulled are for the first day of the incident in hourly intervals.
     Wind speed and downward solar radiation are averaged and rounded to three
@@ -101,42 +346,43 @@ def augment_weather_instance(weather, datetime_, ipp):
     as rainfall.
 
     Arguments:
-        weather: An instance of the `Weather` database model with at least one
-                 missing field.
         datetime_: The date and time of the incident (named with the trailing
                    underscore to avoid clashing with the `datetime` module).
-        ipp: The initial planning point (that is, coordinates) of the incident,
-             represented as a `Point` instance.
+        latitude: The latitude of the incident's initial planning point.
+        longitude: The longitude of the incident's initial planning point.
+
+    Returns:
+        A dictionary mapping `Weather` column names to the values found. Fields
+        with no data are left out.
     """
     start_date = datetime_.date()
     end_date = start_date + datetime.timedelta(1)
     fields = ['surfaceTemperatureCelsius', 'windSpeedKph',
               'precipitationPreviousHourCentimeters', 'downwardSolarRadiation']
 
-    history = wsi.fetch_history(lat=ipp.latitude, long=ipp.longitude,
+    history = wsi.fetch_history(lat=latitude, long=longitude,
                                 startDate=start_date, endDate=end_date,
                                 fields=fields)
 
     series = history['weatherData']['hourly']['hours']
+    values = {}
 
     scrub = lambda sequence: filter(lambda item: item is not None, sequence)
     collect = lambda field: map(lambda hourly: hourly.get(field, None), series)
 
     temperatures = list(scrub(collect('surfaceTemperatureCelsius')))
     if len(temperatures) > 0:
-        if weather.low_temp is None:
-            weather.low_temp = min(temperatures)
-        if weather.high_temp is None:
-            weather.high_temp = max(temperatures)
+        values['low_temp'] = min(temperatures)
+        values['high_temp'] = max(temperatures)
 
     wind_speeds = list(scrub(collect('windSpeedKph')))
-    if len(wind_speeds) > 0 and weather.wind_speed is None:
-        weather.wind_speed = round(sum(wind_speeds)/len(wind_speeds), 3)
+    if len(wind_speeds) > 0:
+        values['wind_speed'] = round(sum(wind_speeds)/len(wind_speeds), 3)
 
     solar_radiation = list(scrub(collect('downwardSolarRadiation')))
-    if len(solar_radiation) > 0 and weather.solar_radiation is None:
+    if len(solar_radiation) > 0:
         mean = sum(solar_radiation)/len(solar_radiation)
-        weather.solar_radiation = round(mean, 3)
+        values['solar_radiation'] = round(mean, 3)
 
     snow, rain = 0, 0
     for hourly in series:
@@ -149,59 +395,289 @@ def augment_weather_instance(weather, datetime_, ipp):
             else:
                 rain += prcp
 
-    if weather.snow is None:
-        weather.snow = round(snow, 3)
-    if weather.rain is None:
-        weather.rain = round(rain, 3)
+    values['snow'], values['rain'] = round(snow, 3), round(rain, 3)
+    return values
 
 
+@task(reads=['incidents:readable', 'operations:readable', 'points:readable'],
+      writes=['weather:readable'])
 def augment_weather_instances(session, limit=5000, save_every=50):
     """
     Find incomplete `Weather` instances with a location and time and attempt to
     supplement them with historical weather data from the online WSI database.
 
+    Only missing fields are filled in. New values are checked against the
+    `Weather` validators before they are written back in bulk. Incidents that
+    `remove_unreadable_incidents` would delete are skipped, and the task
+    returns early once `STOP` is set.
+
     Arguments:
         session: A SQLAlchemy scoped session object connected to the database.
         limit: The maximum number of instances to augment (this may be useful
                for complying with API daily usage limits).
         save_every: The number of instances to augment before the session
                     should commit the new data to the disk.
+
+    Returns:
+        The number of instances augmented.
+
+    Raises:
+        Any error other than a `ValueError` for a single instance (for example,
+        a network error) after the instances augmented so far are committed.
     """
     configure_api_access()
     logger = logging.getLogger()
     logger.info('WSI key set to: {}'.format(wsi.DEFAULT_PARAMETERS['userKey']))
 
-    query = session.query(Weather, Incident.datetime, Operation.ipp_id)
-    query = query.join(Incident, Operation)
-    query = query.filter(Incident.datetime, Operation.ipp_id)
-
     columns = Weather.high_temp, Weather.low_temp, Weather.wind_speed
     columns += Weather.snow, Weather.rain, Weather.solar_radiation
+    names = [column.key for column in columns]
     criteria = map(lambda column: column == None, columns)
-    query = query.filter(reduce(or_, criteria))
+
+    batches = iterate_ipps(session, Weather, reduce(or_, criteria),
+                           not_(is_unreadable_incident()), columns=columns,
+                           batch_size=save_every, limit=limit)
 
     count = 0
-    for weather, datetime_, ipp_id in query:
-        ipp = session.query(Point).get(ipp_id)
-
-        if ipp.latitude is not None and ipp.longitude is not None:
-            try:
-                augment_weather_instance(weather, datetime_, ipp)
-                logger.info('Updated {}'.format(weather))
-            except ValueError as error:
-                logger.error('Instance ID {}: {}'.format(weather.id, error))
-            except error:
-                logger.error(error)
-                break
-
-            count += 1
-            if count >= limit:
-                break
-            elif (count + 1)%save_every == 0:
-                session.commit()
-
-    session.commit()
+    for batch in batches:
+        if STOP.is_set():
+            logger.info('Stopping weather augmentation')
+            break
+
+        mappings = []
+        try:
+            for weather_id, datetime_, latitude, longitude, *current in batch:
+                try:
+                    values = augment_weather_instance(datetime_, latitude,
+                                                      longitude)
+                    values = {name: values[name] for name, value
+                              in zip(names, current)
+                              if value is None and name in values}
+                    # Validate against the existing values before bypassing
+                    # the ORM (for instance, a new high against an old low)
+                    Weather(**dict(zip(names, current), **values))
+                except ValueError as error:
+                    logger.error('Instance ID {}: {}'.format(weather_id,
+                                                             error))
+                    continue
+
+                values['id'] = weather_id
+                mappings.append(values)
+                logger.debug('Updated weather {}: {}'.format(weather_id,
+                                                             values))
+        finally:
+            # Keep what was fetched before an error (the task still fails)
+            count += bulk_update(session, Weather, mappings)
+            session.commit()
+
     logger.info('Updated {} weather instances'.format(count))
+    return count
+
+
+def snapshot_name(path):
+    """
+    Identify the database snapshot a path refers to.
+
+    `isrid-master.db` is normally a symbolic link to a dated snapshot (see the
+    README), so the snapshot is identified by the file the link resolves to.
+
+    Arguments:
+        path: A string representing the path to the database file.
+
+    Returns:
+        The absolute path of the snapshot as a string.
+    """
+    return os.path.realpath(path)
+
+
+def read_state(filename, snapshot):
+    """
+    Read the record of completed tasks from a previous run.
+
+    Arguments:
+        filename: A string representing the path to the state file.
+        snapshot: The name of the current database snapshot (see
+                  `snapshot_name`).
+
+    Returns:
+        A dictionary with a `snapshot` key and a `tasks` key, which maps task
+        names to their recorded statistics. If the file does not exist or was
+        written for a different snapshot, no tasks are recorded.
+    """
+    state = {'snapshot': snapshot, 'tasks': {}}
+    try:
+        with open(filename) as state_file:
+            previous = json.load(state_file)
+    except (OSError, ValueError):
+        return state
+
+    if previous.get('snapshot') == snapshot:
+        state['tasks'] = previous.get('tasks', {})
+    return state
+
+
+def write_state(filename, state):
+    """
+    Atomically save the record of completed tasks.
+
+    Arguments:
+        filename: A string representing the path to the state file.
+        state: A dictionary in the form returned by `read_state`.
+    """
+    temporary = filename + '.tmp'
+    with open(temporary, 'w') as state_file:
+        json.dump(state, state_file, indent=2, sort_keys=True)
+    os.replace(temporary, filename)
+
+
+def find_dependencies(tasks):
+    """
+    Order tasks by the tables they share.
+
+    A task depends on every earlier task that writes to a table it reads, or
+    that reads a table it writes to (taking scopes into account, see `task`). Tasks with no such conflicts may run
+    concurrently.
+
+    Arguments:
+        tasks: A sequence of `Task` instances, in registration order.
+
+    Returns:
+        A dictionary mapping each task to a set of the tasks it depends on.
+    """
+    def overlap(names, other_names):
+        for name, other_name in itertools.product(names, other_names):
+            table, _, scope = name.partition(':')
+            other_table, _, other_scope = other_name.partition(':')
+            if table == other_table and (not scope or not other_scope or
+                                         scope == other_scope):
+                return True
+        return False
+
+    dependencies = {}
+    for index, current in enumerate(tasks):
+        dependencies[current] = {previous for previous in tasks[:index]
+                                 if overlap(previous.writes, current.reads) or
+                                 overlap(current.writes, previous.reads)}
+    return dependencies
+
+
+def run_task(task_, session):
+    """
+    Run a task in the current thread with its own session.
+
+    Arguments:
+        task_: A `Task` instance.
+        session: A SQLAlchemy scoped session object. Each thread is given a
+                 separate session, which is closed once the task finishes
+                 (along with the thread's weather API connections).
+
+    Returns:
+        rows: The number of rows the task reported changing.
+        seconds: The task's wall time in seconds.
+    """
+    start = time.perf_counter()
+    try:
+        rows = task_.function(session)
+    finally:
+        session.remove()
+        transport.DEFAULT.close()
+    return rows, time.perf_counter() - start
+
+
+def run_tasks(tasks, session, state_filename, snapshot, workers=4):
+    """
+    Run tasks concurrently, respecting the dependencies between them.
+
+    Tasks that completed against the same snapshot in a previous, unfinished
+    run are skipped. If a task fails, the error is logged and every task that
+    depends on it is skipped, but independent tasks continue. Once every task
+    has succeeded, the state file is removed.
+
+    On `KeyboardInterrupt`, queued tasks are cancelled and `STOP` is set, so
+    running tasks return after their current batch. Tasks that return after
+    the interruption are not recorded as completed.
+
+    Arguments:
+        tasks: A sequence of `Task` instances, in registration order.
+        session: A SQLAlchemy scoped session object connected to the database.
+        state_filename: A string representing the path to the state file.
+        snapshot: The name of the current database snapshot.
+        workers: The maximum number of tasks to run at once.
+
+    Returns:
+        A dictionary mapping task names to their statistics (status, wall time
+        in seconds, and rows changed).
+    """
+    logger = logging.getLogger()
+    STOP.clear()
+    state = read_state(state_filename, snapshot)
+    completed = state['tasks']
+    dependencies = find_dependencies(tasks)
+    name = lambda task_: task_.function.__name__
+
+    pending = [task_ for task_ in tasks if name(task_) not in completed]
+    for task_ in set(tasks) - set(pending):
+        logger.info('Skipping completed task: {}'.format(name(task_)))
+
+    finished, failed, running = set(set(tasks) - set(pending)), set(), {}
+    executor = ThreadPoolExecutor(max_workers=workers)
+
+    try:
+        while pending or running:
+            for task_ in list(pending):
+                if dependencies[task_] & failed:
+                    logger.warning('Skipping task: {} (dependency failed)'
+                                   .format(name(task_)))
+                    pending.remove(task_)
+                    failed.add(task_)
+                elif dependencies[task_] <= finished:
+                    logger.info('Starting task: {}'.format(name(task_)))
+                    future = executor.submit(run_task, task_, session)
+                    running[future] = task_
+                    pending.remove(task_)
+
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                task_ = running.pop(future)
+                try:
+                    rows, seconds = future.result()
+                except Exception as error:
+                    logger.error('{} failed: {}: {}'.format(
+                                 name(task_), type(error).__name__, error))
+                    failed.add(task_)
+                    continue
+
+                if STOP.is_set():
+                    logger.info('Stopped task: {}'.format(name(task_)))
+                    continue
+
+                logger.info('Finished task: {} ({} rows in {:.3f} s)'
+                            .format(name(task_), rows, seconds))
+                finished.add(task_)
+                completed[name(task_)] = {
+                    'finished': datetime.datetime.now().isoformat(),
+                    'rows': rows,
+                    'seconds': round(seconds, 3)
+                }
+                write_state(state_filename, state)
+    except KeyboardInterrupt:
+        STOP.set()
+        logger.info('Stopping {} running tasks ... '.format(len(running)))
+        raise
+    finally:
+        for future in running:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+    if not failed and len(finished) == len(tasks):
+        try:
+            os.remove(state_filename)
+        except FileNotFoundError:
+            pass
+    return completed
 
 
 def main():
@@ -209,29 +685,24 @@ def main():
     Bootstrap the update process by wrapping the initialization and termination
     of logging and database access.
 
-    Errors raised by tasks are caught here and logged, and the script is
-    immediately killed.
+    Errors raised by tasks are caught and logged by `run_tasks`. Interrupting
+    the script waits for running tasks to finish; rerunning it afterwards
+    resumes with the tasks that have not completed yet.
     """
     initialize_logging('../logs/update.log')
     logger = logging.getLogger()
-    engine, session = database.initialize('sqlite:///../data/isrid-master.db')
 
-    tasks = [augment_weather_instances]
-
-    for task in tasks:
-        try:
-            task_name = task.__name__.replace('_', ' ')
-            logger.info('Starting task: {}'.format(task_name))
-            task(session)
-
-        except KeyboardInterrupt:
-            print()
-            logger.info('Terminating update ... ')
-            break
-
-        except Exception as error:
-            logger.error('{}: {}'.format(type(error).__name__, error))
-            break
+    # Concurrent tasks wait on each other's write locks instead of failing
+    filename = '../data/isrid-master.db'
+    engine, session = database.initialize('sqlite:///' + filename,
+                                          connect_args={'timeout': 600})
+
+    try:
+        run_tasks(TASKS, session, '../logs/update-state.json',
+                  snapshot_name(filename))
+    except KeyboardInterrupt:
+        print()
+        logger.info('Terminating update ... ')
 
     logging.shutdown()  # Flush files
     database.terminate(engine, session)
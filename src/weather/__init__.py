@@ -2,9 +2,10 @@
 weather -- Historical weather data API access
 
 The purpose of this module is to provide a Python interface to online
-historical weather data APIs. Each API is represented as a submodule.
+historical weather data APIs. Each API is represented as a submodule, and all
+of them share the HTTP connections in `transport`.
 """
 
-__all__ = ['noaa', 'wsi']
+__all__ = ['noaa', 'solar', 'transport', 'wsi']
 
-from weather import noaa, wsi
+from weather import transport, noaa, solar, wsi
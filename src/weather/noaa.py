@@ -16,8 +16,9 @@ __all__ = ['fetch', 'fetch_history']
 
 import datetime
 import json
-from urllib.request import Request, urlopen, urljoin
-from urllib.parse import urlencode
+from urllib.parse import urlencode, urljoin
+
+from weather import transport
 
 API_TOKEN = None  # Set to a string containing a valid token
 
@@ -42,6 +43,8 @@ def fetch(endpoint, safe=':,', **parameters):
 
     Raises:
         ValueError: when no API token is set.
+        urllib.error.HTTPError: when the request fails (transient failures are
+                                retried first, see `weather.transport`).
     """
     if API_TOKEN is None:
         raise ValueError('no API token found')
@@ -57,10 +60,8 @@ def fetch(endpoint, safe=':,', **parameters):
             parameters[key] = str(value)
 
     url = urljoin(BASE_URL, endpoint) + '?' + urlencode(parameters, safe=safe)
-    request = Request(url, headers={'token': API_TOKEN})
-
-    response = urlopen(request)
-    return json.loads(response.read().decode('utf-8'))
+    response = transport.DEFAULT.request(url, headers={'token': API_TOKEN})
+    return json.loads(response.decode('utf-8'))
 
 
 def fetch_history(date, bounds, *datatypes):
@@ -0,0 +1,171 @@
+"""
+weather.solar -- Offline solar position and daylight calculations
+
+Unlike the other submodules, this one needs no network access: the position of
+the sun is a deterministic function of the time and place, so sunrise, sunset,
+the duration of daylight, and clear-sky irradiance are computed directly. Every
+function accepts NumPy arrays (or scalars) and broadcasts over them, so whole
+tables of incidents can be processed at once.
+
+Times are treated as UTC. Since the incident times in the database are local,
+results that depend on the time of day (like `zenith`) are only approximate,
+but the duration of daylight depends on the date alone and is unaffected.
+
+The solar position uses NOAA's general solar position equations, which are
+accurate to within a few minutes for sunrise and sunset between the polar
+circles. Clear-sky irradiance uses the Haurwitz model.
+
+Sources:
+  - https://gml.noaa.gov/grad/solcalc/solareqns.PDF
+  - Haurwitz, B. (1945). Insolation in relation to cloudiness and cloud
+    density. Journal of Meteorology, 2, 154-166.
+"""
+
+__all__ = ['declination', 'equation_of_time', 'zenith', 'sunrise_sunset',
+           'daylight', 'clear_sky_irradiance']
+
+import numpy as np
+
+HORIZON = np.radians(90.833)  # Zenith at sunrise (refraction and solar disk)
+
+
+def _fractional_year(datetimes):
+    """ Convert times to the fractional year (in radians) and minutes (UTC). """
+    datetimes = np.asarray(datetimes, dtype='datetime64[s]')
+    days = datetimes.astype('datetime64[D]')
+    years = datetimes.astype('datetime64[Y]')
+    day_of_year = (days - years).astype(np.float64)
+    minutes = (datetimes - days).astype(np.float64)/60
+
+    leap = (years.astype(np.int64) + 1970) % 4 == 0  # Good until 2100
+    days_in_year = np.where(leap, 366, 365)
+    gamma = 2*np.pi/days_in_year*(day_of_year + (minutes/60 - 12)/24)
+    return gamma, minutes
+
+
+def declination(datetimes):
+    """
+    Compute the solar declination.
+
+    Arguments:
+        datetimes: An array of `numpy.datetime64` values or `datetime` objects.
+
+    Returns:
+        An array of declinations in radians.
+    """
+    gamma, _ = _fractional_year(datetimes)
+    return (0.006918 - 0.399912*np.cos(gamma) + 0.070257*np.sin(gamma)
+            - 0.006758*np.cos(2*gamma) + 0.000907*np.sin(2*gamma)
+            - 0.002697*np.cos(3*gamma) + 0.00148*np.sin(3*gamma))
+
+
+def equation_of_time(datetimes):
+    """
+    Compute the equation of time (apparent minus mean solar time).
+
+    Arguments:
+        datetimes: An array of `numpy.datetime64` values or `datetime` objects.
+
+    Returns:
+        An array of differences in minutes.
+    """
+    gamma, _ = _fractional_year(datetimes)
+    return 229.18*(0.000075 + 0.001868*np.cos(gamma) - 0.032077*np.sin(gamma)
+                   - 0.014615*np.cos(2*gamma) - 0.040849*np.sin(2*gamma))
+
+
+def zenith(datetimes, latitudes, longitudes):
+    """
+    Compute the solar zenith angle.
+
+    Arguments:
+        datetimes: An array of `numpy.datetime64` values or `datetime` objects
+                   in UTC.
+        latitudes: An array of latitudes in degrees.
+        longitudes: An array of longitudes in degrees (east is positive).
+
+    Returns:
+        An array of zenith angles in radians. Angles greater than pi/2 indicate
+        the sun is below the horizon.
+    """
+    _, minutes = _fractional_year(datetimes)
+    solar_time = minutes + equation_of_time(datetimes)
+    solar_time += 4*np.asarray(longitudes)
+    hour_angle = np.radians(solar_time/4 - 180)
+
+    latitudes, decl = np.radians(latitudes), declination(datetimes)
+    cos_zenith = (np.sin(latitudes)*np.sin(decl) +
+                  np.cos(latitudes)*np.cos(decl)*np.cos(hour_angle))
+    return np.arccos(np.clip(cos_zenith, -1, 1))
+
+
+def _hour_angle(dates, latitudes):
+    """ Compute the hour angle of sunrise (in degrees) on the given dates. """
+    noon = np.asarray(dates, dtype='datetime64[D]') + np.timedelta64(12, 'h')
+    latitudes, decl = np.radians(latitudes), declination(noon)
+    cos_hour_angle = (np.cos(HORIZON)/(np.cos(latitudes)*np.cos(decl))
+                      - np.tan(latitudes)*np.tan(decl))
+    # The sun never sets (less than -1) or never rises (greater than 1)
+    return np.degrees(np.arccos(np.clip(cos_hour_angle, -1, 1))), noon
+
+
+def sunrise_sunset(dates, latitudes, longitudes):
+    """
+    Compute the times of sunrise and sunset.
+
+    Arguments:
+        dates: An array of dates (`numpy.datetime64` values or `datetime`
+               objects, of which only the date is used).
+        latitudes: An array of latitudes in degrees.
+        longitudes: An array of longitudes in degrees (east is positive).
+
+    Returns:
+        A tuple of two arrays of `numpy.datetime64` values in UTC. During polar
+        day or night, sunrise and sunset both fall on solar noon (with a full
+        day between them during polar day).
+    """
+    hour_angle, noon = _hour_angle(dates, latitudes)
+    solar_noon = 720 - 4*np.asarray(longitudes) - equation_of_time(noon)
+    days = noon.astype('datetime64[D]')
+    to_datetime = lambda minutes: days + np.round(
+        minutes*60).astype(np.int64).astype('timedelta64[s]')
+    return (to_datetime(solar_noon - 4*hour_angle),
+            to_datetime(solar_noon + 4*hour_angle))
+
+
+def daylight(dates, latitudes):
+    """
+    Compute the duration of daylight.
+
+    Arguments:
+        dates: An array of dates (`numpy.datetime64` values or `datetime`
+               objects, of which only the date is used).
+        latitudes: An array of latitudes in degrees.
+
+    Returns:
+        An array of durations as `numpy.timedelta64` values (in seconds).
+    """
+    hour_angle, _ = _hour_angle(dates, latitudes)
+    seconds = np.round(8*hour_angle*60).astype(np.int64)
+    return seconds.astype('timedelta64[s]')
+
+
+def clear_sky_irradiance(datetimes, latitudes, longitudes):
+    """
+    Estimate the global horizontal irradiance under a cloudless sky.
+
+    Arguments:
+        datetimes: An array of `numpy.datetime64` values or `datetime` objects
+                   in UTC.
+        latitudes: An array of latitudes in degrees.
+        longitudes: An array of longitudes in degrees (east is positive).
+
+    Returns:
+        An array of irradiances in W/m^2 (zero while the sun is down).
+    """
+    cos_zenith = np.cos(zenith(datetimes, latitudes, longitudes))
+    gamma, _ = _fractional_year(datetimes)
+    distance = 1 + 0.033*np.cos(gamma)  # Inverse square of Earth-Sun distance
+    with np.errstate(divide='ignore', over='ignore', invalid='ignore'):
+        irradiance = 1098*distance*cos_zenith*np.exp(-0.059/cos_zenith)
+    return np.where(cos_zenith > 0, irradiance, 0.0)
@@ -0,0 +1,231 @@
+"""
+weather.transport -- Shared HTTP transport for the weather APIs
+
+Every weather client sends its requests through a `Transport`, which keeps one
+persistent connection per host (per thread), asks for gzip-compressed
+responses, and retries transient failures (HTTP 429 and 5xx responses, as well
+as dropped connections) with exponential backoff. When a server sends a
+`Retry-After` header, the transport waits as long as the server asks instead.
+
+The clients use whatever transport `DEFAULT` refers to at the time of the
+request, so a differently configured transport (or one pointed at a local test
+server) can be swapped in by assigning to `weather.transport.DEFAULT`.
+"""
+
+__all__ = ['Transport', 'DEFAULT']
+
+import collections
+import datetime
+import email.utils
+import gzip
+import http.client
+import logging
+import threading
+import time
+from urllib.error import HTTPError
+from urllib.parse import urlsplit, urlunsplit
+import zlib
+
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+Measurement = collections.namedtuple('Measurement', ['host', 'status',
+                                                     'attempts', 'seconds'])
+
+
+class Transport:
+    """
+    An HTTP client with connection reuse, compression, and retries.
+
+    Attributes:
+        retries: The maximum number of times to retry a failed request.
+        backoff: The delay in seconds before the first retry. The delay doubles
+                 after every subsequent failure.
+        max_delay: The greatest delay in seconds between two attempts,
+                   including delays requested with `Retry-After`.
+        timeout: The socket timeout in seconds.
+        measurements: A bounded sequence of `Measurement` tuples, one for each
+                      completed request, holding the latency (including any
+                      retries) in seconds.
+        sleep: The function used to wait between attempts (replaceable in
+               tests).
+    """
+    def __init__(self, retries=5, backoff=1, max_delay=120, timeout=60,
+                 history=10000, sleep=time.sleep):
+        self.retries, self.backoff = retries, backoff
+        self.max_delay, self.timeout = max_delay, timeout
+        self.measurements = collections.deque(maxlen=history)
+        self.sleep = sleep
+        self.local = threading.local()
+
+    def connect(self, scheme, netloc):
+        """
+        Get a persistent connection to a host, opening one if necessary.
+
+        Connections are not shared between threads.
+
+        Arguments:
+            scheme: Either `'http'` or `'https'`.
+            netloc: The host (and port, if any) to connect to.
+
+        Returns:
+            An `http.client.HTTPConnection` instance.
+        """
+        if not hasattr(self.local, 'connections'):
+            self.local.connections = {}
+
+        key = scheme, netloc
+        if key not in self.local.connections:
+            if scheme == 'https':
+                connection = http.client.HTTPSConnection(netloc,
+                                                         timeout=self.timeout)
+            else:
+                connection = http.client.HTTPConnection(netloc,
+                                                        timeout=self.timeout)
+            self.local.connections[key] = connection
+        return self.local.connections[key]
+
+    def disconnect(self, scheme, netloc):
+        """ Close and forget the current thread's connection to a host. """
+        connections = getattr(self.local, 'connections', {})
+        connection = connections.pop((scheme, netloc), None)
+        if connection is not None:
+            connection.close()
+
+    def close(self):
+        """
+        Close all of the current thread's connections.
+
+        Threads that are about to exit (for instance, the workers that run
+        update tasks) should call this so their sockets are released.
+        """
+        for scheme, netloc in list(getattr(self.local, 'connections', {})):
+            self.disconnect(scheme, netloc)
+
+    def delay(self, attempt, headers=None):
+        """
+        Determine how long to wait before retrying.
+
+        Arguments:
+            attempt: The number of attempts made so far (at least one).
+            headers: The headers of the failed response, if there was one.
+
+        Returns:
+            The delay in seconds. A `Retry-After` header holding a number of
+            seconds or an HTTP date takes precedence over exponential backoff.
+            Dates without a timezone are read as UTC, and values that cannot
+            be parsed are ignored.
+        """
+        retry_after = headers.get('Retry-After') if headers else None
+        if retry_after is not None:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                try:
+                    date = email.utils.parsedate_to_datetime(retry_after)
+                    if date.tzinfo is None:
+                        date = date.replace(tzinfo=datetime.timezone.utc)
+                    delay = date.timestamp() - time.time()
+                except (TypeError, ValueError, IndexError):
+                    delay = None
+            if delay is not None:
+                return min(max(delay, 0), self.max_delay)
+        return min(self.backoff*2**(attempt - 1), self.max_delay)
+
+    def request(self, url, headers=None):
+        """
+        Send a `GET` request, retrying transient failures.
+
+        Arguments:
+            url: The absolute URL to request.
+            headers: A dictionary of additional request headers.
+
+        Returns:
+            The (decompressed) body of the response as bytes.
+
+        Raises:
+            urllib.error.HTTPError: when the server responds with an error that
+                                    is not transient, or keeps responding with
+                                    transient errors after every retry.
+            OSError: when the connection keeps failing after every retry.
+        """
+        logger = logging.getLogger()
+        parts = urlsplit(url)
+        path = urlunsplit(('', '', parts.path or '/', parts.query, ''))
+        headers = dict(headers or {})
+        headers.setdefault('Accept-Encoding', 'gzip')
+
+        start, attempt = time.perf_counter(), 0
+        while True:
+            attempt += 1
+            connection = self.connect(parts.scheme, parts.netloc)
+            reused = connection.sock is not None
+            try:
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+            except (OSError, http.client.HTTPException) as error:
+                self.disconnect(parts.scheme, parts.netloc)
+                if reused:  # The server closed an idle connection
+                    attempt -= 1
+                    continue
+                if attempt > self.retries:
+                    raise
+                delay = self.delay(attempt)
+                logger.warning('{} ({}), retrying in {:.1f} s'.format(
+                               parts.netloc, error, delay))
+                self.sleep(delay)
+                continue
+
+            if response.getheader('Connection', '').lower() == 'close':
+                self.disconnect(parts.scheme, parts.netloc)
+
+            if response.status in RETRY_STATUSES and attempt <= self.retries:
+                delay = self.delay(attempt, response.headers)
+                logger.warning('{} responded {}, retrying in {:.1f} s'.format(
+                               parts.netloc, response.status, delay))
+                self.sleep(delay)
+                continue
+            break
+
+        seconds = time.perf_counter() - start
+        self.measurements.append(Measurement(parts.netloc, response.status,
+                                             attempt, seconds))
+        logger.debug('GET {} ({}, {} attempts, {:.3f} s)'.format(
+                     parts.netloc, response.status, attempt, seconds))
+
+        if response.status >= 400:
+            raise HTTPError(url, response.status, response.reason,
+                            response.headers, None)
+
+        encoding = response.getheader('Content-Encoding', '').lower()
+        if encoding == 'gzip':
+            body = gzip.decompress(body)
+        elif encoding == 'deflate':
+            body = zlib.decompress(body)
+        return body
+
+    def summarize(self):
+        """
+        Summarize the latencies of the recorded requests.
+
+        Returns:
+            A dictionary with the number of requests, the number of retries,
+            and the mean, median, 99th percentile, and maximum latency in
+            seconds (or `None` when nothing has been recorded).
+        """
+        latencies = sorted(measurement.seconds
+                           for measurement in self.measurements)
+        summary = {'requests': len(latencies),
+                   'retries': sum(measurement.attempts - 1
+                                  for measurement in self.measurements)}
+        if len(latencies) == 0:
+            summary.update(mean=None, p50=None, p99=None, max=None)
+        else:
+            percentile = lambda q: latencies[int(q*(len(latencies) - 1))]
+            summary.update(mean=sum(latencies)/len(latencies),
+                           p50=percentile(0.5), p99=percentile(0.99),
+                           max=latencies[-1])
+        return summary
+
+
+DEFAULT = Transport()
@@ -11,10 +11,11 @@ import csv
 import datetime
 import io
 import json
-from urllib.request import urlopen
 from urllib.parse import urlencode
 import xml.etree.ElementTree
 
+from weather import transport
+
 BASE_URL = 'http://cleanedobservations.wsi.com/CleanedObs.svc/GetObs'
 
 DEFAULT_PARAMETERS = {
@@ -45,6 +46,8 @@ def fetch_history(safe=':,', **parameters):
     Raises:
         ValueError: when the reponse format is unrecognizable (valid options
                     are JSON, CSV, and XML).
+        urllib.error.HTTPError: when the request fails (transient failures are
+                                retried first, see `weather.transport`).
     """
     default = dict(DEFAULT_PARAMETERS)
     default.update(parameters)
@@ -61,8 +64,7 @@ def fetch_history(safe=':,', **parameters):
             parameters[key] = str(value)
 
     url = BASE_URL + '?' + urlencode(parameters, safe=safe)
-    response = urlopen(url)
-    text = response.read().decode('utf-8')
+    text = transport.DEFAULT.request(url).decode('utf-8')
 
     form = parameters.get('format', None)
     if form == 'json':